@@ -0,0 +1,38 @@
+"""
+Add the cold-storage stub columns (archived_at, archive_ref) to the messages
+and payment_logs tables of an existing database.
+Usage: python add_archive_columns.py
+"""
+import sys
+import os
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import inspect
+from app.database import engine
+from app.archive import ARCHIVE_TARGETS
+
+STUB_COLUMNS = ["archived_at", "archive_ref"]
+
+
+def main():
+    inspector = inspect(engine)
+    added = 0
+    for table, (model, _) in ARCHIVE_TARGETS.items():
+        existing = {col["name"] for col in inspector.get_columns(table)}
+        for name in STUB_COLUMNS:
+            if name in existing:
+                continue
+            col_type = model.__table__.c[name].type.compile(dialect=engine.dialect)
+            print(f"Adding column {table}.{name}")
+            with engine.begin() as conn:
+                conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {name} {col_type}")
+            added += 1
+            print(f"  ✓ {name} added")
+
+    print(f"\nDone! {added} column(s) added.")
+
+
+if __name__ == "__main__":
+    main()
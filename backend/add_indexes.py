@@ -0,0 +1,97 @@
+"""
+Create any index declared on the models that is missing from the database.
+create_all() only creates indexes together with new tables, so run this after
+deploying a release that adds indexes to existing tables.
+Usage: python add_indexes.py
+On PostgreSQL indexes are built CONCURRENTLY so writes are not blocked. For
+partitioned tables (messages) the index is created on the parent only, built
+concurrently on each partition and then attached. On SQLite the datetime()
+sort indexes used by keyset pagination are created as well.
+"""
+import sys
+import os
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateIndex
+from app.database import engine, Base
+from app.pagination import create_sqlite_sort_indexes
+from app.partitioning import is_partitioned
+from app import models  # noqa: F401 - registers the tables on Base.metadata
+
+
+def create_concurrently(ddl: str):
+    ddl = ddl.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY IF NOT EXISTS", 1)
+    ddl = ddl.replace("CREATE UNIQUE INDEX", "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS", 1)
+    # CONCURRENTLY cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql(ddl)
+
+
+def create_partitioned_index(index):
+    """CREATE INDEX ... ON ONLY parent, then build and attach it per partition"""
+    table = index.table.name
+    ddl = str(CreateIndex(index).compile(dialect=engine.dialect))
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            ddl.replace(f" ON {table} ", f" ON ONLY {table} ", 1)
+            .replace("INDEX ", "INDEX IF NOT EXISTS ", 1)
+        )
+        partitions = conn.execute(
+            text("SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = to_regclass(:table)"),
+            {"table": table}
+        ).scalars().all()
+
+    for partition in partitions:
+        with engine.connect() as conn:
+            # Partitions created after the parent index already have a copy of it
+            attached = conn.execute(text(
+                "SELECT 1 FROM pg_inherits i JOIN pg_index x ON x.indexrelid = i.inhrelid "
+                "WHERE i.inhparent = to_regclass(:index) AND x.indrelid = to_regclass(:partition)"
+            ), {"index": index.name, "partition": partition}).scalar()
+        if attached:
+            continue
+        child = f"{partition}_{index.name.removeprefix('ix_')}"[:63]
+        create_concurrently(
+            ddl.replace(f"INDEX {index.name} ON {table} ", f"INDEX {child} ON {partition} ", 1)
+        )
+        with engine.begin() as conn:
+            conn.exec_driver_sql(f"ALTER INDEX {index.name} ATTACH PARTITION {child}")
+
+
+def main():
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    is_postgres = engine.dialect.name == "postgresql"
+    with engine.connect() as conn:
+        partitioned = {name for name in existing_tables if is_partitioned(conn, name)}
+
+    created = 0
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue  # create_all() will build the table with its indexes
+
+        existing = {ix["name"] for ix in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+
+            print(f"Creating index {index.name} on {table.name}...")
+            if is_postgres and table.name in partitioned:
+                create_partitioned_index(index)
+            elif is_postgres:
+                create_concurrently(str(CreateIndex(index).compile(dialect=engine.dialect)))
+            else:
+                index.create(bind=engine, checkfirst=True)
+            created += 1
+            print(f"  ✓ {index.name} created")
+
+    create_sqlite_sort_indexes(engine)
+
+    print(f"\nDone! {created} index(es) created.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Add users.phone_e164 (normalised phone, see app/phones.py) to an existing
+database, backfill it from users.phone and create its unique index.
+
+Numbers shared by several users (e.g. 8700762648 and +918700762648) keep
+phone_e164 on one of them only: the active, portal-enabled user, else the
+oldest. The others are listed so they can be fixed by hand.
+
+Usage: python add_phone_e164.py
+"""
+import sys
+import os
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateIndex
+from app.database import engine
+from app.models import User
+from app.phones import normalize_phone
+
+BATCH_SIZE = 1000
+
+
+def main():
+    existing = {col["name"] for col in inspect(engine).get_columns("users")}
+    if "phone_e164" not in existing:
+        col_type = User.__table__.c.phone_e164.type.compile(dialect=engine.dialect)
+        print("Adding column users.phone_e164")
+        with engine.begin() as conn:
+            conn.exec_driver_sql(f"ALTER TABLE users ADD COLUMN phone_e164 {col_type}")
+
+    with engine.connect() as conn:
+        rows = conn.execute(text(
+            "SELECT id, phone, phone_e164 FROM users WHERE phone IS NOT NULL "
+            "ORDER BY (CASE WHEN is_active AND portal_enabled THEN 0 ELSE 1 END), id"
+        )).all()
+
+    owners = {}
+    duplicates = []
+    updates = []
+    for user_id, phone, current in rows:
+        phone_e164 = normalize_phone(phone)
+        if phone_e164 in owners:
+            duplicates.append((user_id, phone, owners[phone_e164]))
+            phone_e164 = None
+        elif phone_e164:
+            owners[phone_e164] = user_id
+        if phone_e164 != current:
+            updates.append({"id": user_id, "phone_e164": phone_e164})
+
+    # Clear first so a row losing its number never collides with the new owner
+    for start in range(0, len(updates), BATCH_SIZE):
+        batch = updates[start:start + BATCH_SIZE]
+        with engine.begin() as conn:
+            conn.execute(text("UPDATE users SET phone_e164 = NULL WHERE id = :id"), batch)
+    for start in range(0, len(updates), BATCH_SIZE):
+        batch = [u for u in updates[start:start + BATCH_SIZE] if u["phone_e164"]]
+        if batch:
+            with engine.begin() as conn:
+                conn.execute(text("UPDATE users SET phone_e164 = :phone_e164 WHERE id = :id"), batch)
+    print(f"Backfilled {len(updates)} user(s)")
+
+    index = next(ix for ix in User.__table__.indexes if ix.name == "ix_users_phone_e164")
+    ddl = str(CreateIndex(index).compile(dialect=engine.dialect))
+    if engine.dialect.name == "postgresql":
+        ddl = ddl.replace("CREATE UNIQUE INDEX", "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS", 1)
+        # CONCURRENTLY cannot run inside a transaction block
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.exec_driver_sql(ddl)
+    else:
+        with engine.begin() as conn:
+            conn.exec_driver_sql(ddl.replace("CREATE UNIQUE INDEX", "CREATE UNIQUE INDEX IF NOT EXISTS", 1))
+    print(f"Index {index.name} ready")
+
+    if duplicates:
+        print(f"\n{len(duplicates)} user(s) share a phone number with another user (phone_e164 left empty):")
+        for user_id, phone, owner_id in duplicates:
+            print(f"  user {user_id} ({phone}) duplicates user {owner_id}")
+
+    print("\nDone!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Cold storage for old message bodies and payment log payloads.
+
+Rows older than ARCHIVE_AFTER_DAYS are written, complete, to compressed JSONL
+files (zstd when the zstandard package is installed, gzip otherwise) in a local
+directory or an S3 bucket (ARCHIVE_URL). The row itself stays in the database
+as a stub: the bulky column (Message.message_content, PaymentLog.raw_data) is
+cleared and archived_at / archive_ref record where it went. Listings, totals
+and counters keep working off the stub; detail endpoints read the value back
+with archived_field().
+"""
+import gzip
+import json
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Optional
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.orm import Session
+from . import models
+from .config import settings
+
+try:
+    import zstandard
+except ImportError:  # gzip fallback
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Table name -> (model, column moved to the archive)
+ARCHIVE_TARGETS = {
+    "messages": (models.Message, "message_content"),
+    "payment_logs": (models.PaymentLog, "raw_data"),
+}
+
+
+class LocalArchiveStore:
+    def __init__(self, root: str):
+        self.root = root
+
+    def put(self, key: str, data: bytes):
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get(self, key: str) -> bytes:
+        with open(os.path.join(self.root, key), "rb") as f:
+            return f.read()
+
+
+class S3ArchiveStore:
+    def __init__(self, bucket: str, prefix: str):
+        import boto3  # only needed for s3:// archives
+        self.client = boto3.client("s3")
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def put(self, key: str, data: bytes):
+        self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=data)
+
+    def get(self, key: str) -> bytes:
+        return self.client.get_object(Bucket=self.bucket, Key=self._key(key))["Body"].read()
+
+
+@lru_cache(maxsize=1)
+def get_store():
+    """Store for ARCHIVE_URL: s3://bucket/prefix or a local directory"""
+    url = settings.ARCHIVE_URL
+    if url.startswith("s3://"):
+        bucket, _, prefix = url[len("s3://"):].partition("/")
+        return S3ArchiveStore(bucket, prefix)
+    return LocalArchiveStore(url.removeprefix("file://"))
+
+
+def _compress(data: bytes):
+    """Returns (compressed bytes, file extension)"""
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=10).compress(data), ".jsonl.zst"
+    return gzip.compress(data), ".jsonl.gz"
+
+
+def _decompress(key: str, data: bytes) -> bytes:
+    if key.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read .zst archives")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def _row_to_dict(row) -> dict:
+    return {
+        column.name: value.isoformat() if isinstance(value, datetime) else value
+        for column in row.__table__.columns
+        for value in [getattr(row, column.key)]
+    }
+
+
+def archive_rows(db: Session, table: str, older_than_days: Optional[int] = None,
+                 batch_size: int = 5000, dry_run: bool = False) -> dict:
+    """
+    Archive rows of table created more than older_than_days ago, one file per
+    batch. Each batch is uploaded before its rows are stubbed, so an
+    interrupted run only leaves an unreferenced file behind.
+    """
+    model, field = ARCHIVE_TARGETS[table]
+    column = getattr(model, field)
+    if older_than_days is None:
+        older_than_days = settings.ARCHIVE_AFTER_DAYS
+    cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+
+    query = (
+        select(model)
+        .where(model.created_at < cutoff, model.archived_at.is_(None), column.isnot(None))
+        .order_by(model.created_at, model.id)
+        .limit(batch_size)
+    )
+    report = {"table": table, "rows": 0, "files": 0, "bytes_raw": 0, "bytes_stored": 0}
+    store = get_store()
+    last = None  # (created_at, id) of the previous batch's last row
+
+    while True:
+        batch_query = query
+        if last is not None:
+            # Keyset past the previous batch (dry runs leave those rows in place)
+            batch_query = query.where(or_(
+                model.created_at > last[0],
+                and_(model.created_at == last[0], model.id > last[1])
+            ))
+        rows = db.execute(batch_query).scalars().all()
+        if not rows:
+            break
+        last = (rows[-1].created_at, rows[-1].id)
+
+        body = "\n".join(json.dumps(_row_to_dict(row), default=str) for row in rows).encode()
+        data, extension = _compress(body)
+        first = rows[0]
+        key = f"{table}/{first.created_at:%Y/%m}/{table}-{first.id}-{rows[-1].id}{extension}"
+        ids = [row.id for row in rows]
+        db.expunge_all()  # keep the session small across batches
+
+        report["rows"] += len(ids)
+        report["files"] += 1
+        report["bytes_raw"] += len(body)
+        report["bytes_stored"] += len(data)
+        if dry_run:
+            continue
+
+        store.put(key, data)
+        db.execute(
+            update(model)
+            .where(model.id.in_(ids))
+            .values({field: None, "archived_at": datetime.now(timezone.utc), "archive_ref": key})
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        logger.info(f"Archived {len(ids)} {table} rows to {key}")
+
+    return report
+
+
+@lru_cache(maxsize=16)
+def _load_archive(key: str) -> dict:
+    """Archived rows of one file, by id"""
+    data = _decompress(key, get_store().get(key))
+    records = (json.loads(line) for line in data.decode().splitlines() if line)
+    return {record["id"]: record for record in records}
+
+
+def archived_field(row, field: str):
+    """Value of field, read back from the archive file when the row has been archived"""
+    value = getattr(row, field)
+    if value is not None or not row.archive_ref:
+        return value
+    try:
+        record = _load_archive(row.archive_ref).get(row.id)
+    except Exception as e:
+        logger.error(f"Could not read archive {row.archive_ref}: {e}")
+        return None
+    return record.get(field) if record else None
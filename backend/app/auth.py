@@ -4,9 +4,11 @@ from jose import JWTError, jwt
 import bcrypt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from .config import settings
-from .database import get_db
+from .database import get_db, get_async_db
 from . import models
 
 security = HTTPBearer()
@@ -40,29 +42,22 @@ def decode_token(token: str) -> Optional[dict]:
     except JWTError:
         return None
 
-async def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
-) -> models.User:
-    credentials_exception = HTTPException(
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
 
-    token = credentials.credentials
-    payload = decode_token(token)
-
-    if payload is None:
-        raise credentials_exception
+def _email_from_credentials(credentials: HTTPAuthorizationCredentials) -> str:
+    payload = decode_token(credentials.credentials)
+    if payload is None or payload.get("sub") is None:
+        raise _credentials_exception()
+    return payload["sub"]
 
-    email: str = payload.get("sub")
-    if email is None:
-        raise credentials_exception
-
-    user = db.query(models.User).filter(models.User.email == email).first()
+def _check_user(user: Optional[models.User]) -> models.User:
     if user is None:
-        raise credentials_exception
+        raise _credentials_exception()
 
     if not user.is_active:
         raise HTTPException(
@@ -72,6 +67,29 @@ async def get_current_user(
 
     return user
 
+def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: Session = Depends(get_db)
+) -> models.User:
+    # Plain def: the blocking query runs in the threadpool, not on the event loop
+    email = _email_from_credentials(credentials)
+    # Writes committed on this session count as the user's own (see database.get_read_db)
+    db.info["principal"] = email
+    user = db.query(models.User).filter(models.User.email == email).first()
+    return _check_user(user)
+
+async def get_current_user_async(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: AsyncSession = Depends(get_async_db)
+) -> models.User:
+    """get_current_user for async routes; the user is attached to the request's AsyncSession"""
+    email = _email_from_credentials(credentials)
+    db.info["principal"] = email
+    user = (await db.execute(
+        select(models.User).where(models.User.email == email)
+    )).scalars().first()
+    return _check_user(user)
+
 async def get_current_admin(
     current_user: models.User = Depends(get_current_user)
 ) -> models.User:
@@ -0,0 +1,129 @@
+"""
+Low balance alerts, once per threshold crossing.
+
+Debits used to email the customer whenever the balance was below
+LOW_BALANCE_THRESHOLD, so a sync of thousands of messages sent thousands of
+alerts. low_balance_alert_states records per user whether the balance is
+below the threshold and when the last alert went out:
+
+  - balance drops below the threshold -> alert (direction "down")
+  - still below                       -> nothing, or a reminder once
+                                         LOW_BALANCE_ALERT_COOLDOWN_HOURS passed
+  - balance back at/above it          -> re-armed (direction "up")
+
+The alert is claimed with a conditional UPDATE, so concurrent checks for one
+user send a single email, which goes out through the mail queue. Debit
+endpoints call schedule_low_balance_check (at most one check per user per
+request); credits call rearm_low_balance_alert in their own transaction.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Tuple
+from fastapi import BackgroundTasks
+from sqlalchemy import or_, update
+from sqlalchemy.orm import Session
+from . import models
+from .config import settings
+from .database import SessionLocal, insert_ignore
+from .email_utils import low_balance_alert_message
+from .mailer import enqueue
+
+
+def _create_states(db: Session, user_ids: Iterable[int]):
+    """Create missing state rows (not below threshold, never alerted)"""
+    rows = [{"user_id": user_id, "below_threshold": False} for user_id in user_ids]
+    if rows:
+        insert_ignore(db, models.LowBalanceAlertState, rows, ["user_id"])
+
+
+def _alert_due(now: datetime):
+    State = models.LowBalanceAlertState
+    due = State.below_threshold == False
+    if settings.LOW_BALANCE_ALERT_COOLDOWN_HOURS > 0:
+        cutoff = now - timedelta(hours=settings.LOW_BALANCE_ALERT_COOLDOWN_HOURS)
+        due = or_(due, State.last_alerted_at.is_(None), State.last_alerted_at <= cutoff)
+    return due
+
+
+def rearm_low_balance_alert(db: Session, user_id: int, balance: int):
+    """After a credit: the next drop below the threshold alerts again (caller commits)"""
+    if balance < settings.LOW_BALANCE_THRESHOLD:
+        return
+    db.execute(
+        update(models.LowBalanceAlertState)
+        .where(
+            models.LowBalanceAlertState.user_id == user_id,
+            models.LowBalanceAlertState.below_threshold == True
+        )
+        .values(below_threshold=False, direction="up")
+        .execution_options(synchronize_session=False)
+    )
+
+
+def check_low_balance(user_id: int) -> bool:
+    """Queue a low balance alert if one is due for this user; returns True if queued"""
+    db = SessionLocal()
+    try:
+        user = db.query(
+            models.User.id, models.User.email, models.User.name,
+            models.User.balance, models.User.company_name
+        ).filter(models.User.id == user_id).first()
+        if not user:
+            return False
+
+        if user.balance >= settings.LOW_BALANCE_THRESHOLD:
+            rearm_low_balance_alert(db, user.id, user.balance)
+            db.commit()
+            return False
+
+        now = datetime.now(timezone.utc)
+        _create_states(db, [user.id])
+        claimed = db.execute(
+            update(models.LowBalanceAlertState)
+            .where(models.LowBalanceAlertState.user_id == user.id, _alert_due(now))
+            .values(below_threshold=True, direction="down", last_alerted_at=now, last_alerted_balance=user.balance)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not claimed:
+            db.commit()
+            return False
+
+        # Commits the claim together with the queued email
+        enqueue(db, [{
+            "user_id": user.id,
+            **low_balance_alert_message(
+                user_email=user.email,
+                user_name=user.name,
+                balance_paise=user.balance,
+                company_name=user.company_name
+            )
+        }])
+        return True
+    finally:
+        db.close()
+
+
+def schedule_low_balance_check(background_tasks: BackgroundTasks, user_id: int):
+    """Check user_id after the response, once however many debits this request made"""
+    for task in background_tasks.tasks:
+        if task.func is check_low_balance and task.args == (user_id,):
+            return
+    background_tasks.add_task(check_low_balance, user_id)
+
+
+def record_alerts(db: Session, alerted: Iterable[Tuple[int, int]]):
+    """Record alerts sent outside the automatic check, as (user_id, balance) (caller commits)"""
+    now = datetime.now(timezone.utc)
+    rows = [
+        {
+            "user_id": user_id,
+            "below_threshold": True,
+            "direction": "down",
+            "last_alerted_at": now,
+            "last_alerted_balance": balance,
+        }
+        for user_id, balance in alerted
+    ]
+    if not rows:
+        return
+    _create_states(db, [row["user_id"] for row in rows])
+    db.execute(update(models.LowBalanceAlertState), rows)
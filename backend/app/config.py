@@ -7,9 +7,105 @@ class Settings:
         self.SECRET_KEY: str = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
         self.ALGORITHM: str = "HS256"
         self.ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 7  # 7 days
+        self.DEBUG: bool = os.getenv("DEBUG", "false").lower() == "true"
+
+        # Instrumentation: statements slower than this are logged; /metrics needs
+        # a bearer token, METRICS_API_KEY (for the scraper) or an admin's token
+        self.SLOW_STATEMENT_MS: int = int(os.getenv("SLOW_STATEMENT_MS", "500"))
+        self.METRICS_API_KEY: str = os.getenv("METRICS_API_KEY", "")
 
         # Database - supports both SQLite and PostgreSQL
         self.DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite:///./whatsapp_dashboard.db")
+        # Async routes use the same database through aiosqlite / asyncpg;
+        # set only to point them at a different URL
+        self.ASYNC_DATABASE_URL: str = os.getenv("ASYNC_DATABASE_URL", "")
+
+        # Read replica for reporting / listing endpoints (empty = use the primary).
+        # Reads fall back to the primary when the replica lags more than
+        # REPLICA_MAX_LAG_SECONDS, and for READ_YOUR_WRITES_SECONDS after a user's own write.
+        self.DATABASE_REPLICA_URL: str = os.getenv("DATABASE_REPLICA_URL", "")
+        self.REPLICA_MAX_LAG_SECONDS: float = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "10"))
+        self.REPLICA_LAG_CHECK_SECONDS: float = float(os.getenv("REPLICA_LAG_CHECK_SECONDS", "5"))
+        self.READ_YOUR_WRITES_SECONDS: float = float(os.getenv("READ_YOUR_WRITES_SECONDS", "30"))
+
+        # SQLite tuning: "performance" (WAL, synchronous=NORMAL, mmap), "durable"
+        # (WAL, synchronous=FULL) or "default" (plain SQLite settings)
+        self.SQLITE_PRAGMA_PROFILE: str = os.getenv("SQLITE_PRAGMA_PROFILE", "performance")
+        busy_timeout = os.getenv("SQLITE_BUSY_TIMEOUT_MS")
+        self.SQLITE_BUSY_TIMEOUT_MS: int = int(busy_timeout) if busy_timeout else None
+
+        # Connection pool (PostgreSQL, per worker process)
+        self.DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "5"))
+        self.DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+        self.DB_POOL_TIMEOUT: int = int(os.getenv("DB_POOL_TIMEOUT", "10"))  # seconds to wait for a connection
+        self.DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds, -1 disables
+        self.DB_POOL_PRE_PING: bool = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+        self.DB_STATEMENT_TIMEOUT_MS: int = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))  # 0 disables
+        self.DB_APPLICATION_NAME: str = os.getenv("DB_APPLICATION_NAME", "whatsapp-dashboard")
+        # Set when connecting through PgBouncer in transaction pooling mode:
+        # no startup options and no server-side prepared statements
+        self.DB_PGBOUNCER: bool = os.getenv("DB_PGBOUNCER", "false").lower() == "true"
+
+        # PostgreSQL messages partitioning: monthly partitions are kept created this
+        # many months ahead, checked at startup and every MESSAGE_PARTITION_CHECK_HOURS
+        self.MESSAGE_PARTITIONS_AHEAD: int = int(os.getenv("MESSAGE_PARTITIONS_AHEAD", "3"))
+        self.MESSAGE_PARTITION_CHECK_HOURS: float = float(os.getenv("MESSAGE_PARTITION_CHECK_HOURS", "24"))
+
+        # How long estimated listing totals (cached COUNT(*)) are reused
+        self.COUNT_CACHE_TTL_SECONDS: int = int(os.getenv("COUNT_CACHE_TTL_SECONDS", "60"))
+
+        # Cold storage for message bodies / payment log payloads older than
+        # ARCHIVE_AFTER_DAYS: a local directory or s3://bucket/prefix
+        self.ARCHIVE_URL: str = os.getenv("ARCHIVE_URL", "./archive")
+        self.ARCHIVE_AFTER_DAYS: int = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+
+        # Background message exports: files are written to EXPORT_DIR and removed
+        # EXPORT_RETENTION_HOURS after they are generated
+        self.EXPORT_DIR: str = os.getenv("EXPORT_DIR", "./exports")
+        self.EXPORT_RETENTION_HOURS: int = int(os.getenv("EXPORT_RETENTION_HOURS", "72"))
+
+        # Bulk invoice downloads: documents rendered in parallel per bundle,
+        # and the most invoices one bundle may contain
+        self.INVOICE_BUNDLE_WORKERS: int = int(os.getenv("INVOICE_BUNDLE_WORKERS", "4"))
+        self.INVOICE_BUNDLE_MAX: int = int(os.getenv("INVOICE_BUNDLE_MAX", "5000"))
+
+        # Razorpay webhook inbox: events are stored on receipt and processed by a
+        # background worker, retried with exponential backoff up to
+        # WEBHOOK_MAX_ATTEMPTS times
+        self.WEBHOOK_POLL_SECONDS: float = float(os.getenv("WEBHOOK_POLL_SECONDS", "5"))
+        self.WEBHOOK_MAX_ATTEMPTS: int = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))
+        self.WEBHOOK_RETRY_BASE_SECONDS: int = int(os.getenv("WEBHOOK_RETRY_BASE_SECONDS", "30"))
+
+        # Reconciliation of pending Razorpay orders: orders created in the last
+        # RECONCILE_WINDOW_HOURS are matched against Razorpay payments; unpaid ones
+        # older than RECONCILE_EXPIRE_HOURS are expired. Runs every
+        # RECONCILE_INTERVAL_MINUTES (0 = only on demand)
+        self.RECONCILE_WINDOW_HOURS: float = float(os.getenv("RECONCILE_WINDOW_HOURS", "72"))
+        self.RECONCILE_EXPIRE_HOURS: float = float(os.getenv("RECONCILE_EXPIRE_HOURS", "24"))
+        self.RECONCILE_INTERVAL_MINUTES: float = float(os.getenv("RECONCILE_INTERVAL_MINUTES", "60"))
+        self.RECONCILE_CONCURRENCY: int = int(os.getenv("RECONCILE_CONCURRENCY", "4"))
+
+        # Public portal phone lookups are cached per worker for this long
+        self.PORTAL_LOOKUP_CACHE_SECONDS: int = int(os.getenv("PORTAL_LOOKUP_CACHE_SECONDS", "60"))
+
+        # Public portal rate limits ("<requests>/<second|minute|hour|day>"), per
+        # client IP for all /payments/public/ endpoints, additionally per IP for
+        # create-order (a Razorpay call) and per phone number looked up.
+        # Counters are per process unless RATE_LIMIT_STORAGE_URL is a redis:// URL.
+        # RATE_LIMIT_TRUSTED_PROXIES is the number of proxies in front of the app
+        # that append to X-Forwarded-For (1 on Railway and behind our nginx); the
+        # client IP is taken that many entries from the right. 0 uses the socket peer
+        self.RATE_LIMIT_STORAGE_URL: str = os.getenv("RATE_LIMIT_STORAGE_URL", "memory://")
+        self.RATE_LIMIT_TRUSTED_PROXIES: int = int(os.getenv("RATE_LIMIT_TRUSTED_PROXIES", "1"))
+        self.PORTAL_RATE_LIMIT_IP: str = os.getenv("PORTAL_RATE_LIMIT_IP", "60/minute")
+        self.PORTAL_RATE_LIMIT_ORDER_IP: str = os.getenv("PORTAL_RATE_LIMIT_ORDER_IP", "10/minute")
+        self.PORTAL_RATE_LIMIT_PHONE: str = os.getenv("PORTAL_RATE_LIMIT_PHONE", "20/minute")
+
+        # Twilio template catalogue: refreshed in the background every
+        # TEMPLATE_REFRESH_MINUTES (0 disables), approval statuses fetched
+        # TEMPLATE_FETCH_CONCURRENCY at a time
+        self.TEMPLATE_REFRESH_MINUTES: int = int(os.getenv("TEMPLATE_REFRESH_MINUTES", "10"))
+        self.TEMPLATE_FETCH_CONCURRENCY: int = int(os.getenv("TEMPLATE_FETCH_CONCURRENCY", "8"))
 
         # Frontend URL for CORS
         self.FRONTEND_URL: str = os.getenv("FRONTEND_URL", "https://akashvanni.com")
@@ -37,7 +133,19 @@ class Settings:
         self.SMTP_PASSWORD: str = os.getenv("SMTP_PASSWORD", "")
         self.SMTP_FROM_NAME: str = os.getenv("SMTP_FROM_NAME", "Invoaice")
 
+        # Outbound mail queue: SMTP connections kept open (and sends in parallel),
+        # idle connections closed after MAIL_IDLE_SECONDS, failed sends retried
+        # with backoff up to MAIL_MAX_ATTEMPTS
+        self.MAIL_CONCURRENCY: int = int(os.getenv("MAIL_CONCURRENCY", "4"))
+        self.MAIL_IDLE_SECONDS: int = int(os.getenv("MAIL_IDLE_SECONDS", "60"))
+        self.MAIL_TIMEOUT_SECONDS: int = int(os.getenv("MAIL_TIMEOUT_SECONDS", "30"))
+        self.MAIL_MAX_ATTEMPTS: int = int(os.getenv("MAIL_MAX_ATTEMPTS", "3"))
+        self.MAIL_POLL_SECONDS: int = int(os.getenv("MAIL_POLL_SECONDS", "10"))
+
         # Low balance threshold (in paise - ₹200 = 20000 paise)
         self.LOW_BALANCE_THRESHOLD: int = int(os.getenv("LOW_BALANCE_THRESHOLD", "20000"))
+        # A user still below the threshold is reminded again after this many
+        # hours (0: only when the balance crosses below the threshold)
+        self.LOW_BALANCE_ALERT_COOLDOWN_HOURS: float = float(os.getenv("LOW_BALANCE_ALERT_COOLDOWN_HOURS", "24"))
 
 settings = Settings()
@@ -0,0 +1,215 @@
+"""
+Materialised per-tenant counters.
+
+Totals that never shrink (messages recorded, money spent, revenue) are kept in
+the tenant_counters table so dashboards read one row by primary key instead of
+scanning messages and transactions on every load.
+
+Counters are bumped from a session-level before_flush hook, so every code path
+that writes a Message or completes a Transaction updates them inside the same
+database transaction. Only the tenant's own row is touched: platform-wide
+totals are the SUM over all rows (platform_counter), so writers of different
+tenants never wait on a shared row lock.
+
+Rows are created by the first write of a tenant; seed_counters (run at
+startup) creates them for tenants whose data predates the counters.
+reconcile_counters() recomputes the totals from the source tables to detect
+(and optionally repair) drift. Reads never write: a tenant without a row gets
+totals computed on the fly.
+"""
+
+from typing import Collection, Dict, Optional
+from sqlalchemy import event, func, inspect, select, update
+from sqlalchemy.orm import Session
+from . import models
+from .database import insert_ignore
+
+COUNTER_FIELDS = ("messages_total", "spent_total", "revenue_total")
+
+
+def _is_completed(status) -> bool:
+    return status == models.TransactionStatus.COMPLETED
+
+
+def _transaction_delta(transaction: models.Transaction) -> dict:
+    """Counter fields affected by a completed transaction"""
+    if transaction.type == models.TransactionType.DEBIT:
+        return {"spent_total": transaction.amount or 0}
+    if transaction.type == models.TransactionType.CREDIT:
+        return {"revenue_total": transaction.amount or 0}
+    return {}
+
+
+def _add_delta(deltas: Dict[int, dict], tenant_id: Optional[int], changes: dict):
+    if tenant_id is None or not changes:
+        return
+    tenant_delta = deltas.setdefault(tenant_id, dict.fromkeys(COUNTER_FIELDS, 0))
+    for field, value in changes.items():
+        tenant_delta[field] += value
+
+
+def _status_became_completed(transaction: models.Transaction) -> bool:
+    history = inspect(transaction).attrs.status.history
+    if not history.added or not _is_completed(history.added[0]):
+        return False
+    # Ignore re-assignments of an already completed status
+    return not (history.deleted and _is_completed(history.deleted[0]))
+
+
+def compute_totals(db: Session, tenant_ids: Optional[Collection[int]] = None) -> Dict[int, dict]:
+    """
+    Recompute counter values from the source tables.
+    Returns {tenant_id: {field: value}}; if tenant_ids is given, only (and all of) those tenants.
+    """
+    totals: Dict[int, dict] = {}
+
+    def bucket(key):
+        return totals.setdefault(key, dict.fromkeys(COUNTER_FIELDS, 0))
+
+    message_query = db.query(models.Message.user_id, func.count(models.Message.id))
+    money_query = db.query(
+        models.Transaction.user_id,
+        models.Transaction.type,
+        func.sum(models.Transaction.amount)
+    ).filter(models.Transaction.status == models.TransactionStatus.COMPLETED)
+
+    if tenant_ids is not None:
+        message_query = message_query.filter(models.Message.user_id.in_(tenant_ids))
+        money_query = money_query.filter(models.Transaction.user_id.in_(tenant_ids))
+        for tenant_id in tenant_ids:
+            bucket(tenant_id)
+
+    for user_id, count in message_query.group_by(models.Message.user_id):
+        bucket(user_id)["messages_total"] += count
+
+    for user_id, txn_type, amount in money_query.group_by(
+        models.Transaction.user_id, models.Transaction.type
+    ):
+        if txn_type == models.TransactionType.DEBIT:
+            bucket(user_id)["spent_total"] += amount or 0
+        elif txn_type == models.TransactionType.CREDIT:
+            bucket(user_id)["revenue_total"] += amount or 0
+
+    return totals
+
+
+def _apply_delta(session: Session, tenant_id: int, delta: dict):
+    """Atomically increment a tenant's counters, seeding the row if it doesn't exist yet"""
+    table = models.TenantCounter
+    stmt = update(table).where(table.tenant_id == tenant_id).values(
+        **{field: getattr(table, field) + value for field, value in delta.items()}
+    ).execution_options(synchronize_session=False)
+
+    if session.execute(stmt).rowcount:
+        return
+
+    # First write for this tenant: seed from the already stored rows.
+    # Objects pending in this flush are not in the tables yet, so the delta still applies.
+    seed = compute_totals(session, [tenant_id])[tenant_id]
+    insert_ignore(session, models.TenantCounter, [{"tenant_id": tenant_id, **seed}], ["tenant_id"])
+    session.execute(stmt)
+
+
+@event.listens_for(Session, "before_flush")
+def _update_counters_before_flush(session, flush_context, instances):
+    deltas: Dict[int, dict] = {}
+
+    for obj in session.new:
+        if isinstance(obj, models.Message):
+            _add_delta(deltas, obj.user_id, {"messages_total": 1})
+        elif isinstance(obj, models.Transaction) and _is_completed(obj.status):
+            _add_delta(deltas, obj.user_id, _transaction_delta(obj))
+
+    for obj in session.dirty:
+        if isinstance(obj, models.Transaction) and _status_became_completed(obj):
+            _add_delta(deltas, obj.user_id, _transaction_delta(obj))
+
+    for tenant_id, delta in deltas.items():
+        delta = {field: value for field, value in delta.items() if value}
+        if delta:
+            _apply_delta(session, tenant_id, delta)
+
+
+def get_counter(db: Session, tenant_id: int) -> models.TenantCounter:
+    """
+    Get the counter row for a tenant (primary key read).
+    A tenant without a row yet gets its totals computed from the source
+    tables, returned unsaved (the row is created by its first write).
+    """
+    counter = db.get(models.TenantCounter, tenant_id)
+    if counter is None:
+        counter = models.TenantCounter(tenant_id=tenant_id, **compute_totals(db, [tenant_id])[tenant_id])
+    return counter
+
+
+def platform_counter(db: Session) -> models.TenantCounter:
+    """Platform-wide totals: the sum of every tenant's counters (unsaved)"""
+    table = models.TenantCounter
+    sums = db.query(
+        *[func.coalesce(func.sum(getattr(table, field)), 0) for field in COUNTER_FIELDS]
+    ).one()
+    return models.TenantCounter(**dict(zip(COUNTER_FIELDS, sums)))
+
+
+def seed_counters(db: Session) -> int:
+    """
+    Create the counter rows of users that have none yet, from the source tables,
+    so platform totals include tenants whose data predates the counters.
+    Returns how many rows were created.
+    """
+    missing = [
+        user_id for (user_id,) in db.query(models.User.id).filter(
+            models.User.id.not_in(select(models.TenantCounter.tenant_id))
+        )
+    ]
+    if not missing:
+        return 0
+
+    totals = compute_totals(db, missing)
+    for tenant_id in missing:
+        # Another worker starting at the same time may create it first
+        insert_ignore(db, models.TenantCounter, [{"tenant_id": tenant_id, **totals[tenant_id]}], ["tenant_id"])
+    db.commit()
+    return len(missing)
+
+
+def reconcile_counters(db: Session, fix: bool = False) -> dict:
+    """
+    Compare every counter row with totals recomputed from messages and transactions.
+
+    Returns a report listing drifted fields. With fix=True the stored counters
+    are overwritten with the recomputed values (missing rows are created).
+    """
+    actual = compute_totals(db)
+    stored = {c.tenant_id: c for c in db.query(models.TenantCounter).all()}
+
+    drift = []
+    for tenant_id in sorted(set(actual) | set(stored)):
+        expected = actual.get(tenant_id, dict.fromkeys(COUNTER_FIELDS, 0))
+        counter = stored.get(tenant_id)
+
+        for field in COUNTER_FIELDS:
+            current = getattr(counter, field) if counter else None
+            if current != expected[field]:
+                drift.append({
+                    "tenant_id": tenant_id,
+                    "field": field,
+                    "counter": current,
+                    "actual": expected[field]
+                })
+
+        if fix and counter is None:
+            db.add(models.TenantCounter(tenant_id=tenant_id, **expected))
+        elif fix:
+            for field in COUNTER_FIELDS:
+                setattr(counter, field, expected[field])
+
+    if fix and drift:
+        db.commit()
+
+    return {
+        "tenants_checked": len(set(actual) | set(stored)),
+        "drift_count": len(drift),
+        "drift": drift,
+        "fixed": fix and bool(drift)
+    }
@@ -1,20 +1,204 @@
-from sqlalchemy import create_engine
+import hashlib
+import hmac
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import List, Optional
+from fastapi import Request
+from sqlalchemy import create_engine, event, exc, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from .config import settings
 
-# Check if using SQLite or PostgreSQL
+logger = logging.getLogger(__name__)
+
+
+class _CheckoutTimingMixin:
+    """Records how long pool checkouts wait for a connection"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.timeouts += timed_out
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+
+
+class TimedQueuePool(_CheckoutTimingMixin, QueuePool):
+    """QueuePool that records how long checkouts wait for a connection"""
+
+
+class TimedAsyncQueuePool(_CheckoutTimingMixin, AsyncAdaptedQueuePool):
+    """Pool of the async engine, with the same checkout timing"""
+
+
+# SQLite pragma profiles, selected with SQLITE_PRAGMA_PROFILE.
+# WAL lets readers run alongside the (single) writer; busy_timeout makes a
+# writer wait for the lock instead of failing with "database is locked".
+SQLITE_PRAGMA_PROFILES = {
+    # Plain SQLite defaults (rollback journal, full database locks)
+    "default": {},
+    # WAL with full fsync on every commit
+    "durable": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "busy_timeout": 5000,
+    },
+    # WAL with fsync only at checkpoints: a power loss may drop the last
+    # commits but never corrupts the database
+    "performance": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "cache_size": -64000,  # KiB (64 MB)
+        "mmap_size": 268435456,  # 256 MB
+        "temp_store": "MEMORY",
+    },
+}
+
+
+def apply_sqlite_pragmas(dbapi_connection, profile: str):
+    """Run the PRAGMAs of a profile on a new SQLite connection"""
+    if profile not in SQLITE_PRAGMA_PROFILES:
+        raise ValueError(
+            f"Unknown SQLITE_PRAGMA_PROFILE '{profile}', expected one of {', '.join(SQLITE_PRAGMA_PROFILES)}"
+        )
+    pragmas = dict(SQLITE_PRAGMA_PROFILES[profile])
+    if settings.SQLITE_BUSY_TIMEOUT_MS is not None and "busy_timeout" in pragmas:
+        pragmas["busy_timeout"] = settings.SQLITE_BUSY_TIMEOUT_MS
+
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+def _postgres_pool_args(poolclass) -> dict:
+    # Every worker process gets its own pools (sync and async), so the server must
+    # allow workers * 2 * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections.
+    return {
+        "poolclass": poolclass,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        # Recycle before the server / load balancer reaps idle connections
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+        # Reuse the most recent connection so surplus ones go idle and get recycled
+        "pool_use_lifo": True,
+    }
+
+
+def _set_local_statement_timeout(target_engine):
+    # PgBouncer (transaction pooling) rejects startup options and shares
+    # server sessions, so the timeout is set per transaction instead
+    @event.listens_for(target_engine, "begin")
+    def _set_statement_timeout(conn):
+        conn.exec_driver_sql(f"SET LOCAL statement_timeout = {int(settings.DB_STATEMENT_TIMEOUT_MS)}")
+
+
+def async_database_url(url: str) -> str:
+    """The same database through its asyncio driver (aiosqlite / asyncpg)"""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend == "sqlite":
+        return url.set(drivername="sqlite+aiosqlite").render_as_string(hide_password=False)
+    if backend in ("postgresql", "postgres"):
+        # asyncpg takes "ssl" as a connect argument, not libpq's sslmode
+        return url.set(drivername="postgresql+asyncpg").difference_update_query(
+            ["sslmode"]
+        ).render_as_string(hide_password=False)
+    return url.render_as_string(hide_password=False)
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    apply_sqlite_pragmas(dbapi_connection, settings.SQLITE_PRAGMA_PROFILE)
+
+
+def _create_sync_engine(url: str, application_name: str):
+    if url.startswith("sqlite"):
+        sync_engine = create_engine(url, connect_args={"check_same_thread": False})
+        event.listen(sync_engine, "connect", _set_sqlite_pragmas)
+        return sync_engine
+
+    # PostgreSQL or other databases
+    connect_args = {"application_name": application_name}
+    if settings.DB_STATEMENT_TIMEOUT_MS and not settings.DB_PGBOUNCER:
+        connect_args["options"] = f"-c statement_timeout={settings.DB_STATEMENT_TIMEOUT_MS}"
+
+    sync_engine = create_engine(url, connect_args=connect_args, **_postgres_pool_args(TimedQueuePool))
+    if settings.DB_PGBOUNCER and settings.DB_STATEMENT_TIMEOUT_MS:
+        _set_local_statement_timeout(sync_engine)
+    return sync_engine
+
+
+engine = _create_sync_engine(settings.DATABASE_URL, settings.DB_APPLICATION_NAME)
+
+# Async engine for the same database
 if settings.DATABASE_URL.startswith("sqlite"):
-    engine = create_engine(
-        settings.DATABASE_URL,
-        connect_args={"check_same_thread": False}
-    )
+    async_engine = create_async_engine(settings.ASYNC_DATABASE_URL or async_database_url(settings.DATABASE_URL))
+    event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
 else:
-    # PostgreSQL or other databases
-    engine = create_engine(settings.DATABASE_URL)
+    # asyncpg: startup parameters go in server_settings
+    server_settings = {"application_name": settings.DB_APPLICATION_NAME}
+    if settings.DB_STATEMENT_TIMEOUT_MS and not settings.DB_PGBOUNCER:
+        server_settings["statement_timeout"] = str(settings.DB_STATEMENT_TIMEOUT_MS)
+    async_connect_args = {"server_settings": server_settings}
+
+    sslmode = make_url(settings.DATABASE_URL).query.get("sslmode")
+    if sslmode:
+        async_connect_args["ssl"] = sslmode
+
+    if settings.DB_PGBOUNCER:
+        # No server-side prepared statement caching: PgBouncer may hand the
+        # next transaction to a server connection that doesn't have them
+        async_connect_args["statement_cache_size"] = 0
+        async_connect_args["prepared_statement_name_func"] = lambda: f"__asyncpg_{uuid.uuid4()}__"
+
+    async_url = make_url(settings.ASYNC_DATABASE_URL or async_database_url(settings.DATABASE_URL))
+    if settings.DB_PGBOUNCER:
+        async_url = async_url.update_query_dict({"prepared_statement_cache_size": "0"})
+
+    async_engine = create_async_engine(
+        async_url,
+        connect_args=async_connect_args,
+        **_postgres_pool_args(TimedAsyncQueuePool)
+    )
+
+    if settings.DB_PGBOUNCER and settings.DB_STATEMENT_TIMEOUT_MS:
+        _set_local_statement_timeout(async_engine.sync_engine)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async sessions keep attributes loaded after commit: lazy refreshes would need
+# implicit (awaited) IO, so reload explicitly with `await db.refresh(obj)`
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 def get_db():
@@ -23,3 +207,255 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    """AsyncSession dependency for async def routes (doesn't block the event loop)"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def insert_ignore(session: Session, model, rows: List[dict], index_elements: List[str]):
+    """
+    INSERT rows into model's table, skipping those that conflict on index_elements
+    (e.g. created meanwhile by another transaction). Returns the result; its
+    rowcount is the number of rows inserted.
+    """
+    if session.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return session.execute(
+        insert(model).values(rows).on_conflict_do_nothing(index_elements=index_elements)
+    )
+
+
+# ========== Read replica ==========
+# Read-only reporting endpoints use get_read_db. Reads go to DATABASE_REPLICA_URL
+# when it is configured, reachable and lagging at most REPLICA_MAX_LAG_SECONDS;
+# otherwise (and for users who just wrote, or requests sending X-Read-Primary)
+# they go to the primary.
+#
+# "Just wrote" has to hold whichever worker serves the next read, so a request
+# that committed a write for a user gets a short-lived signed cookie
+# (READ_YOUR_WRITES_COOKIE, valid READ_YOUR_WRITES_SECONDS) naming that user;
+# _read_target honours it as well as this worker's own record of writes.
+
+READ_PRIMARY_HEADER = "X-Read-Primary"
+READ_YOUR_WRITES_COOKIE = "rw_until"
+
+# Set by read_your_writes_middleware for each request; record_write stores the
+# principal in it (a shared dict, so writes made in the threadpool are seen)
+_request_writes: ContextVar[Optional[dict]] = ContextVar("request_writes", default=None)
+
+if settings.DATABASE_REPLICA_URL:
+    replica_engine = _create_sync_engine(settings.DATABASE_REPLICA_URL, f"{settings.DB_APPLICATION_NAME}-replica")
+    ReplicaSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=replica_engine)
+else:
+    replica_engine = None
+    ReplicaSessionLocal = None
+
+# Seconds the replica is behind the primary (0 if caught up with what it received)
+_REPLICA_LAG_SQL = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+_replica_lock = threading.Lock()
+_replica_lag: Optional[float] = None
+_replica_checked_at = 0.0
+
+# Principal (JWT subject) -> monotonic time of its last committed write
+_RECENT_WRITES_SIZE = 10000
+_recent_writes: "OrderedDict[str, float]" = OrderedDict()
+_recent_writes_lock = threading.Lock()
+
+# (target, reason) -> count, exported by /metrics
+read_routing_counts = {}
+_routing_lock = threading.Lock()
+
+
+def replica_lag() -> Optional[float]:
+    """Replica lag in seconds, None if the replica is unreachable. Checked at most every REPLICA_LAG_CHECK_SECONDS."""
+    global _replica_lag, _replica_checked_at
+    if replica_engine is None:
+        return None
+
+    if time.monotonic() - _replica_checked_at < settings.REPLICA_LAG_CHECK_SECONDS:
+        return _replica_lag
+    # Only one thread probes; the others keep using the previous value meanwhile
+    if not _replica_lock.acquire(blocking=False):
+        return _replica_lag
+    try:
+        with replica_engine.connect() as conn:
+            if replica_engine.dialect.name == "postgresql":
+                _replica_lag = float(conn.execute(_REPLICA_LAG_SQL).scalar() or 0)
+            else:
+                conn.execute(text("SELECT 1"))
+                _replica_lag = 0.0
+    except Exception as e:
+        logger.warning(f"Read replica unavailable, reading from primary: {e}")
+        _replica_lag = None
+    finally:
+        _replica_checked_at = time.monotonic()
+        _replica_lock.release()
+    return _replica_lag
+
+
+def record_write(principal: str):
+    request_writes = _request_writes.get()
+    if request_writes is not None:
+        request_writes["principal"] = principal
+    with _recent_writes_lock:
+        _recent_writes[principal] = time.monotonic()
+        _recent_writes.move_to_end(principal)
+        while len(_recent_writes) > _RECENT_WRITES_SIZE:
+            _recent_writes.popitem(last=False)
+
+
+def wrote_recently(principal: str) -> bool:
+    """True if the principal committed a write within READ_YOUR_WRITES_SECONDS in this worker"""
+    with _recent_writes_lock:
+        written_at = _recent_writes.get(principal)
+    return written_at is not None and time.monotonic() - written_at < settings.READ_YOUR_WRITES_SECONDS
+
+
+# Sessions carry the authenticated principal in session.info["principal"]
+# (set by get_current_user); its committed writes are remembered so that its
+# next reads go to the primary.
+@event.listens_for(Session, "after_flush")
+def _flag_flush_write(session, flush_context):
+    session.info["wrote"] = True
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _flag_statement_write(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info["wrote"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _remember_write(session):
+    principal = session.info.get("principal")
+    if session.info.pop("wrote", False) and principal:
+        record_write(principal)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_write(session):
+    session.info.pop("wrote", None)
+
+
+def _request_principal(request: Request) -> Optional[str]:
+    from .auth import decode_token
+
+    authorization = request.headers.get("Authorization", "")
+    if not authorization.lower().startswith("bearer "):
+        return None
+    payload = decode_token(authorization[7:])
+    return payload.get("sub") if payload else None
+
+
+def _write_marker_signature(principal: str, until: int) -> str:
+    return hmac.new(
+        settings.SECRET_KEY.encode(), f"{principal}:{until}".encode(), hashlib.sha256
+    ).hexdigest()
+
+
+def _cookie_marks_write(request: Request, principal: str) -> bool:
+    """True if the request carries an unexpired read-your-writes cookie for principal"""
+    until, _, signature = request.cookies.get(READ_YOUR_WRITES_COOKIE, "").partition(".")
+    if not until.isdigit() or int(until) < time.time():
+        return False
+    return hmac.compare_digest(signature, _write_marker_signature(principal, int(until)))
+
+
+async def read_your_writes_middleware(request: Request, call_next):
+    """Set the read-your-writes cookie on responses to requests that committed a user's write"""
+    request_writes = {}
+    token = _request_writes.set(request_writes)
+    try:
+        response = await call_next(request)
+    finally:
+        _request_writes.reset(token)
+
+    principal = request_writes.get("principal")
+    if principal and ReplicaSessionLocal is not None:
+        max_age = int(settings.READ_YOUR_WRITES_SECONDS)
+        until = int(time.time()) + max_age
+        response.set_cookie(
+            READ_YOUR_WRITES_COOKIE,
+            f"{until}.{_write_marker_signature(principal, until)}",
+            max_age=max_age,
+            httponly=True,
+            samesite="lax",
+            secure=request.headers.get("x-forwarded-proto", request.url.scheme) == "https",
+        )
+    return response
+
+
+def _read_target(request: Request):
+    """("replica" | "primary", reason) for a read-only request"""
+    if ReplicaSessionLocal is None:
+        return "primary", "no_replica"
+    if request.headers.get(READ_PRIMARY_HEADER, "").lower() in ("1", "true", "yes"):
+        return "primary", "requested"
+    principal = _request_principal(request)
+    if principal and (wrote_recently(principal) or _cookie_marks_write(request, principal)):
+        return "primary", "read_your_writes"
+    lag = replica_lag()
+    if lag is None:
+        return "primary", "replica_unavailable"
+    if lag > settings.REPLICA_MAX_LAG_SECONDS:
+        return "primary", "replica_lagging"
+    return "replica", "ok"
+
+
+def open_read_session(request: Request) -> Session:
+    """Replica or primary session for a read-only request; the caller closes it"""
+    target, reason = _read_target(request)
+    with _routing_lock:
+        read_routing_counts[(target, reason)] = read_routing_counts.get((target, reason), 0) + 1
+
+    db = ReplicaSessionLocal() if target == "replica" else SessionLocal()
+    db.info["read_target"] = target
+    return db
+
+
+def get_read_db(request: Request):
+    """Session for read-only endpoints: the replica when it is safe to use, else the primary"""
+    db = open_read_session(request)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def pool_stats(bind=None) -> dict:
+    """Current connection pool usage of this worker process (sync engine by default)"""
+    pool = (bind or engine).pool
+    stats = {"pool_class": type(pool).__name__}
+
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "pool_size": pool.size(),
+            "max_overflow": pool._max_overflow,
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),
+        })
+
+    if isinstance(pool, _CheckoutTimingMixin):
+        with pool._stats_lock:
+            stats.update({
+                "checkouts": pool.checkouts,
+                "timeouts": pool.timeouts,
+                "wait_total_ms": round(pool.wait_total * 1000, 2),
+                "wait_avg_ms": round(pool.wait_total * 1000 / pool.checkouts, 3) if pool.checkouts else 0,
+                "wait_max_ms": round(pool.wait_max * 1000, 2),
+            })
+
+    return stats
@@ -1,26 +1,15 @@
 """
 Email utility module for sending alerts and notifications.
-Uses Hostinger SMTP server.
+Uses Hostinger SMTP server, through the connection pool in app/mailer.py.
 """
 
-import os
 import smtplib
 import logging
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 from typing import Optional
 
-logger = logging.getLogger(__name__)
-
-# Email configuration from environment variables
-SMTP_HOST = os.getenv("SMTP_HOST", "smtp.hostinger.com")
-SMTP_PORT = int(os.getenv("SMTP_PORT", "465"))
-SMTP_USER = os.getenv("SMTP_USER", "admin@invoaice.com")
-SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", "")
-SMTP_FROM_NAME = os.getenv("SMTP_FROM_NAME", "Invoaice")
+from .mailer import MailNotConfigured, send_message
 
-# Low balance threshold in paise (₹200 = 20000 paise)
-LOW_BALANCE_THRESHOLD = int(os.getenv("LOW_BALANCE_THRESHOLD", "20000"))
+logger = logging.getLogger(__name__)
 
 
 def send_email(
@@ -30,7 +19,8 @@ def send_email(
     text_content: Optional[str] = None
 ) -> bool:
     """
-    Send an email using Hostinger SMTP server.
+    Send an email right away over a pooled SMTP connection.
+    For bulk mail queue it instead (mailer.enqueue).
 
     Args:
         to_email: Recipient email address
@@ -41,34 +31,14 @@ def send_email(
     Returns:
         bool: True if email was sent successfully, False otherwise
     """
-    if not SMTP_PASSWORD:
-        logger.warning("SMTP_PASSWORD not configured. Email not sent.")
-        return False
-
     try:
-        # Create message
-        msg = MIMEMultipart("alternative")
-        msg["Subject"] = subject
-        msg["From"] = f"{SMTP_FROM_NAME} <{SMTP_USER}>"
-        msg["To"] = to_email
-
-        # Add plain text part
-        if text_content:
-            part1 = MIMEText(text_content, "plain")
-            msg.attach(part1)
-
-        # Add HTML part
-        part2 = MIMEText(html_content, "html")
-        msg.attach(part2)
-
-        # Connect to SMTP server using SSL
-        with smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT) as server:
-            server.login(SMTP_USER, SMTP_PASSWORD)
-            server.sendmail(SMTP_USER, to_email, msg.as_string())
-
+        send_message(to_email, subject, html_content, text_content)
         logger.info(f"Email sent successfully to {to_email}: {subject}")
         return True
 
+    except MailNotConfigured:
+        logger.warning("SMTP_PASSWORD not configured. Email not sent.")
+        return False
     except smtplib.SMTPAuthenticationError as e:
         logger.error(f"SMTP Authentication failed: {e}")
         return False
@@ -190,6 +160,18 @@ This is an automated message from Invoaice.
 """
 
 
+def low_balance_alert_message(user_email: str, user_name: str, balance_paise: int, company_name: Optional[str] = None) -> dict:
+    """Low balance alert as a mail queue message (see mailer.enqueue)"""
+    balance_rupees = balance_paise / 100
+
+    return {
+        "to_email": user_email,
+        "subject": f"⚠️ Low Balance Alert - Your wallet has ₹{balance_rupees:.2f} remaining",
+        "html_content": get_low_balance_email_html(user_name, balance_rupees, company_name),
+        "text_content": get_low_balance_email_text(user_name, balance_rupees, company_name),
+    }
+
+
 def send_low_balance_alert(user_email: str, user_name: str, balance_paise: int, company_name: Optional[str] = None) -> bool:
     """
     Send low balance alert email to user.
@@ -203,31 +185,6 @@ def send_low_balance_alert(user_email: str, user_name: str, balance_paise: int,
     Returns:
         bool: True if email was sent successfully
     """
-    balance_rupees = balance_paise / 100
-
-    subject = f"⚠️ Low Balance Alert - Your wallet has ₹{balance_rupees:.2f} remaining"
-    html_content = get_low_balance_email_html(user_name, balance_rupees, company_name)
-    text_content = get_low_balance_email_text(user_name, balance_rupees, company_name)
+    message = low_balance_alert_message(user_email, user_name, balance_paise, company_name)
+    return send_email(**message)
 
-    return send_email(user_email, subject, html_content, text_content)
-
-
-def check_and_send_low_balance_alert(user) -> bool:
-    """
-    Check if user's balance is below threshold and send alert if needed.
-    This should be called after any balance deduction.
-
-    Args:
-        user: User model instance with email, name, balance, and company_name
-
-    Returns:
-        bool: True if alert was sent, False otherwise
-    """
-    if user.balance < LOW_BALANCE_THRESHOLD:
-        return send_low_balance_alert(
-            user_email=user.email,
-            user_name=user.name,
-            balance_paise=user.balance,
-            company_name=user.company_name
-        )
-    return False
@@ -0,0 +1,368 @@
+"""
+Streaming exports (payment logs, message history).
+
+Rows are read through a server-side cursor (yield_per) and encoded chunk by
+chunk, so memory stays flat however large the export is. Direct downloads
+stream CSV / JSONL straight into a StreamingResponse; the stream owns its
+database session (replica or primary, as for other reads), opened when
+streaming starts and closed after the last row, so it does not depend on the
+request's dependency lifetime.
+
+Very large message exports run as background ExportJobs instead: the file
+(gzipped CSV / JSONL, or Parquet) is written to EXPORT_DIR and downloaded
+through the job's download link until it expires.
+"""
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import zlib
+from datetime import date, datetime, timedelta, timezone
+from typing import Callable, Iterable, Iterator, List, Optional
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import DateTime, Integer, select
+from sqlalchemy.orm import Session
+from . import models, schemas
+from .archive import archived_field
+from .config import settings
+from .database import SessionLocal, ReplicaSessionLocal, open_read_session, replica_lag
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet exports need pyarrow
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+# Rows fetched per round trip, and rows per chunk sent to the client
+EXPORT_FETCH_SIZE = 1000
+EXPORT_CHUNK_ROWS = 500
+
+PAYMENT_LOG_CSV_HEADER = [
+    "ID", "Event", "Source", "Razorpay Payment ID", "Razorpay Order ID", "User ID", "User Email",
+    "User Name", "Phone", "Company", "GST Number", "Total (Paise)", "Total (Rs)", "Subtotal", "GST",
+    "Credited", "Invoice Number", "New Balance", "Created At",
+]
+
+# Only the columns the CSV needs (raw_data stays in the database)
+PAYMENT_LOG_CSV_COLUMNS = [
+    models.PaymentLog.id, models.PaymentLog.event_type, models.PaymentLog.source,
+    models.PaymentLog.razorpay_payment_id, models.PaymentLog.razorpay_order_id,
+    models.PaymentLog.user_id, models.PaymentLog.user_email, models.PaymentLog.user_name,
+    models.PaymentLog.user_phone, models.PaymentLog.company_name, models.PaymentLog.gst_number,
+    models.PaymentLog.total_amount, models.PaymentLog.subtotal_amount, models.PaymentLog.gst_amount,
+    models.PaymentLog.credited_amount, models.PaymentLog.invoice_number, models.PaymentLog.new_balance,
+    models.PaymentLog.created_at,
+]
+
+# Message export columns (field name = column name); cost is in paise
+MESSAGE_EXPORT_COLUMNS = [
+    models.Message.id, models.Message.user_id, models.Message.recipient_phone,
+    models.Message.recipient_name, models.Message.message_type, models.Message.template_name,
+    models.Message.direction, models.Message.status, models.Message.whatsapp_message_id,
+    models.Message.cost, models.Message.error_message, models.Message.created_at,
+    models.Message.sent_at, models.Message.delivered_at, models.Message.read_at,
+]
+
+
+def csv_chunks(header: list, rows: Iterable[list]) -> Iterator[bytes]:
+    """Encode rows as CSV, EXPORT_CHUNK_ROWS rows per chunk"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count % EXPORT_CHUNK_ROWS == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, (datetime, date)) else str(value)
+
+
+def jsonl_chunks(fields: List[str], rows: Iterable[list]) -> Iterator[bytes]:
+    """Encode rows as JSON lines keyed by fields, EXPORT_CHUNK_ROWS rows per chunk"""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(fields, row)), default=_json_value))
+        if len(lines) == EXPORT_CHUNK_ROWS:
+            yield ("\n".join(lines) + "\n").encode()
+            lines = []
+    if lines:
+        yield ("\n".join(lines) + "\n").encode()
+
+
+def gzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _stream_rows(open_session: Callable[[], Session], query) -> Iterator:
+    """Rows of query through a server-side cursor, in a session of their own"""
+    db = open_session()
+    try:
+        # yield_per streams through a server-side cursor instead of buffering the result
+        yield from db.execute(query.execution_options(yield_per=EXPORT_FETCH_SIZE))
+    finally:
+        db.close()
+
+
+def _date_range(query, column, date_from: Optional[date], date_to: Optional[date]):
+    if date_from:
+        query = query.where(column >= date_from)
+    if date_to:
+        query = query.where(column < date_to + timedelta(days=1))
+    return query
+
+
+def _payment_log_rows(request: Request, date_from: Optional[date], date_to: Optional[date],
+                      user_id: Optional[int]) -> Iterator[list]:
+    query = select(*PAYMENT_LOG_CSV_COLUMNS).order_by(
+        models.PaymentLog.created_at.desc(), models.PaymentLog.id.desc()
+    )
+    query = _date_range(query, models.PaymentLog.created_at, date_from, date_to)
+    if user_id:
+        query = query.where(models.PaymentLog.user_id == user_id)
+
+    for log in _stream_rows(lambda: open_read_session(request), query):
+        yield [
+            log.id, log.event_type, log.source, log.razorpay_payment_id, log.razorpay_order_id,
+            log.user_id, log.user_email, log.user_name, log.user_phone, log.company_name,
+            log.gst_number, log.total_amount,
+            log.total_amount / 100 if log.total_amount else "",
+            log.subtotal_amount, log.gst_amount, log.credited_amount, log.invoice_number,
+            log.new_balance, log.created_at,
+        ]
+
+
+def payment_logs_csv_response(request: Request, date_from: Optional[date] = None,
+                              date_to: Optional[date] = None, user_id: Optional[int] = None,
+                              compress: bool = False) -> StreamingResponse:
+    """Stream payment logs (newest first) as CSV, optionally gzip-compressed"""
+    filename = "payment_logs"
+    if date_from or date_to:
+        filename += f"_{date_from or 'start'}_{date_to or 'now'}"
+
+    chunks = csv_chunks(PAYMENT_LOG_CSV_HEADER, _payment_log_rows(request, date_from, date_to, user_id))
+    if compress:
+        return StreamingResponse(
+            gzip_chunks(chunks),
+            media_type="application/gzip",
+            headers={"Content-Disposition": f"attachment; filename={filename}.csv.gz"}
+        )
+    return StreamingResponse(
+        chunks,
+        media_type="text/csv",
+        headers={"Content-Disposition": f"attachment; filename={filename}.csv"}
+    )
+
+
+# ========== Message exports ==========
+
+def message_export_columns(filters: schemas.MessageExportFilters) -> list:
+    columns = list(MESSAGE_EXPORT_COLUMNS)
+    if filters.include_content:
+        # archived_at tells an archived body from an empty one: direct downloads
+        # leave archived bodies empty, export jobs read them back (see archive.py)
+        columns += [models.Message.message_content, models.Message.archived_at]
+    return columns
+
+
+def message_export_query(filters: schemas.MessageExportFilters, columns: Optional[list] = None):
+    """Messages matching filters, oldest first (uses the (user_id, created_at, id) index)"""
+    query = select(*(columns or message_export_columns(filters))).order_by(
+        models.Message.created_at, models.Message.id
+    )
+    query = _date_range(query, models.Message.created_at, filters.date_from, filters.date_to)
+    if filters.user_id:
+        query = query.where(models.Message.user_id == filters.user_id)
+    if filters.status:
+        query = query.where(models.Message.status == filters.status)
+    if filters.template_name:
+        query = query.where(models.Message.template_name == filters.template_name)
+    return query
+
+
+def _export_filename(filters: schemas.MessageExportFilters) -> str:
+    filename = "messages"
+    if filters.user_id:
+        filename += f"_user{filters.user_id}"
+    if filters.date_from or filters.date_to:
+        filename += f"_{filters.date_from or 'start'}_{filters.date_to or 'now'}"
+    return filename
+
+
+def _encode(fmt: str, fields: List[str], rows: Iterable) -> Iterator[bytes]:
+    if fmt == schemas.ExportFormat.JSONL:
+        return jsonl_chunks(fields, rows)
+    return csv_chunks(fields, rows)
+
+
+def message_export_response(request: Request, filters: schemas.MessageExportFilters,
+                            fmt: str, compress: bool = False) -> StreamingResponse:
+    """Stream messages as CSV or JSON lines, optionally gzip-compressed"""
+    fields = [column.key for column in message_export_columns(filters)]
+    rows = _stream_rows(lambda: open_read_session(request), message_export_query(filters))
+    chunks = _encode(fmt, fields, rows)
+    media_type = "application/x-ndjson" if fmt == schemas.ExportFormat.JSONL else "text/csv"
+    filename = f"{_export_filename(filters)}.{fmt}"
+    if compress:
+        chunks = gzip_chunks(chunks)
+        media_type = "application/gzip"
+        filename += ".gz"
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+
+def _restore_archived_content(rows: Iterable, fields: List[str]) -> Iterator[list]:
+    """
+    Rows with archived message bodies read back from cold storage. Each row
+    carries archive_ref as an extra last column, which is dropped. Rows come
+    oldest first, in archive file order, so each file is fetched once.
+    """
+    position = fields.index("message_content")
+    for row in rows:
+        values = list(row[:-1])
+        if row.archive_ref:
+            values[position] = archived_field(row, "message_content")
+        yield values
+
+
+def _parquet_type(column):
+    if isinstance(column.type, Integer):
+        return pyarrow.int64()
+    if isinstance(column.type, DateTime):
+        return pyarrow.timestamp("us", tz="UTC")
+    return pyarrow.string()
+
+
+def write_parquet(path: str, columns: list, rows: Iterable) -> int:
+    """Write rows to a Parquet file, one row group per EXPORT_FETCH_SIZE rows"""
+    schema = pyarrow.schema([(column.key, _parquet_type(column)) for column in columns])
+    count = 0
+    with pyarrow.parquet.ParquetWriter(path, schema, compression="zstd") as writer:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == EXPORT_FETCH_SIZE:
+                writer.write_table(pyarrow.Table.from_pylist([dict(zip(schema.names, r)) for r in batch], schema=schema))
+                count += len(batch)
+                batch = []
+        if batch:
+            writer.write_table(pyarrow.Table.from_pylist([dict(zip(schema.names, r)) for r in batch], schema=schema))
+            count += len(batch)
+    return count
+
+
+def _export_read_session() -> Session:
+    """Background exports read from the replica when it is caught up"""
+    if ReplicaSessionLocal is not None:
+        lag = replica_lag()
+        if lag is not None and lag <= settings.REPLICA_MAX_LAG_SECONDS:
+            return ReplicaSessionLocal()
+    return SessionLocal()
+
+
+def export_job_response(job: models.ExportJob) -> schemas.ExportJobResponse:
+    response = schemas.ExportJobResponse.model_validate(job)
+    if job.status == "completed":
+        response.download_url = f"/exports/jobs/{job.id}/download"
+    return response
+
+
+class _RowCounter:
+    """Iterator wrapper counting the rows that pass through"""
+    def __init__(self, rows: Iterable):
+        self.rows = iter(rows)
+        self.count = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = next(self.rows)
+        self.count += 1
+        return row
+
+
+def run_message_export_job(job_id: int):
+    """Generate the file of an ExportJob (runs as a background task)"""
+    db = SessionLocal()
+    try:
+        job = db.get(models.ExportJob, job_id)
+        job.status = "running"
+        db.commit()
+
+        filters = schemas.MessageExportFilters.model_validate_json(job.filters)
+        columns = message_export_columns(filters)
+        if filters.include_content:
+            query = message_export_query(filters, columns + [models.Message.archive_ref])
+            rows = _restore_archived_content(
+                _stream_rows(_export_read_session, query), [c.key for c in columns]
+            )
+        else:
+            rows = _stream_rows(_export_read_session, message_export_query(filters))
+        os.makedirs(settings.EXPORT_DIR, exist_ok=True)
+
+        if job.format == schemas.ExportFormat.PARQUET:
+            path = os.path.join(settings.EXPORT_DIR, f"messages-{job.id}.parquet")
+            count = write_parquet(path, columns, rows)
+        else:
+            path = os.path.join(settings.EXPORT_DIR, f"messages-{job.id}.{job.format}.gz")
+            counted = _RowCounter(rows)
+            with gzip.open(path, "wb") as f:
+                for chunk in _encode(job.format, [c.key for c in columns], counted):
+                    f.write(chunk)
+            count = counted.count
+
+        job.status = "completed"
+        job.row_count = count
+        job.file_path = path
+        job.file_size = os.path.getsize(path)
+        job.completed_at = datetime.now(timezone.utc)
+        job.expires_at = job.completed_at + timedelta(hours=settings.EXPORT_RETENTION_HOURS)
+        db.commit()
+        logger.info(f"Export job {job.id}: {count} rows written to {path}")
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Export job {job_id} failed: {e}")
+        job = db.get(models.ExportJob, job_id)
+        if job:
+            job.status = "failed"
+            job.error = str(e)
+            db.commit()
+    finally:
+        db.close()
+
+
+def purge_expired_exports(db: Session) -> int:
+    """Delete the files of expired export jobs; returns how many were purged"""
+    expired = db.query(models.ExportJob).filter(
+        models.ExportJob.status == "completed",
+        models.ExportJob.expires_at < datetime.now(timezone.utc)
+    ).all()
+    for job in expired:
+        if job.file_path and os.path.exists(job.file_path):
+            os.remove(job.file_path)
+        job.status = "expired"
+        job.file_path = None
+    if expired:
+        db.commit()
+    return len(expired)
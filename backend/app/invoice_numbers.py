@@ -0,0 +1,63 @@
+"""
+Invoice number allocation.
+
+Numbers look like TZ-2025-0001 and come from one counter row per prefix and
+year (invoice_sequences). Allocation is a single UPDATE ... RETURNING on that
+row, so it costs the same however many invoices exist, and the row lock it
+takes is held until the payment's transaction ends: concurrent payments queue
+for the next number instead of minting the same one. A rolled-back payment
+rolls its increment back too, so the sequence has no gaps.
+
+Callers must allocate inside the transaction that inserts the invoice and
+commit (or roll back) promptly, since later allocations wait on the lock.
+"""
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from . import models
+from .database import insert_ignore
+from .invoices import get_company
+
+DEFAULT_INVOICE_PREFIX = "TZ"
+
+
+def _highest_issued(db: Session, prefix: str, year: int) -> int:
+    """Highest number already used for prefix/year (seeds a new counter row once)"""
+    numbers = db.query(models.Invoice.invoice_number).filter(
+        models.Invoice.invoice_number.like(f"{prefix}-{year}-%")
+    )
+    highest = 0
+    for (invoice_number,) in numbers:
+        suffix = invoice_number.rsplit("-", 1)[-1]
+        if suffix.isdigit():
+            highest = max(highest, int(suffix))
+    return highest
+
+
+def next_invoice_number(db: Session, prefix: Optional[str] = None, year: Optional[int] = None) -> str:
+    """Allocate the next invoice number like TZ-2024-0001 in db's current transaction"""
+    if prefix is None:
+        prefix = get_company(db).get("invoice_prefix") or DEFAULT_INVOICE_PREFIX
+    if year is None:
+        year = datetime.now().year
+
+    allocate = (
+        update(models.InvoiceSequence)
+        .where(models.InvoiceSequence.prefix == prefix, models.InvoiceSequence.year == year)
+        .values(last_value=models.InvoiceSequence.last_value + 1)
+        .returning(models.InvoiceSequence.last_value)
+        .execution_options(synchronize_session=False)
+    )
+    value = db.execute(allocate).scalar()
+    if value is None:
+        # First invoice of the year (or of a new prefix): continue after any
+        # numbers issued before the counter existed
+        insert_ignore(
+            db, models.InvoiceSequence,
+            [{"prefix": prefix, "year": year, "last_value": _highest_issued(db, prefix, year)}],
+            ["prefix", "year"]
+        )
+        value = db.execute(allocate).scalar_one()
+
+    return f"{prefix}-{year}-{str(value).zfill(4)}"
@@ -0,0 +1,583 @@
+"""
+Invoice rendering service.
+
+Invoices are immutable once issued, so each one is rendered once, as HTML and
+as a PDF, and stored in invoice_renders keyed by invoice id and company
+version (a hash of the company details and the template version). Downloads
+serve the stored document with an ETag / Last-Modified and answer conditional
+requests with 304. When the company details change, renders made with the old
+details are regenerated (in bulk in the background, or lazily on download).
+
+Bulk downloads (invoice_bundle_response) stream a zip of many invoices: the
+documents are fetched / rendered on a small thread pool and written into the
+zip one at a time as they complete, so the archive is never held in memory.
+"""
+import csv
+import hashlib
+import html
+import io
+import json
+import logging
+import threading
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Iterator, Optional
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from . import models
+from .config import settings
+from .database import SessionLocal
+
+try:
+    from fpdf import FPDF
+except ImportError:  # PDF rendering needs fpdf2
+    FPDF = None
+
+logger = logging.getLogger(__name__)
+
+# Bump when the invoice layout changes so existing renders are regenerated
+TEMPLATE_VERSION = 1
+
+COMPANY_FIELDS = [
+    "company_name", "legal_name", "gst_number", "address", "city", "state", "pincode",
+    "email", "phone", "bank_name", "bank_account", "bank_ifsc", "invoice_prefix",
+]
+
+# Used when no company_config row exists
+DEFAULT_COMPANY = {
+    "company_name": "TWOZERO",
+    "legal_name": "MAHESH",
+    "gst_number": "07ATPPM6940D1ZG",
+    "address": "First Floor, A-784, G. D. Colony, Mayur Vihar, Phase - 3, East Delhi, Delhi, 110096",
+}
+
+# Company details are read on every download; cache them per worker
+COMPANY_CACHE_SECONDS = 60
+_company_cache = {"company": None, "expires": 0.0}
+_company_lock = threading.Lock()
+
+
+def get_company(db: Session) -> dict:
+    """Company details used on invoices (cached for COMPANY_CACHE_SECONDS)"""
+    with _company_lock:
+        if _company_cache["company"] is not None and time.monotonic() < _company_cache["expires"]:
+            return _company_cache["company"]
+
+    row = db.query(models.CompanyConfig).first()
+    if row:
+        company = {field: getattr(row, field) for field in COMPANY_FIELDS}
+    else:
+        company = {field: DEFAULT_COMPANY.get(field) for field in COMPANY_FIELDS}
+
+    with _company_lock:
+        _company_cache["company"] = company
+        _company_cache["expires"] = time.monotonic() + COMPANY_CACHE_SECONDS
+    return company
+
+
+def invalidate_company_cache():
+    with _company_lock:
+        _company_cache["company"] = None
+
+
+def company_version(company: dict) -> str:
+    payload = json.dumps([TEMPLATE_VERSION, company], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def esc(value) -> str:
+    return html.escape(str(value)) if value is not None else ""
+
+
+def invoice_date(invoice: models.Invoice) -> str:
+    return (invoice.payment_date or invoice.created_at).strftime('%d %b %Y')
+
+
+def render_invoice_html(invoice: models.Invoice, company: dict) -> str:
+    """Printable HTML invoice"""
+    return f"""
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <meta charset="UTF-8">
+        <title>Invoice {esc(invoice.invoice_number)}</title>
+        <style>
+            body {{ font-family: Arial, sans-serif; margin: 40px; color: #333; }}
+            .header {{ display: flex; justify-content: space-between; border-bottom: 2px solid #2563eb; padding-bottom: 20px; margin-bottom: 30px; }}
+            .company-name {{ font-size: 24px; font-weight: bold; color: #2563eb; }}
+            .invoice-title {{ font-size: 28px; color: #666; }}
+            .invoice-number {{ font-size: 14px; color: #666; }}
+            .section {{ margin-bottom: 30px; }}
+            .section-title {{ font-weight: bold; color: #2563eb; margin-bottom: 10px; border-bottom: 1px solid #ddd; padding-bottom: 5px; }}
+            .details-grid {{ display: grid; grid-template-columns: 1fr 1fr; gap: 20px; }}
+            .detail-item {{ margin-bottom: 8px; }}
+            .detail-label {{ color: #666; font-size: 12px; }}
+            .detail-value {{ font-weight: 500; }}
+            table {{ width: 100%; border-collapse: collapse; margin-top: 10px; }}
+            th, td {{ padding: 12px; text-align: left; border-bottom: 1px solid #ddd; }}
+            th {{ background: #f8f9fa; font-weight: 600; }}
+            .amount-row {{ font-weight: bold; }}
+            .total-row {{ background: #2563eb; color: white; }}
+            .total-row td {{ border: none; }}
+            .footer {{ margin-top: 40px; padding-top: 20px; border-top: 1px solid #ddd; font-size: 12px; color: #666; }}
+            .text-right {{ text-align: right; }}
+            @media print {{
+                body {{ margin: 20px; }}
+                .no-print {{ display: none; }}
+            }}
+        </style>
+    </head>
+    <body>
+        <div class="header">
+            <div>
+                <div class="company-name">{esc(company['company_name'])}</div>
+                <div style="font-size: 12px; color: #666; margin-top: 5px;">{esc(company['legal_name'])}</div>
+                <div style="font-size: 12px; color: #666;">GSTIN: {esc(company['gst_number'])}</div>
+                <div style="font-size: 11px; color: #888; max-width: 300px; margin-top: 5px;">{esc(company['address'])}</div>
+            </div>
+            <div class="text-right">
+                <div class="invoice-title">TAX INVOICE</div>
+                <div class="invoice-number">#{esc(invoice.invoice_number)}</div>
+                <div style="font-size: 12px; color: #666; margin-top: 10px;">
+                    Date: {invoice_date(invoice)}
+                </div>
+            </div>
+        </div>
+
+        <div class="section">
+            <div class="section-title">Bill To</div>
+            <div class="details-grid">
+                <div>
+                    <div class="detail-item">
+                        <div class="detail-label">Name</div>
+                        <div class="detail-value">{esc(invoice.customer_company or invoice.customer_name)}</div>
+                    </div>
+                    <div class="detail-item">
+                        <div class="detail-label">Email</div>
+                        <div class="detail-value">{esc(invoice.customer_email)}</div>
+                    </div>
+                </div>
+                <div>
+                    {f'<div class="detail-item"><div class="detail-label">GSTIN</div><div class="detail-value">{esc(invoice.customer_gst)}</div></div>' if invoice.customer_gst else ''}
+                    {f'<div class="detail-item"><div class="detail-label">Address</div><div class="detail-value">{esc(invoice.customer_address)}</div></div>' if invoice.customer_address else ''}
+                </div>
+            </div>
+        </div>
+
+        <div class="section">
+            <div class="section-title">Invoice Details</div>
+            <table>
+                <thead>
+                    <tr>
+                        <th>Description</th>
+                        <th>SAC Code</th>
+                        <th class="text-right">Amount</th>
+                    </tr>
+                </thead>
+                <tbody>
+                    <tr>
+                        <td>WhatsApp Messaging Service - Wallet Recharge</td>
+                        <td>998319</td>
+                        <td class="text-right">₹{invoice.subtotal / 100:.2f}</td>
+                    </tr>
+                    <tr>
+                        <td colspan="2">CGST @ 9%</td>
+                        <td class="text-right">₹{invoice.cgst_amount / 100:.2f}</td>
+                    </tr>
+                    <tr>
+                        <td colspan="2">SGST @ 9%</td>
+                        <td class="text-right">₹{invoice.sgst_amount / 100:.2f}</td>
+                    </tr>
+                    <tr class="total-row">
+                        <td colspan="2"><strong>Total Amount</strong></td>
+                        <td class="text-right"><strong>₹{invoice.total_amount / 100:.2f}</strong></td>
+                    </tr>
+                </tbody>
+            </table>
+        </div>
+
+        <div class="section">
+            <div class="section-title">Payment Details</div>
+            <div class="details-grid">
+                <div>
+                    <div class="detail-item">
+                        <div class="detail-label">Payment Method</div>
+                        <div class="detail-value">Online (Razorpay)</div>
+                    </div>
+                    <div class="detail-item">
+                        <div class="detail-label">Payment ID</div>
+                        <div class="detail-value">{esc(invoice.razorpay_payment_id or 'N/A')}</div>
+                    </div>
+                </div>
+                <div>
+                    <div class="detail-item">
+                        <div class="detail-label">Status</div>
+                        <div class="detail-value" style="color: #16a34a; font-weight: bold;">PAID</div>
+                    </div>
+                    <div class="detail-item">
+                        <div class="detail-label">Wallet Credit</div>
+                        <div class="detail-value">₹{invoice.credited_amount / 100:.2f}</div>
+                    </div>
+                </div>
+            </div>
+        </div>
+
+        <div class="footer">
+            <p>This is a computer-generated invoice and does not require a signature.</p>
+            <p>For any queries, please contact us at support@twozero.in</p>
+        </div>
+
+        <div class="no-print" style="margin-top: 30px; text-align: center;">
+            <button onclick="window.print()" style="background: #2563eb; color: white; border: none; padding: 12px 24px; border-radius: 8px; cursor: pointer; font-size: 16px;">
+                Print / Save as PDF
+            </button>
+        </div>
+    </body>
+    </html>
+    """
+
+
+def _pdf_text(value) -> str:
+    # Built-in PDF fonts are Latin-1 only
+    return str(value or "").replace("₹", "Rs. ").encode("latin-1", "replace").decode("latin-1")
+
+
+def render_invoice_pdf(invoice: models.Invoice, company: dict) -> Optional[bytes]:
+    """PDF invoice with the same content as the HTML one (None without fpdf2)"""
+    if FPDF is None:
+        return None
+
+    pdf = FPDF(format="A4")
+    pdf.set_title(_pdf_text(f"Invoice {invoice.invoice_number}"))
+    pdf.set_auto_page_break(auto=True, margin=15)
+    pdf.add_page()
+    width = pdf.w - pdf.l_margin - pdf.r_margin
+
+    # Header: company on the left, invoice number on the right
+    top = pdf.get_y()
+    pdf.set_font("Helvetica", "B", 18)
+    pdf.set_text_color(37, 99, 235)
+    pdf.cell(width / 2, 9, _pdf_text(company["company_name"]), new_x="LMARGIN", new_y="NEXT")
+    pdf.set_font("Helvetica", "", 9)
+    pdf.set_text_color(102, 102, 102)
+    pdf.cell(width / 2, 5, _pdf_text(company["legal_name"]), new_x="LMARGIN", new_y="NEXT")
+    pdf.cell(width / 2, 5, _pdf_text(f"GSTIN: {company['gst_number']}"), new_x="LMARGIN", new_y="NEXT")
+    pdf.multi_cell(width / 2, 4.5, _pdf_text(company["address"]), new_x="LMARGIN", new_y="NEXT")
+    bottom = pdf.get_y()
+
+    pdf.set_xy(pdf.l_margin + width / 2, top)
+    pdf.set_font("Helvetica", "", 20)
+    pdf.cell(width / 2, 9, "TAX INVOICE", align="R", new_x="LEFT", new_y="NEXT")
+    pdf.set_font("Helvetica", "", 10)
+    pdf.cell(width / 2, 6, _pdf_text(f"#{invoice.invoice_number}"), align="R", new_x="LEFT", new_y="NEXT")
+    pdf.cell(width / 2, 6, f"Date: {invoice_date(invoice)}", align="R")
+    pdf.set_y(max(bottom, pdf.get_y()) + 4)
+    pdf.set_draw_color(37, 99, 235)
+    pdf.line(pdf.l_margin, pdf.get_y(), pdf.l_margin + width, pdf.get_y())
+    pdf.ln(6)
+
+    def section(title):
+        pdf.set_font("Helvetica", "B", 11)
+        pdf.set_text_color(37, 99, 235)
+        pdf.cell(width, 7, title, new_x="LMARGIN", new_y="NEXT")
+        pdf.set_text_color(51, 51, 51)
+
+    def detail(label, value):
+        pdf.set_font("Helvetica", "", 8)
+        pdf.set_text_color(102, 102, 102)
+        pdf.cell(width, 4, label, new_x="LMARGIN", new_y="NEXT")
+        pdf.set_font("Helvetica", "", 10)
+        pdf.set_text_color(51, 51, 51)
+        pdf.multi_cell(width, 5, _pdf_text(value), new_x="LMARGIN", new_y="NEXT")
+        pdf.ln(1)
+
+    section("Bill To")
+    detail("Name", invoice.customer_company or invoice.customer_name)
+    detail("Email", invoice.customer_email)
+    if invoice.customer_gst:
+        detail("GSTIN", invoice.customer_gst)
+    if invoice.customer_address:
+        detail("Address", invoice.customer_address)
+    pdf.ln(4)
+
+    section("Invoice Details")
+    columns = (width * 0.6, width * 0.15, width * 0.25)
+    pdf.set_font("Helvetica", "B", 10)
+    pdf.set_fill_color(248, 249, 250)
+    for text, col_width, align in zip(("Description", "SAC Code", "Amount"), columns, "LLR"):
+        pdf.cell(col_width, 8, text, border="B", align=align, fill=True)
+    pdf.ln()
+    pdf.set_font("Helvetica", "", 10)
+    rows = [
+        ("WhatsApp Messaging Service - Wallet Recharge", "998319", invoice.subtotal),
+        ("CGST @ 9%", "", invoice.cgst_amount),
+        ("SGST @ 9%", "", invoice.sgst_amount),
+    ]
+    for description, sac, amount in rows:
+        pdf.cell(columns[0], 8, description, border="B")
+        pdf.cell(columns[1], 8, sac, border="B")
+        pdf.cell(columns[2], 8, f"Rs. {(amount or 0) / 100:.2f}", border="B", align="R")
+        pdf.ln()
+    pdf.set_font("Helvetica", "B", 10)
+    pdf.set_fill_color(37, 99, 235)
+    pdf.set_text_color(255, 255, 255)
+    pdf.cell(columns[0] + columns[1], 9, "Total Amount", fill=True)
+    pdf.cell(columns[2], 9, f"Rs. {invoice.total_amount / 100:.2f}", align="R", fill=True)
+    pdf.ln(14)
+    pdf.set_text_color(51, 51, 51)
+
+    section("Payment Details")
+    detail("Payment Method", "Online (Razorpay)")
+    detail("Payment ID", invoice.razorpay_payment_id or "N/A")
+    detail("Status", "PAID")
+    detail("Wallet Credit", f"Rs. {invoice.credited_amount / 100:.2f}")
+
+    pdf.ln(8)
+    pdf.set_font("Helvetica", "", 8)
+    pdf.set_text_color(102, 102, 102)
+    pdf.cell(width, 5, "This is a computer-generated invoice and does not require a signature.",
+             new_x="LMARGIN", new_y="NEXT")
+    pdf.cell(width, 5, "For any queries, please contact us at support@twozero.in")
+    return bytes(pdf.output())
+
+
+def render_invoice(db: Session, invoice: models.Invoice) -> models.InvoiceRender:
+    """Stored render of invoice for the current company details, rendering it if missing or stale"""
+    company = get_company(db)
+    version = company_version(company)
+    render = db.query(models.InvoiceRender).filter(models.InvoiceRender.invoice_id == invoice.id).first()
+    if render and render.company_version == version:
+        return render
+
+    if render is None:
+        render = models.InvoiceRender(invoice_id=invoice.id)
+        db.add(render)
+    render.company_version = version
+    render.html = render_invoice_html(invoice, company)
+    render.pdf = render_invoice_pdf(invoice, company)
+    render.rendered_at = datetime.now(timezone.utc)
+    try:
+        db.commit()
+    except IntegrityError:
+        # Rendered concurrently by another request; use that one
+        db.rollback()
+        render = db.query(models.InvoiceRender).filter(models.InvoiceRender.invoice_id == invoice.id).one()
+    return render
+
+
+def prerender_invoice(invoice_id: int):
+    """Render a newly issued invoice (background task)"""
+    db = SessionLocal()
+    try:
+        invoice = db.get(models.Invoice, invoice_id)
+        if invoice:
+            render_invoice(db, invoice)
+    except Exception as e:
+        logger.error(f"Could not render invoice {invoice_id}: {e}")
+    finally:
+        db.close()
+
+
+def regenerate_invoices(batch_size: int = 200) -> int:
+    """Re-render every invoice whose stored render is missing or stale; returns how many"""
+    invalidate_company_cache()
+    db = SessionLocal()
+    try:
+        version = company_version(get_company(db))
+        count = 0
+        last_id = 0
+        while True:
+            invoices = db.query(models.Invoice).outerjoin(
+                models.InvoiceRender, models.InvoiceRender.invoice_id == models.Invoice.id
+            ).filter(
+                models.Invoice.id > last_id,
+                (models.InvoiceRender.id.is_(None)) | (models.InvoiceRender.company_version != version)
+            ).order_by(models.Invoice.id).limit(batch_size).all()
+            if not invoices:
+                break
+            for invoice in invoices:
+                render_invoice(db, invoice)
+                count += 1
+            last_id = invoices[-1].id
+            db.expunge_all()
+        logger.info(f"Regenerated {count} invoice render(s)")
+        return count
+    finally:
+        db.close()
+
+
+def _as_utc(value: datetime) -> datetime:
+    # SQLite returns naive datetimes (stored in UTC)
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def invoice_download_response(db: Session, invoice: models.Invoice, fmt: str, request: Request) -> Response:
+    """Stored invoice document with ETag / Last-Modified, or 304 when the client copy is current"""
+    version = company_version(get_company(db))
+    etag = f'"{invoice.id}-{version[:16]}-{fmt}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+    # Invoices never change for the same company version: the ETag alone decides
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    render = render_invoice(db, invoice)
+    last_modified = _as_utc(render.rendered_at)
+    headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and not if_none_match:
+        try:
+            if last_modified.replace(microsecond=0) <= parsedate_to_datetime(if_modified_since):
+                return Response(status_code=304, headers=headers)
+        except (TypeError, ValueError):
+            pass
+
+    if fmt == "pdf":
+        if render.pdf is None and FPDF is not None:
+            # Rendered before PDF support was available
+            render.pdf = render_invoice_pdf(invoice, get_company(db))
+            db.commit()
+        if render.pdf is None:
+            raise HTTPException(status_code=503, detail="PDF rendering is not available")
+        headers["Content-Disposition"] = f'attachment; filename="{invoice.invoice_number}.pdf"'
+        return Response(content=render.pdf, media_type="application/pdf", headers=headers)
+    return Response(content=render.html, media_type="text/html; charset=utf-8", headers=headers)
+
+
+BUNDLE_SUMMARY_HEADER = [
+    "Invoice Number", "Invoice Date", "Customer Name", "Customer Email", "Company", "GST Number",
+    "Subtotal (Rs)", "CGST (Rs)", "SGST (Rs)", "IGST (Rs)", "Total (Rs)", "Credited (Rs)",
+    "Razorpay Payment ID", "Status",
+]
+
+
+class _ZipStream:
+    """Write-only file for zipfile; the bytes written so far are taken out with take()"""
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _bundle_document(invoice_id: int, fmt: str) -> bytes:
+    """Stored document of one invoice (rendered first if missing or stale); runs on the pool"""
+    db = SessionLocal()
+    try:
+        invoice = db.get(models.Invoice, invoice_id)
+        render = render_invoice(db, invoice)
+        if fmt == "html":
+            return render.html.encode()
+        if render.pdf is None:
+            render.pdf = render_invoice_pdf(invoice, get_company(db))
+            db.commit()
+        return render.pdf
+    finally:
+        db.close()
+
+
+def _bundle_summary_row(invoice: models.Invoice) -> list:
+    return [
+        invoice.invoice_number, invoice_date(invoice), invoice.customer_name, invoice.customer_email,
+        invoice.customer_company or "", invoice.customer_gst or "",
+        invoice.subtotal / 100, (invoice.cgst_amount or 0) / 100, (invoice.sgst_amount or 0) / 100,
+        (invoice.igst_amount or 0) / 100, invoice.total_amount / 100, invoice.credited_amount / 100,
+        invoice.razorpay_payment_id or "", invoice.status,
+    ]
+
+
+def _bundle_chunks(invoices: list, fmt: str) -> Iterator[bytes]:
+    stream = _ZipStream()
+    # PDFs are already compressed; HTML shrinks a lot
+    compression = zipfile.ZIP_STORED if fmt == "pdf" else zipfile.ZIP_DEFLATED
+    workers = max(1, settings.INVOICE_BUNDLE_WORKERS)
+
+    with zipfile.ZipFile(stream, "w", compression=compression) as bundle, \
+            ThreadPoolExecutor(max_workers=workers, thread_name_prefix="invoice-bundle") as pool:
+        # Keep a bounded window of renders in flight and write them in order
+        pending = deque()
+        remaining = iter(invoices)
+        for invoice in remaining:
+            pending.append((invoice, pool.submit(_bundle_document, invoice.id, fmt)))
+            if len(pending) >= workers * 2:
+                break
+        while pending:
+            invoice, future = pending.popleft()
+            try:
+                document = future.result()
+            except Exception as e:
+                logger.error(f"Could not add invoice {invoice.id} to bundle: {e}")
+                document = None
+            if document is not None:
+                bundle.writestr(f"{invoice.invoice_number}.{fmt}", document)
+                yield stream.take()
+            next_invoice = next(remaining, None)
+            if next_invoice is not None:
+                pending.append((next_invoice, pool.submit(_bundle_document, next_invoice.id, fmt)))
+
+        summary = io.StringIO()
+        writer = csv.writer(summary)
+        writer.writerow(BUNDLE_SUMMARY_HEADER)
+        writer.writerows(_bundle_summary_row(invoice) for invoice in invoices)
+        bundle.writestr("summary.csv", summary.getvalue(), compress_type=zipfile.ZIP_DEFLATED)
+    yield stream.take()
+
+
+def invoice_bundle_response(db: Session, fmt: str, user_id: Optional[int] = None,
+                            date_from: Optional[date] = None, date_to: Optional[date] = None) -> StreamingResponse:
+    """
+    Zip of the invoices issued in [date_from, date_to] (for one user, or all
+    users when user_id is None), one file per invoice plus a summary.csv for
+    GST filing. The zip is streamed as the documents are ready.
+    """
+    if fmt == "pdf" and FPDF is None:
+        raise HTTPException(status_code=503, detail="PDF rendering is not available")
+
+    query = db.query(models.Invoice)
+    if user_id is not None:
+        query = query.filter(models.Invoice.user_id == user_id)
+    if date_from:
+        query = query.filter(models.Invoice.created_at >= date_from)
+    if date_to:
+        query = query.filter(models.Invoice.created_at < date_to + timedelta(days=1))
+    invoices = query.order_by(models.Invoice.created_at, models.Invoice.id).all()
+    if not invoices:
+        raise HTTPException(status_code=404, detail="No invoices found for this period")
+    if len(invoices) > settings.INVOICE_BUNDLE_MAX:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many invoices ({len(invoices)}), narrow the date range (max {settings.INVOICE_BUNDLE_MAX})"
+        )
+    # The stream outlives the request session; it only needs the loaded rows
+    db.expunge_all()
+
+    period = "-".join(str(d) for d in (date_from, date_to) if d) or "all"
+    filename = f"invoices-{period}.zip"
+    return StreamingResponse(
+        _bundle_chunks(invoices, fmt),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
@@ -0,0 +1,328 @@
+"""
+Outbound mail: pooled SMTP connections and a durable send queue.
+
+SMTP sessions are expensive (TLS handshake + AUTH), so connections are kept
+open and reused: a pool of MAIL_CONCURRENCY authenticated connections, each
+reopened transparently when the server has dropped it and closed after
+MAIL_IDLE_SECONDS unused. send_message sends one email right away through the
+pool; that is what email_utils.send_email uses.
+
+Bulk mail goes through the queue instead: enqueue stores one email_deliveries
+row per recipient (optionally grouped under an email_jobs row) and returns.
+The worker (mail_queue_loop, started with the app) claims queued rows with a
+conditional UPDATE and sends them MAIL_CONCURRENCY at a time. Each delivery
+records its own outcome; temporary failures are retried with backoff up to
+MAIL_MAX_ATTEMPTS and the job's sent/failed counts are kept up to date.
+"""
+import asyncio
+import logging
+import queue
+import smtplib
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import Dict, Iterable, List, Optional
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import and_, func, insert, or_, select, update
+from sqlalchemy.orm import Session
+from . import models
+from .config import settings
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# A claimed delivery not finished within this long is assumed abandoned
+SENDING_TIMEOUT = timedelta(minutes=10)
+RETRY_BASE_SECONDS = 60
+
+# Set (thread-safely, via the loop) when mail is queued
+_wakeup = asyncio.Event()
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+class MailNotConfigured(Exception):
+    pass
+
+
+class SMTPConnection:
+    """One authenticated SMTP session, reopened when the server has dropped it"""
+
+    def __init__(self):
+        self._server: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+
+    def _connect(self):
+        if not settings.SMTP_PASSWORD:
+            raise MailNotConfigured("SMTP_PASSWORD not configured")
+        if settings.SMTP_PORT == 465:
+            server = smtplib.SMTP_SSL(settings.SMTP_HOST, settings.SMTP_PORT, timeout=settings.MAIL_TIMEOUT_SECONDS)
+        else:
+            server = smtplib.SMTP(settings.SMTP_HOST, settings.SMTP_PORT, timeout=settings.MAIL_TIMEOUT_SECONDS)
+            server.starttls()
+        try:
+            server.login(settings.SMTP_USER, settings.SMTP_PASSWORD)
+        except Exception:
+            server.close()
+            raise
+        self._server = server
+
+    def idle_for(self) -> float:
+        return time.monotonic() - self._last_used
+
+    def send(self, to_email: str, message: str):
+        if self._server is not None and self.idle_for() > settings.MAIL_IDLE_SECONDS:
+            self.close()  # The server has most likely timed the session out
+        for attempt in (1, 2):
+            if self._server is None:
+                self._connect()
+            try:
+                self._server.sendmail(settings.SMTP_USER, to_email, message)
+                self._last_used = time.monotonic()
+                return
+            except (smtplib.SMTPServerDisconnected, ConnectionError, socket.timeout):
+                # Dropped session: reconnect once, then give up
+                self.close()
+                if attempt == 2:
+                    raise
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                self._server.close()
+            self._server = None
+
+
+class SMTPPool:
+    """Fixed set of SMTP connections; checking one out bounds concurrent sends"""
+
+    def __init__(self, size: int):
+        self._idle: "queue.LifoQueue[SMTPConnection]" = queue.LifoQueue()
+        for _ in range(max(1, size)):
+            self._idle.put(SMTPConnection())
+
+    @contextmanager
+    def connection(self):
+        conn = self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def close_idle(self):
+        """Close connections unused for MAIL_IDLE_SECONDS (those not checked out)"""
+        checked = []
+        while True:
+            try:
+                checked.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        for conn in checked:
+            if conn.idle_for() > settings.MAIL_IDLE_SECONDS:
+                conn.close()
+            self._idle.put(conn)
+
+
+_pool = SMTPPool(settings.MAIL_CONCURRENCY)
+
+
+def build_message(to_email: str, subject: str, html_content: str, text_content: Optional[str] = None) -> str:
+    msg = MIMEMultipart("alternative")
+    msg["Subject"] = subject
+    msg["From"] = f"{settings.SMTP_FROM_NAME} <{settings.SMTP_USER}>"
+    msg["To"] = to_email
+    if text_content:
+        msg.attach(MIMEText(text_content, "plain"))
+    msg.attach(MIMEText(html_content, "html"))
+    return msg.as_string()
+
+
+def send_message(to_email: str, subject: str, html_content: str, text_content: Optional[str] = None):
+    """Send one email now over a pooled connection; raises on failure"""
+    message = build_message(to_email, subject, html_content, text_content)
+    with _pool.connection() as conn:
+        conn.send(to_email, message)
+
+
+def _is_permanent(error: Exception) -> bool:
+    """Failures that will not succeed on retry (bad recipient, 5xx, no SMTP config)"""
+    if isinstance(error, (MailNotConfigured, smtplib.SMTPRecipientsRefused)):
+        return True
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code >= 500
+    return False
+
+
+# ========== Queue ==========
+
+def notify_worker():
+    """Wake the queue worker; safe to call from request threads"""
+    if _loop is not None and not _loop.is_closed():
+        _loop.call_soon_threadsafe(_wakeup.set)
+
+
+def enqueue(db: Session, messages: Iterable[dict], kind: Optional[str] = None,
+            requested_by: Optional[int] = None) -> Optional[models.EmailJob]:
+    """
+    Queue emails for the worker. Each message has to_email, subject,
+    html_content and optionally text_content and user_id. With a kind the
+    deliveries are grouped under a new EmailJob, which is returned.
+    """
+    rows = [dict(message) for message in messages]
+    job = None
+    if kind:
+        job = models.EmailJob(kind=kind, requested_by=requested_by, status="queued", total=len(rows))
+        db.add(job)
+        db.flush()
+        for row in rows:
+            row["job_id"] = job.id
+    if rows:
+        for row in rows:
+            row.setdefault("status", "queued")
+            row.setdefault("attempts", 0)
+        db.execute(insert(models.EmailDelivery), rows)
+    elif job:
+        job.status = "completed"
+        job.completed_at = datetime.now(timezone.utc)
+    db.commit()
+    notify_worker()
+    return job
+
+
+def _claimable(now: datetime):
+    return or_(
+        and_(
+            models.EmailDelivery.status == "queued",
+            or_(models.EmailDelivery.next_attempt_at.is_(None), models.EmailDelivery.next_attempt_at <= now)
+        ),
+        and_(
+            models.EmailDelivery.status == "sending",
+            models.EmailDelivery.locked_at < now - SENDING_TIMEOUT
+        )
+    )
+
+
+def claim_deliveries(db: Session, batch_size: int) -> List[int]:
+    """Mark up to batch_size due deliveries as sending; returns the ids this worker owns"""
+    now = datetime.now(timezone.utc)
+    candidates = db.execute(
+        select(models.EmailDelivery.id)
+        .where(_claimable(now))
+        .order_by(models.EmailDelivery.id)
+        .limit(batch_size)
+    ).scalars().all()
+
+    claimed = []
+    for delivery_id in candidates:
+        result = db.execute(
+            update(models.EmailDelivery)
+            .where(models.EmailDelivery.id == delivery_id, _claimable(now))
+            .values(status="sending", locked_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount:
+            claimed.append(delivery_id)
+    db.commit()
+    return claimed
+
+
+def deliver(delivery_id: int) -> Optional[int]:
+    """Send one claimed delivery and record the outcome; returns its job id"""
+    db = SessionLocal()
+    try:
+        delivery = db.get(models.EmailDelivery, delivery_id)
+        attempts = (delivery.attempts or 0) + 1
+        now = datetime.now(timezone.utc)
+        try:
+            send_message(delivery.to_email, delivery.subject, delivery.html_content, delivery.text_content)
+            values = {"status": "sent", "sent_at": now, "error": None}
+        except Exception as e:
+            logger.error(f"Email {delivery_id} to {delivery.to_email} failed, attempt {attempts}: {e}")
+            if _is_permanent(e) or attempts >= settings.MAIL_MAX_ATTEMPTS:
+                values = {"status": "failed", "error": str(e)}
+            else:
+                values = {
+                    "status": "queued",
+                    "next_attempt_at": now + timedelta(seconds=RETRY_BASE_SECONDS * 2 ** (attempts - 1)),
+                    "error": str(e),
+                }
+        db.execute(
+            update(models.EmailDelivery)
+            .where(models.EmailDelivery.id == delivery_id)
+            .values(attempts=attempts, locked_at=None, **values)
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        return delivery.job_id
+    finally:
+        db.close()
+
+
+def refresh_jobs(db: Session, job_ids: Iterable[int]):
+    """Recount sent/failed deliveries of these jobs, completing those with nothing left to send"""
+    job_ids = set(job_ids)
+    if not job_ids:
+        return
+    counts: Dict[int, Dict[str, int]] = {job_id: {} for job_id in job_ids}
+    rows = db.query(
+        models.EmailDelivery.job_id, models.EmailDelivery.status, func.count(models.EmailDelivery.id)
+    ).filter(
+        models.EmailDelivery.job_id.in_(job_ids)
+    ).group_by(models.EmailDelivery.job_id, models.EmailDelivery.status).all()
+    for job_id, status, count in rows:
+        counts[job_id][status] = count
+
+    for job in db.query(models.EmailJob).filter(models.EmailJob.id.in_(job_ids)):
+        by_status = counts[job.id]
+        job.sent = by_status.get("sent", 0)
+        job.failed = by_status.get("failed", 0)
+        if not by_status.get("queued") and not by_status.get("sending") and job.status != "completed":
+            job.status = "completed"
+            job.completed_at = datetime.now(timezone.utc)
+    db.commit()
+
+
+def process_mail_queue(batch_size: int = 100) -> int:
+    """Send every due delivery; returns how many were attempted"""
+    handled = 0
+    with ThreadPoolExecutor(max_workers=max(1, settings.MAIL_CONCURRENCY), thread_name_prefix="mail") as pool:
+        while True:
+            db = SessionLocal()
+            try:
+                claimed = claim_deliveries(db, batch_size)
+            finally:
+                db.close()
+            if not claimed:
+                return handled
+            job_ids = [job_id for job_id in pool.map(deliver, claimed) if job_id]
+            db = SessionLocal()
+            try:
+                refresh_jobs(db, job_ids)
+            finally:
+                db.close()
+            handled += len(claimed)
+
+
+async def mail_queue_loop():
+    """Background task sending queued mail, on each enqueue or every MAIL_POLL_SECONDS"""
+    global _loop
+    _loop = asyncio.get_running_loop()
+    try:
+        while True:
+            _wakeup.clear()
+            try:
+                await run_in_threadpool(process_mail_queue)
+                await run_in_threadpool(_pool.close_idle)
+            except Exception as e:
+                logger.error(f"Mail queue processing failed: {e}")
+            try:
+                await asyncio.wait_for(_wakeup.wait(), timeout=settings.MAIL_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        _loop = None
@@ -1,16 +1,38 @@
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session
 from contextlib import asynccontextmanager
-from .database import engine, Base
-from .routers import auth, customer, payments, admin, messages, whatsapp
-from . import models
+from typing import Optional
+import asyncio
+import hmac
+from .database import engine, async_engine, Base, get_db, read_your_writes_middleware
+from .auth import decode_token
+from .routers import auth, customer, payments, admin, messages, whatsapp, exports
+from . import models, counters  # counters registers the tenant counter flush hook
+from .counters import seed_counters
 from .config import settings
+from .pagination import NEXT_CURSOR_HEADER, create_sqlite_sort_indexes
+from .metrics import metrics_middleware, render_prometheus, DEBUG_HEADERS
+from .rate_limit import rate_limit_middleware
+from .partitioning import create_messages_table, ensure_message_partitions, partition_maintenance_loop
+from .reconciliation import reconciliation_loop
+from .webhook_inbox import webhook_inbox_loop
+from .mailer import mail_queue_loop
+from .template_catalogue import close_client as close_template_client, template_catalogue_loop
 
 # Startup logic
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
+    create_messages_table(engine)  # partitioned on PostgreSQL, before create_all
     Base.metadata.create_all(bind=engine)
+    create_sqlite_sort_indexes(engine)
+    try:
+        ensure_message_partitions(engine)
+    except Exception as e:
+        print(f"Message partition check failed: {e}")
 
     from .database import SessionLocal
     from .auth import get_password_hash
@@ -60,13 +82,42 @@ async def lifespan(app: FastAPI):
             print("Created company config for TWOZERO")
 
         db.commit()
+
+        # Counter rows for tenants whose data predates them (the admin
+        # dashboard totals are a SUM over these rows)
+        seeded = seed_counters(db)
+        if seeded:
+            print(f"Seeded {seeded} tenant counter(s)")
     except Exception as e:
         print(f"Startup error: {e}")
     finally:
         db.close()
 
+    partition_task = None
+    if engine.dialect.name == "postgresql":
+        partition_task = asyncio.create_task(partition_maintenance_loop())
+    webhook_task = asyncio.create_task(webhook_inbox_loop())
+    mail_task = asyncio.create_task(mail_queue_loop())
+    template_task = None
+    if settings.TEMPLATE_REFRESH_MINUTES > 0:
+        template_task = asyncio.create_task(template_catalogue_loop())
+    reconcile_task = None
+    if settings.RECONCILE_INTERVAL_MINUTES > 0 and settings.RAZORPAY_KEY_ID and settings.RAZORPAY_KEY_SECRET:
+        reconcile_task = asyncio.create_task(reconciliation_loop())
+
     yield  # App runs here
 
+    if partition_task:
+        partition_task.cancel()
+    webhook_task.cancel()
+    mail_task.cancel()
+    if reconcile_task:
+        reconcile_task.cancel()
+    if template_task:
+        template_task.cancel()
+    await close_template_client()
+    await async_engine.dispose()
+
 app = FastAPI(
     title="WhatsApp Dashboard API",
     description="API for WhatsApp messaging dashboard with Razorpay integration",
@@ -89,14 +140,36 @@ origins = [
     settings.FRONTEND_URL,
 ]
 
+# Keep a user's reads on the primary for a while after their writes, on every worker
+app.middleware("http")(read_your_writes_middleware)
+
+# Throttle the unauthenticated public portal endpoints per client IP
+# (added before CORS so its 429s still carry the CORS headers)
+app.middleware("http")(rate_limit_middleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "Retry-After"] + (DEBUG_HEADERS if settings.DEBUG else []),
 )
 
+# Per-request SQL / provider cost instrumentation
+app.middleware("http")(metrics_middleware)
+
+
+@app.exception_handler(PoolTimeoutError)
+async def pool_timeout_handler(request, exc):
+    # All pooled connections busy (e.g. connection storm after a deploy):
+    # ask the client to retry instead of failing with a 500
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Database busy, please retry"},
+        headers={"Retry-After": "1"}
+    )
+
 # Include routers
 app.include_router(auth.router)
 app.include_router(customer.router)
@@ -104,6 +177,7 @@ app.include_router(payments.router)
 app.include_router(messages.router)
 app.include_router(admin.router)
 app.include_router(whatsapp.router)
+app.include_router(exports.router)
 
 @app.get("/")
 def root():
@@ -116,3 +190,27 @@ def root():
 @app.get("/health")
 def health_check():
     return {"status": "healthy"}
+
+def _metrics_authorized(authorization: Optional[str], db: Session) -> bool:
+    """Bearer METRICS_API_KEY, or the access token of an active admin"""
+    if not authorization or not authorization.startswith("Bearer "):
+        return False
+    token = authorization[len("Bearer "):]
+    if settings.METRICS_API_KEY and hmac.compare_digest(token, settings.METRICS_API_KEY):
+        return True
+    payload = decode_token(token)
+    if not payload or not payload.get("sub"):
+        return False
+    return db.query(models.User.id).filter(
+        models.User.email == payload["sub"],
+        models.User.role == "admin",
+        models.User.is_active == True
+    ).first() is not None
+
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def metrics(authorization: str = Header(None), db: Session = Depends(get_db)):
+    """Prometheus metrics (METRICS_API_KEY or an admin token required)"""
+    if not _metrics_authorized(authorization, db):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,338 @@
+"""
+Per-request cost instrumentation.
+
+Every HTTP request gets a RequestStats object (held in a context variable) that
+collects the number of SQL statements, total database time, the slowest
+statement and the time spent waiting on outbound providers (Twilio, Razorpay,
+Meta). Statements are timed by cursor execute hooks on database.engine (and the
+async engine), provider calls by wrapping them in provider_call().
+
+At the end of the request the stats are
+- written as one structured JSON log line (logger "app.metrics"),
+- added to process-wide counters served by /metrics in Prometheus text format,
+- returned as X-DB-* / X-Provider-Time-Ms response headers when DEBUG is on.
+"""
+
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+from fastapi import Request
+from sqlalchemy import event
+from .config import settings
+from .database import engine, async_engine, replica_engine, pool_stats, read_routing_counts, replica_lag
+
+logger = logging.getLogger(__name__)
+
+# Statements slower than this are logged on their own
+SLOW_STATEMENT_MS = settings.SLOW_STATEMENT_MS
+
+# Request duration histogram buckets (seconds)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestStats:
+    """Costs accumulated while serving one request"""
+
+    def __init__(self):
+        self.db_statements = 0
+        self.db_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_statement: Optional[str] = None
+        self.provider_time = 0.0
+        self.provider_calls: Dict[str, int] = {}
+
+    def add_statement(self, statement: str, elapsed: float):
+        self.db_statements += 1
+        self.db_time += elapsed
+        if elapsed > self.slowest_time:
+            self.slowest_time = elapsed
+            self.slowest_statement = statement
+
+    def add_provider_call(self, provider: str, elapsed: float):
+        self.provider_time += elapsed
+        self.provider_calls[provider] = self.provider_calls.get(provider, 0) + 1
+
+
+_current_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def current_stats() -> Optional[RequestStats]:
+    """Stats of the request being served, None outside a request"""
+    return _current_stats.get()
+
+
+# ========== Process-wide counters (exported by /metrics) ==========
+
+class _Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (method, route, status) -> count
+        self.requests: Dict[Tuple[str, str, str], int] = {}
+        # (method, route) -> [bucket counts..., sum, count]
+        self.durations: Dict[Tuple[str, str], list] = {}
+        # (method, route) -> [statements, seconds]
+        self.db: Dict[Tuple[str, str], list] = {}
+        # (provider, outcome) -> [calls, seconds]
+        self.providers: Dict[Tuple[str, str], list] = {}
+        self.slow_statements = 0
+
+    def observe_request(self, method: str, route: str, status: int, elapsed: float, stats: RequestStats):
+        with self.lock:
+            key = (method, route, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+            hist = self.durations.setdefault((method, route), [0] * len(DURATION_BUCKETS) + [0.0, 0])
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if elapsed <= bound:
+                    hist[i] += 1
+            hist[-2] += elapsed
+            hist[-1] += 1
+
+            db = self.db.setdefault((method, route), [0, 0.0])
+            db[0] += stats.db_statements
+            db[1] += stats.db_time
+
+    def observe_provider(self, provider: str, outcome: str, elapsed: float):
+        with self.lock:
+            entry = self.providers.setdefault((provider, outcome), [0, 0.0])
+            entry[0] += 1
+            entry[1] += elapsed
+
+    def observe_slow_statement(self):
+        with self.lock:
+            self.slow_statements += 1
+
+
+registry = _Registry()
+
+
+# ========== SQL statement timing ==========
+
+# The start time lives on the statement's execution context, so a statement
+# that fails (and never reaches after_cursor_execute) leaves nothing behind
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._metrics_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, "_metrics_start", None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.add_statement(statement, elapsed)
+
+    if elapsed * 1000 >= SLOW_STATEMENT_MS:
+        registry.observe_slow_statement()
+        logger.warning(json.dumps({
+            "event": "slow_statement",
+            "duration_ms": round(elapsed * 1000, 2),
+            "statement": _shorten(statement)
+        }))
+
+
+for _engine in (engine, async_engine.sync_engine, replica_engine):
+    if _engine is None:
+        continue
+    event.listen(_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+# ========== Outbound provider calls ==========
+
+@contextmanager
+def provider_call(provider: str):
+    """
+    Time an outbound call to a provider (e.g. "twilio", "razorpay", "meta").
+
+        with provider_call("twilio"):
+            twilio_client.messages.create(...)
+    """
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        elapsed = time.perf_counter() - start
+        stats = _current_stats.get()
+        if stats is not None:
+            stats.add_provider_call(provider, elapsed)
+        registry.observe_provider(provider, outcome, elapsed)
+
+
+# ========== Middleware ==========
+
+def _shorten(statement: Optional[str], length: int = 300) -> Optional[str]:
+    if statement is None:
+        return None
+    statement = " ".join(statement.split())
+    return statement if len(statement) <= length else statement[:length] + "..."
+
+
+def _route_template(request: Request) -> str:
+    """Matched route path (e.g. /admin/customers/{user_id}) to keep label cardinality low"""
+    route = request.scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+async def metrics_middleware(request: Request, call_next):
+    stats = RequestStats()
+    token = _current_stats.set(stats)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        elapsed = time.perf_counter() - start
+        _current_stats.reset(token)
+
+        route = _route_template(request)
+        registry.observe_request(request.method, route, status, elapsed, stats)
+        logger.info(json.dumps({
+            "event": "request",
+            "method": request.method,
+            "route": route,
+            "path": request.url.path,
+            "status": status,
+            "duration_ms": round(elapsed * 1000, 2),
+            "db_statements": stats.db_statements,
+            "db_time_ms": round(stats.db_time * 1000, 2),
+            "db_slowest_ms": round(stats.slowest_time * 1000, 2),
+            "db_slowest_statement": _shorten(stats.slowest_statement),
+            "provider_time_ms": round(stats.provider_time * 1000, 2),
+            "provider_calls": stats.provider_calls
+        }))
+
+    if settings.DEBUG:
+        response.headers["X-DB-Statements"] = str(stats.db_statements)
+        response.headers["X-DB-Time-Ms"] = f"{stats.db_time * 1000:.2f}"
+        response.headers["X-DB-Slowest-Ms"] = f"{stats.slowest_time * 1000:.2f}"
+        response.headers["X-Provider-Time-Ms"] = f"{stats.provider_time * 1000:.2f}"
+        response.headers["X-Request-Time-Ms"] = f"{elapsed * 1000:.2f}"
+
+    return response
+
+
+# Response headers added in debug mode (exposed through CORS)
+DEBUG_HEADERS = [
+    "X-DB-Statements", "X-DB-Time-Ms", "X-DB-Slowest-Ms", "X-Provider-Time-Ms", "X-Request-Time-Ms"
+]
+
+
+# ========== Prometheus exposition ==========
+
+def _labels(**labels) -> str:
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def render_prometheus() -> str:
+    """All process-wide counters in Prometheus text exposition format"""
+    lines = []
+    with registry.lock:
+        lines += [
+            "# HELP http_requests_total HTTP requests served.",
+            "# TYPE http_requests_total counter",
+        ]
+        for (method, route, status), count in sorted(registry.requests.items()):
+            lines.append(f"http_requests_total{_labels(method=method, route=route, status=status)} {count}")
+
+        lines += [
+            "# HELP http_request_duration_seconds HTTP request latency.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for (method, route), hist in sorted(registry.durations.items()):
+            for bound, count in zip(DURATION_BUCKETS, hist):
+                lines.append(
+                    f"http_request_duration_seconds_bucket{_labels(method=method, route=route, le=bound)} {count}"
+                )
+            lines.append(
+                f"http_request_duration_seconds_bucket{_labels(method=method, route=route, le='+Inf')} {hist[-1]}"
+            )
+            lines.append(f"http_request_duration_seconds_sum{_labels(method=method, route=route)} {hist[-2]:.6f}")
+            lines.append(f"http_request_duration_seconds_count{_labels(method=method, route=route)} {hist[-1]}")
+
+        lines += [
+            "# HELP db_statements_total SQL statements executed while serving requests.",
+            "# TYPE db_statements_total counter",
+        ]
+        for (method, route), (statements, _) in sorted(registry.db.items()):
+            lines.append(f"db_statements_total{_labels(method=method, route=route)} {statements}")
+
+        lines += [
+            "# HELP db_time_seconds_total Time spent executing SQL while serving requests.",
+            "# TYPE db_time_seconds_total counter",
+        ]
+        for (method, route), (_, seconds) in sorted(registry.db.items()):
+            lines.append(f"db_time_seconds_total{_labels(method=method, route=route)} {seconds:.6f}")
+
+        lines += [
+            "# HELP db_slow_statements_total SQL statements slower than SLOW_STATEMENT_MS.",
+            "# TYPE db_slow_statements_total counter",
+            f"db_slow_statements_total {registry.slow_statements}",
+        ]
+
+        lines += [
+            "# HELP provider_calls_total Outbound provider calls.",
+            "# TYPE provider_calls_total counter",
+        ]
+        for (provider, outcome), (calls, _) in sorted(registry.providers.items()):
+            lines.append(f"provider_calls_total{_labels(provider=provider, outcome=outcome)} {calls}")
+
+        lines += [
+            "# HELP provider_call_seconds_total Time spent waiting on outbound providers.",
+            "# TYPE provider_call_seconds_total counter",
+        ]
+        for (provider, outcome), (_, seconds) in sorted(registry.providers.items()):
+            lines.append(f"provider_call_seconds_total{_labels(provider=provider, outcome=outcome)} {seconds:.6f}")
+
+    # Connection pool gauges of this worker
+    pools = {"sync": pool_stats(engine), "async": pool_stats(async_engine)}
+    if replica_engine is not None:
+        pools["replica"] = pool_stats(replica_engine)
+    pool_metrics = (
+        ("db_pool_size", "gauge", "Configured connection pool size.", "pool_size"),
+        ("db_pool_checked_out", "gauge", "Connections currently checked out.", "checked_out"),
+        ("db_pool_overflow", "gauge", "Connections open beyond the pool size.", "overflow"),
+        ("db_pool_checkouts_total", "counter", "Connection checkouts.", "checkouts"),
+        ("db_pool_timeouts_total", "counter", "Checkouts that timed out waiting for a connection.", "timeouts"),
+    )
+    for name, kind, help_text, key in pool_metrics:
+        values = [(pool, stats[key]) for pool, stats in pools.items() if key in stats]
+        if values:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            lines += [f"{name}{_labels(pool=pool)} {value}" for pool, value in values]
+    waits = [(pool, stats["wait_total_ms"]) for pool, stats in pools.items() if "wait_total_ms" in stats]
+    if waits:
+        lines += [
+            "# HELP db_pool_wait_seconds_total Time spent waiting for a pooled connection.",
+            "# TYPE db_pool_wait_seconds_total counter",
+        ]
+        lines += [f"db_pool_wait_seconds_total{_labels(pool=pool)} {ms / 1000:.6f}" for pool, ms in waits]
+
+    # Read replica routing
+    lines += [
+        "# HELP db_read_routing_total Read-only requests by database used and reason.",
+        "# TYPE db_read_routing_total counter",
+    ]
+    for (target, reason), count in sorted(read_routing_counts.items()):
+        lines.append(f"db_read_routing_total{_labels(target=target, reason=reason)} {count}")
+    if replica_engine is not None:
+        lag = replica_lag()
+        lines += [
+            "# HELP db_replica_lag_seconds Replication lag of the read replica (-1 if unreachable).",
+            "# TYPE db_replica_lag_seconds gauge",
+            f"db_replica_lag_seconds {lag if lag is not None else -1}",
+        ]
+
+    return "\n".join(lines) + "\n"
@@ -1,7 +1,8 @@
-from sqlalchemy import Column, Integer, BigInteger, String, Float, Boolean, DateTime, ForeignKey, Enum, Text
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, BigInteger, String, Float, Boolean, DateTime, ForeignKey, Enum, Text, Index, LargeBinary
+from sqlalchemy.orm import relationship, validates
 from sqlalchemy.sql import func
 from .database import Base
+from .phones import normalize_phone
 import enum
 
 class UserRole(str, enum.Enum):
@@ -16,6 +17,7 @@ class TransactionStatus(str, enum.Enum):
     PENDING = "pending"
     COMPLETED = "completed"
     FAILED = "failed"
+    EXPIRED = "expired"  # Order never paid (set by reconciliation)
 
 class MessageType(str, enum.Enum):
     TEMPLATE = "template"
@@ -35,6 +37,7 @@ class User(Base):
     id = Column(Integer, primary_key=True, index=True)
     email = Column(String(255), unique=True, index=True, nullable=False)
     phone = Column(String(20), index=True)
+    phone_e164 = Column(String(20), unique=True, index=True)  # Normalised phone (+918700762648), set from phone
     name = Column(String(255), nullable=False)
     company_name = Column(String(255))
     hashed_password = Column(String(255), nullable=False)
@@ -74,6 +77,11 @@ class User(Base):
     messages = relationship("Message", back_populates="user")
     invoices = relationship("Invoice", back_populates="user")
 
+    @validates("phone")
+    def _set_phone_e164(self, key, phone):
+        self.phone_e164 = normalize_phone(phone)
+        return phone
+
 # Transaction model (for balance history)
 class Transaction(Base):
     __tablename__ = "transactions"
@@ -94,8 +102,9 @@ class Transaction(Base):
     # Description
     description = Column(String(500))
 
-    # For message-related debits
-    message_id = Column(Integer, ForeignKey("messages.id"), nullable=True)
+    # For message-related debits. No FOREIGN KEY: on PostgreSQL messages is
+    # partitioned by created_at, so messages.id alone is not a unique key
+    message_id = Column(Integer, nullable=True)
 
     # Link to invoice
     invoice_id = Column(Integer, ForeignKey("invoices.id"), nullable=True)
@@ -105,9 +114,18 @@ class Transaction(Base):
 
     # Relationships
     user = relationship("User", back_populates="transactions")
-    message = relationship("Message", back_populates="transaction")
+    message = relationship(
+        "Message", back_populates="transaction",
+        primaryjoin="foreign(Transaction.message_id) == Message.id"
+    )
     invoice = relationship("Invoice", back_populates="transaction")
 
+    # Keyset pagination indexes (newest first on created_at, id)
+    __table_args__ = (
+        Index("ix_transactions_user_created", "user_id", "created_at", "id"),
+        Index("ix_transactions_created", "created_at", "id"),
+    )
+
 # Invoice model
 class Invoice(Base):
     __tablename__ = "invoices"
@@ -146,6 +164,18 @@ class Invoice(Base):
     user = relationship("User", back_populates="invoices")
     transaction = relationship("Transaction", back_populates="invoice", uselist=False)
 
+# Rendered invoice documents (invoices.py). One row per invoice, re-rendered
+# when the company details it was rendered with change.
+class InvoiceRender(Base):
+    __tablename__ = "invoice_renders"
+
+    id = Column(Integer, primary_key=True, index=True)
+    invoice_id = Column(Integer, ForeignKey("invoices.id"), unique=True, nullable=False)
+    company_version = Column(String(40), nullable=False)  # Hash of company details + template version
+    html = Column(Text, nullable=False)
+    pdf = Column(LargeBinary)  # None when PDF rendering is unavailable
+    rendered_at = Column(DateTime(timezone=True), nullable=False)
+
 # Message model (WhatsApp messages)
 class Message(Base):
     __tablename__ = "messages"
@@ -179,9 +209,25 @@ class Message(Base):
     delivered_at = Column(DateTime(timezone=True))
     read_at = Column(DateTime(timezone=True))
 
+    # Cold storage: message_content moved to an archive file (app/archive.py)
+    archived_at = Column(DateTime(timezone=True))
+    archive_ref = Column(String(255))
+
     # Relationships
     user = relationship("User", back_populates="messages")
-    transaction = relationship("Transaction", back_populates="message", uselist=False)
+    transaction = relationship(
+        "Transaction", back_populates="message", uselist=False,
+        primaryjoin="Message.id == foreign(Transaction.message_id)"
+    )
+
+    # Keyset pagination indexes (newest first on created_at, id). On PostgreSQL
+    # the table is range-partitioned by month on created_at (app/partitioning.py)
+    # and these are created on every partition.
+    __table_args__ = (
+        Index("ix_messages_user_created", "user_id", "created_at", "id"),
+        Index("ix_messages_created", "created_at", "id"),
+        Index("ix_messages_whatsapp_message_id", "whatsapp_message_id"),  # status webhooks
+    )
 
 # Pricing configuration (admin can update)
 class PricingConfig(Base):
@@ -289,12 +335,21 @@ class PaymentLog(Base):
     # Raw JSON data (stores complete Razorpay response)
     raw_data = Column(Text)
 
+    # Cold storage: raw_data moved to an archive file (app/archive.py)
+    archived_at = Column(DateTime(timezone=True))
+    archive_ref = Column(String(255))
+
     # Timestamps
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     # Relationship
     user = relationship("User")
 
+    # Keyset pagination index (newest first on created_at, id)
+    __table_args__ = (
+        Index("ix_payment_logs_created", "created_at", "id"),
+    )
+
 
 # Public Customer Mapping (for portal recharge without login)
 class PublicCustomer(Base):
@@ -343,3 +398,161 @@ class PublicPayment(Base):
     # Relationships
     public_customer = relationship("PublicCustomer")
     user = relationship("User", foreign_keys=[user_id])
+
+
+# Materialised running totals per tenant (maintained by counters.py)
+class TenantCounter(Base):
+    __tablename__ = "tenant_counters"
+
+    # users.id of the tenant (platform totals are the SUM over all rows)
+    tenant_id = Column(Integer, primary_key=True)
+
+    messages_total = Column(BigInteger, nullable=False, default=0)  # All messages ever recorded
+    spent_total = Column(BigInteger, nullable=False, default=0)     # Completed debits, in paise
+    revenue_total = Column(BigInteger, nullable=False, default=0)   # Completed credits, in paise
+
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class InvoiceSequence(Base):
+    __tablename__ = "invoice_sequences"
+
+    # One counter per invoice prefix and year (TZ-2025-0001, TZ-2025-0002, ...)
+    prefix = Column(String(10), primary_key=True)
+    year = Column(Integer, primary_key=True)
+    last_value = Column(Integer, nullable=False, default=0)  # Last number handed out
+
+
+# Background export of message history (generated by exports.py)
+class ExportJob(Base):
+    __tablename__ = "export_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)  # Requested by
+
+    format = Column(String(20), nullable=False)  # csv/jsonl/parquet
+    filters = Column(Text)  # JSON of the export filters
+    status = Column(String(20), default="pending")  # pending, running, completed, failed, expired
+
+    row_count = Column(Integer, default=0)
+    file_path = Column(String(500))
+    file_size = Column(BigInteger)
+    error = Column(Text)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    completed_at = Column(DateTime(timezone=True))
+    expires_at = Column(DateTime(timezone=True))
+
+
+class WebhookEvent(Base):
+    __tablename__ = "webhook_inbox"
+    __table_args__ = (
+        Index("uq_webhook_inbox_provider_event", "provider", "event_id", unique=True),
+        Index("ix_webhook_inbox_status_next_attempt", "status", "next_attempt_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    provider = Column(String(20), nullable=False)  # razorpay
+    event_id = Column(String(255), nullable=False)  # Provider event id (x-razorpay-event-id)
+    event_type = Column(String(100))
+    payload = Column(Text, nullable=False)  # Verified raw body
+
+    status = Column(String(20), nullable=False, default="pending")  # pending, processing, processed, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime(timezone=True))
+    locked_at = Column(DateTime(timezone=True))  # When a worker claimed it
+    last_error = Column(Text)
+
+    received_at = Column(DateTime(timezone=True), server_default=func.now())
+    processed_at = Column(DateTime(timezone=True))
+
+
+class EmailJob(Base):
+    __tablename__ = "email_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String(50), nullable=False)  # low_balance_alert
+    requested_by = Column(Integer, ForeignKey("users.id"))  # Admin who queued it
+
+    status = Column(String(20), nullable=False, default="queued")  # queued, completed
+    total = Column(Integer, nullable=False, default=0)
+    sent = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    completed_at = Column(DateTime(timezone=True))
+
+    deliveries = relationship("EmailDelivery", back_populates="job")
+
+
+class EmailDelivery(Base):
+    """One outbound email; the mail queue worker sends queued rows"""
+    __tablename__ = "email_deliveries"
+    __table_args__ = (
+        Index("ix_email_deliveries_status_next_attempt", "status", "next_attempt_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("email_jobs.id"), index=True)  # None for one-off emails
+    user_id = Column(Integer, ForeignKey("users.id"))
+
+    to_email = Column(String(255), nullable=False)
+    subject = Column(String(500), nullable=False)
+    html_content = Column(Text, nullable=False)
+    text_content = Column(Text)
+
+    status = Column(String(20), nullable=False, default="queued")  # queued, sending, sent, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime(timezone=True))
+    locked_at = Column(DateTime(timezone=True))
+    error = Column(Text)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    sent_at = Column(DateTime(timezone=True))
+
+    job = relationship("EmailJob", back_populates="deliveries")
+
+
+class LowBalanceAlertState(Base):
+    """Where a user's balance stood at the last low balance check, so alerts fire once per crossing"""
+    __tablename__ = "low_balance_alert_states"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    below_threshold = Column(Boolean, nullable=False, default=False)
+    direction = Column(String(10))  # down (crossed below), up (recharged above)
+    last_alerted_at = Column(DateTime(timezone=True))
+    last_alerted_balance = Column(Integer)  # in paise
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class TwilioTemplate(Base):
+    """Local copy of a Twilio Content API template (see template_catalogue.py)"""
+    __tablename__ = "twilio_templates"
+    __table_args__ = (
+        Index("uq_twilio_templates_account_sid", "account_sid", "sid", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    account_sid = Column(String(100), nullable=False)
+    sid = Column(String(64), nullable=False)  # Content SID (HX...)
+
+    friendly_name = Column(String(255))
+    language = Column(String(20))
+    types = Column(Text)  # JSON
+    variables = Column(Text)  # JSON
+    approval_requests = Column(Text)  # JSON, as returned inline by the Content API
+    approval_status = Column(String(50))  # WhatsApp approval: received, pending, approved, rejected, ...
+
+    date_created = Column(String(40))  # As reported by Twilio
+    date_updated = Column(String(40))
+    synced_at = Column(DateTime(timezone=True))
+
+
+class TwilioTemplateSync(Base):
+    """Last catalogue refresh per Twilio account"""
+    __tablename__ = "twilio_template_syncs"
+
+    account_sid = Column(String(100), primary_key=True)
+    etag = Column(String(255))  # Of the first Content list page
+    synced_at = Column(DateTime(timezone=True))
+    last_error = Column(Text)
@@ -0,0 +1,166 @@
+"""
+Keyset (cursor) pagination helpers.
+
+Listings are ordered newest first on (created_at, id). A cursor is an opaque,
+URL-safe token holding the sort key of the last row of a page; the next page
+continues strictly after that key, so deep pages cost the same as the first
+one and rows inserted meanwhile are neither skipped nor repeated.
+
+Listing totals are estimated by default (see page_total) so that turning a
+page doesn't pay for a full COUNT(*).
+"""
+
+import base64
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional, Tuple
+from fastapi import HTTPException
+from sqlalchemy import func, text, tuple_
+from sqlalchemy.orm import Query
+from .config import settings
+
+# Response header carrying the next cursor for endpoints that return a bare list
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    payload = json.dumps([created_at.isoformat(), row_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+# SQLite sorts on datetime(created_at) (see _sort_key); these expression
+# indexes mirror the models' (created_at, id) keyset indexes so listings can
+# seek and walk an index instead of scanning and sorting the table.
+# PostgreSQL uses the model indexes directly.
+SQLITE_SORT_INDEXES = {
+    "ix_transactions_user_sort": ("transactions", "user_id, datetime(created_at), id"),
+    "ix_transactions_sort": ("transactions", "datetime(created_at), id"),
+    "ix_messages_user_sort": ("messages", "user_id, datetime(created_at), id"),
+    "ix_messages_sort": ("messages", "datetime(created_at), id"),
+    "ix_payment_logs_sort": ("payment_logs", "datetime(created_at), id"),
+}
+
+
+def create_sqlite_sort_indexes(engine):
+    """Create the SQLite sort indexes that are missing (no-op on other databases)"""
+    if engine.dialect.name != "sqlite":
+        return
+    with engine.begin() as conn:
+        for name, (table, columns) in SQLITE_SORT_INDEXES.items():
+            conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+
+
+def _sort_key(query: Query, model):
+    """
+    Column expression the listing is ordered by.
+    SQLite stores datetimes as text in more than one format, so it is compared
+    through datetime() (second precision, ties broken by id), which is indexed
+    by SQLITE_SORT_INDEXES.
+    """
+    if query.session.get_bind().dialect.name == "sqlite":
+        return func.datetime(model.created_at)
+    return model.created_at
+
+
+def keyset_page(query: Query, model, limit: int, cursor: Optional[str] = None, skip: int = 0):
+    """
+    Fetch one page of query ordered by (created_at, id) descending.
+
+    If cursor is given the page starts right after it; otherwise skip is used
+    as a plain offset (kept for older clients). Returns (rows, next_cursor),
+    next_cursor is None on the last page.
+    """
+    sort_key = _sort_key(query, model)
+
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        if query.session.get_bind().dialect.name == "sqlite":
+            created_at = created_at.strftime("%Y-%m-%d %H:%M:%S")
+        query = query.filter(tuple_(sort_key, model.id) < tuple_(created_at, row_id))
+
+    query = query.order_by(sort_key.desc(), model.id.desc())
+    if skip and not cursor:
+        query = query.offset(skip)
+
+    rows = query.limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+
+    return rows, next_cursor
+
+
+# Cached COUNT(*) results: (statement, params) -> (expires_at, count)
+_COUNT_CACHE_SIZE = 1024
+_count_cache: "OrderedDict[tuple, Tuple[float, int]]" = OrderedDict()
+_count_cache_lock = threading.Lock()
+
+
+def _estimated_table_rows(query: Query, model) -> Optional[int]:
+    """Planner row estimate from pg_class (PostgreSQL only, None if unknown)"""
+    if query.session.get_bind().dialect.name != "postgresql":
+        return None
+    estimate = query.session.execute(
+        text("SELECT reltuples FROM pg_class WHERE oid = to_regclass(:table)"),
+        {"table": model.__tablename__}
+    ).scalar()
+    # reltuples is -1 for tables that were never vacuumed/analyzed
+    if estimate is None or estimate < 0:
+        return None
+    return int(estimate)
+
+
+def _cached_count(query: Query) -> int:
+    compiled = query.statement.compile(dialect=query.session.get_bind().dialect)
+    key = (str(compiled), repr(sorted(compiled.params.items())))
+    now = time.monotonic()
+
+    with _count_cache_lock:
+        cached = _count_cache.get(key)
+        if cached and cached[0] > now:
+            _count_cache.move_to_end(key)
+            return cached[1]
+
+    count = query.count()
+
+    with _count_cache_lock:
+        _count_cache[key] = (now + settings.COUNT_CACHE_TTL_SECONDS, count)
+        _count_cache.move_to_end(key)
+        while len(_count_cache) > _COUNT_CACHE_SIZE:
+            _count_cache.popitem(last=False)
+
+    return count
+
+
+def page_total(query: Query, model, exact: bool = False, filtered: bool = False) -> Tuple[int, bool]:
+    """
+    Total row count for a listing. Returns (total, is_estimate).
+
+    exact=True runs COUNT(*). Otherwise unfiltered PostgreSQL listings use the
+    pg_class row estimate, and everything else a COUNT(*) cached for
+    COUNT_CACHE_TTL_SECONDS per distinct query.
+    """
+    if exact:
+        return query.count(), False
+
+    if not filtered:
+        estimate = _estimated_table_rows(query, model)
+        if estimate is not None:
+            return estimate, True
+
+    return _cached_count(query), True
@@ -0,0 +1,177 @@
+"""
+Monthly range partitioning of the messages table (PostgreSQL).
+
+On PostgreSQL messages is partitioned by RANGE (created_at) with one partition
+per calendar month (messages_y2026m01, ...) plus a DEFAULT partition for rows
+outside the created range. The primary key is (id, created_at) because a
+partitioned table's unique keys must include the partition key; the ORM keeps
+mapping id as the primary key, so queries and inserts are unchanged. Indexes
+declared on models.Message are created on the parent and cascade to every
+partition.
+
+Future partitions are created at startup and by a periodic background task, so
+new rows never land in the DEFAULT partition. Existing unpartitioned tables are
+converted online with partition_messages.py.
+
+SQLite has no partitioning: messages stays a plain table with the same columns
+and (created_at, id) indexes, and every function here is a no-op.
+"""
+import asyncio
+import logging
+from datetime import date, datetime, timezone
+from typing import List, Optional
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import MetaData, PrimaryKeyConstraint, Table, exc, text
+from .config import settings
+from .database import engine, Base
+
+logger = logging.getLogger(__name__)
+
+MESSAGES_TABLE = "messages"
+
+# Serialises partition DDL between worker processes
+_PARTITION_LOCK_KEY = "messages_partitions"
+
+
+def month_start(value) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_y{month.year}m{month.month:02d}"
+
+
+def is_partitioned(conn, table: str = MESSAGES_TABLE) -> bool:
+    """True when table exists and is a partitioned parent table"""
+    if conn.dialect.name != "postgresql":
+        return False
+    relkind = conn.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)"),
+        {"table": table}
+    ).scalar()
+    return relkind == "p"
+
+
+def partitioned_messages_table(name: str = MESSAGES_TABLE, index_suffix: str = "",
+                               id_sequence: Optional[str] = None) -> Table:
+    """
+    Partitioned copy of the messages table definition.
+    name / index_suffix let the online migration build it next to the live
+    table; with id_sequence the id column is created without SERIAL so it can
+    draw from the existing sequence.
+    """
+    source = Base.metadata.tables[MESSAGES_TABLE]
+    metadata = MetaData()
+    Base.metadata.tables["users"].to_metadata(metadata)
+    table = source.to_metadata(metadata, name=name)
+
+    table.c.created_at.primary_key = True
+    table.c.created_at.nullable = False
+    # With a composite key SQLAlchemy only emits SERIAL when asked explicitly
+    table.c.id.autoincrement = not id_sequence
+    table.append_constraint(PrimaryKeyConstraint(table.c.id, table.c.created_at))
+    table.dialect_kwargs["postgresql_partition_by"] = "RANGE (created_at)"
+
+    # Keep the model's index names (index=True names are derived from the table name)
+    source_names = {tuple(c.name for c in ix.columns): ix.name for ix in source.indexes}
+    for index in table.indexes:
+        index.name = source_names[tuple(c.name for c in index.columns)] + index_suffix
+    return table
+
+
+def create_month_partitions(conn, table: str, first: date, last: date) -> List[str]:
+    """Create monthly partitions of table for first..last (inclusive); returns the new ones"""
+    created = []
+    month = month_start(first)
+    while month <= last:
+        name = partition_name(table, month)
+        exists = conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar()
+        if not exists:
+            upper = add_months(month, 1)
+            try:
+                # Savepoint so one failing month (e.g. the DEFAULT partition
+                # already holds rows for it) does not abort the others
+                with conn.begin_nested():
+                    conn.exec_driver_sql(
+                        f'CREATE TABLE "{name}" PARTITION OF "{table}" '
+                        f"FOR VALUES FROM ('{month.isoformat()} 00:00:00+00') "
+                        f"TO ('{upper.isoformat()} 00:00:00+00')"
+                    )
+                created.append(name)
+            except exc.DBAPIError as e:
+                logger.error(f"Could not create partition {name}: {e}")
+        month = add_months(month, 1)
+    return created
+
+
+def create_partitioned_messages(conn, name: str = MESSAGES_TABLE, first: Optional[date] = None,
+                                index_suffix: str = "", id_sequence: Optional[str] = None) -> List[str]:
+    """Create the partitioned messages table with a DEFAULT partition and monthly partitions"""
+    today = datetime.now(timezone.utc).date()
+    table = partitioned_messages_table(name, index_suffix=index_suffix, id_sequence=id_sequence)
+    table.create(bind=conn)
+    if id_sequence:
+        conn.exec_driver_sql(
+            f'ALTER TABLE "{name}" ALTER COLUMN id SET DEFAULT nextval(\'{id_sequence}\'::regclass)'
+        )
+    conn.exec_driver_sql(f'CREATE TABLE "{name}_default" PARTITION OF "{name}" DEFAULT')
+    return create_month_partitions(
+        conn, name, first or today,
+        add_months(month_start(today), settings.MESSAGE_PARTITIONS_AHEAD)
+    )
+
+
+def create_messages_table(bind=engine):
+    """
+    Create messages as a partitioned table on a fresh PostgreSQL database.
+    Runs before create_all(), which then skips the existing table.
+    """
+    if bind.dialect.name != "postgresql":
+        return
+    with bind.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:key))"), {"key": _PARTITION_LOCK_KEY})
+        if conn.execute(text("SELECT to_regclass(:table)"), {"table": MESSAGES_TABLE}).scalar():
+            return
+        create_partitioned_messages(conn)
+        logger.info("Created partitioned messages table")
+
+
+def ensure_message_partitions(bind=engine, months_ahead: Optional[int] = None) -> List[str]:
+    """Create missing partitions from the current month up to months_ahead months ahead"""
+    if bind.dialect.name != "postgresql":
+        return []
+    if months_ahead is None:
+        months_ahead = settings.MESSAGE_PARTITIONS_AHEAD
+
+    with bind.begin() as conn:
+        if not is_partitioned(conn):
+            logger.info("messages is not partitioned; run partition_messages.py to convert it")
+            return []
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:key))"), {"key": _PARTITION_LOCK_KEY})
+        # Creating a partition briefly locks the parent table; give up and retry
+        # on the next run rather than queue behind long transactions
+        conn.exec_driver_sql("SET LOCAL lock_timeout = '2s'")
+        this_month = month_start(datetime.now(timezone.utc))
+        created = create_month_partitions(
+            conn, MESSAGES_TABLE, this_month, add_months(this_month, months_ahead)
+        )
+
+    if created:
+        logger.info(f"Created message partitions: {', '.join(created)}")
+    return created
+
+
+async def partition_maintenance_loop():
+    """Background task keeping future partitions created while the app runs"""
+    interval = settings.MESSAGE_PARTITION_CHECK_HOURS * 3600
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_in_threadpool(ensure_message_partitions)
+        except Exception as e:
+            logger.error(f"Message partition maintenance failed: {e}")
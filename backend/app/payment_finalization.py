@@ -0,0 +1,235 @@
+"""
+Payment finalisation.
+
+The browser callback (verify-payment), the portal callback, the Razorpay
+webhook and the admin "complete pending payment" action can all report the
+same captured payment, sometimes at the same moment. They all go through
+finalize_payment(), keyed by razorpay_order_id:
+
+  1. The pending transaction for the order is claimed with a conditional
+     UPDATE (... WHERE status IN ('pending', 'failed', 'expired')). The UPDATE locks the
+     row until commit; a concurrent finaliser waits, then matches no row and
+     returns the already completed payment without writing anything.
+  2. The invoice, the completed transaction, the wallet credit and the
+     PaymentLog entry are written in that same database transaction, so a
+     failure anywhere rolls all of it back (and releases the claim).
+
+The transaction row is the idempotency record: once completed it carries the
+payment id and invoice, and any repeat (webhook retries, double clicks)
+costs one UPDATE that matches nothing.
+"""
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+from fastapi import HTTPException
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from . import models
+from .balance_alerts import rearm_low_balance_alert
+from .invoice_numbers import next_invoice_number
+
+# GST rate
+GST_RATE = 0.18  # 18%
+
+# Statuses a captured payment may still complete from (a transaction marked
+# failed after a bad callback signature, or expired by reconciliation, is
+# completed by a verified capture)
+FINALIZABLE_STATUSES = (
+    models.TransactionStatus.PENDING, models.TransactionStatus.FAILED, models.TransactionStatus.EXPIRED
+)
+
+
+def calculate_gst(total_amount_paise: int):
+    """
+    Calculate GST breakdown from total amount
+    If customer pays ₹1000, GST is included, so:
+    - Subtotal = 1000 / 1.18 = 847.46
+    - GST = 152.54 (18%)
+    - Credited to wallet = 847.46
+    """
+    subtotal = int(total_amount_paise / (1 + GST_RATE))
+    gst_amount = total_amount_paise - subtotal
+    # Split GST into CGST and SGST (9% each) for intra-state
+    cgst = gst_amount // 2
+    sgst = gst_amount - cgst
+
+    return {
+        "subtotal": subtotal,
+        "cgst": cgst,
+        "sgst": sgst,
+        "igst": 0,  # For inter-state, we'd use IGST instead
+        "total": total_amount_paise,
+        "credited": subtotal  # Amount added to wallet
+    }
+
+
+def payment_log_entry(
+    event_type: str,
+    source: str,
+    razorpay_payment_id: str,
+    razorpay_order_id: str,
+    razorpay_signature: str = None,
+    user: models.User = None,
+    gst_calc: dict = None,
+    invoice_number: str = None,
+    invoice_id: int = None,
+    new_balance: int = None,
+    raw_data: dict = None
+) -> models.PaymentLog:
+    """PaymentLog row with the payment, customer and GST details"""
+    return models.PaymentLog(
+        event_type=event_type,
+        source=source,
+        razorpay_payment_id=razorpay_payment_id,
+        razorpay_order_id=razorpay_order_id,
+        razorpay_signature=razorpay_signature,
+        user_id=user.id if user else None,
+        user_email=user.email if user else None,
+        user_name=user.name if user else None,
+        user_phone=user.phone if user else None,
+        company_name=user.company_name if user else None,
+        gst_number=user.gst_number if user else None,
+        total_amount=gst_calc["total"] if gst_calc else None,
+        subtotal_amount=gst_calc["subtotal"] if gst_calc else None,
+        gst_amount=(gst_calc["cgst"] + gst_calc["sgst"]) if gst_calc else None,
+        cgst_amount=gst_calc["cgst"] if gst_calc else None,
+        sgst_amount=gst_calc["sgst"] if gst_calc else None,
+        credited_amount=gst_calc["credited"] if gst_calc else None,
+        invoice_number=invoice_number,
+        invoice_id=invoice_id,
+        new_balance=new_balance,
+        raw_data=json.dumps(raw_data, default=str) if raw_data else None
+    )
+
+
+def customer_address(user: models.User) -> Optional[str]:
+    if not user.billing_address:
+        return None
+    parts = [user.billing_address]
+    for part in (user.city, user.state, user.pincode):
+        if part:
+            parts.append(part)
+    return ", ".join(parts)
+
+
+def mark_payment_failed(db: Session, transaction_id: int):
+    """Mark a pending transaction failed (bad callback signature); never touches a completed one"""
+    db.execute(
+        update(models.Transaction)
+        .where(
+            models.Transaction.id == transaction_id,
+            models.Transaction.status == models.TransactionStatus.PENDING
+        )
+        .values(status=models.TransactionStatus.FAILED)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+
+@dataclass
+class FinalizedPayment:
+    transaction: models.Transaction
+    user: Optional[models.User]
+    invoice: Optional[models.Invoice]
+    created: bool  # False when the payment had already been finalised
+    gst_calc: Optional[dict] = None
+
+
+def finalize_payment(
+    db: Session,
+    razorpay_order_id: str,
+    razorpay_payment_id: str,
+    source: str,
+    description: str,
+    event_type: str = "payment.verified",
+    razorpay_signature: str = None,
+    user_id: int = None,
+    amount_paise: int = None,
+    raw_data: dict = None
+) -> Optional[FinalizedPayment]:
+    """
+    Complete the transaction for razorpay_order_id exactly once: invoice,
+    wallet credit and PaymentLog in one database transaction. description is
+    formatted with invoice_number. user_id restricts the order to that user;
+    amount_paise overrides the amount paid (defaults to the transaction's).
+    Returns None when no transaction exists for the order.
+    """
+    conditions = [models.Transaction.razorpay_order_id == razorpay_order_id]
+    if user_id is not None:
+        conditions.append(models.Transaction.user_id == user_id)
+
+    claimed = db.execute(
+        update(models.Transaction)
+        .where(*conditions, models.Transaction.status.in_(FINALIZABLE_STATUSES))
+        .values(razorpay_payment_id=razorpay_payment_id)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+    transaction = db.query(models.Transaction).filter(*conditions).populate_existing().first()
+    if transaction is None:
+        db.commit()
+        return None
+    user = db.get(models.User, transaction.user_id)
+
+    if not claimed:
+        # Already finalised (or finalised concurrently and just committed)
+        invoice = db.get(models.Invoice, transaction.invoice_id) if transaction.invoice_id else None
+        db.commit()
+        return FinalizedPayment(transaction=transaction, user=user, invoice=invoice, created=False)
+
+    if user is None:
+        db.rollback()
+        raise HTTPException(status_code=404, detail="User not found for this transaction")
+
+    gst_calc = calculate_gst(amount_paise if amount_paise is not None else transaction.amount)
+    invoice_number = next_invoice_number(db)
+    invoice = models.Invoice(
+        user_id=user.id,
+        invoice_number=invoice_number,
+        customer_name=user.name,
+        customer_email=user.email,
+        customer_company=user.company_name,
+        customer_gst=user.gst_number,
+        customer_address=customer_address(user),
+        subtotal=gst_calc["subtotal"],
+        cgst_amount=gst_calc["cgst"],
+        sgst_amount=gst_calc["sgst"],
+        igst_amount=gst_calc["igst"],
+        total_amount=gst_calc["total"],
+        credited_amount=gst_calc["credited"],
+        razorpay_payment_id=razorpay_payment_id,
+        payment_date=datetime.utcnow(),
+        status="paid"
+    )
+    db.add(invoice)
+    db.flush()  # Get invoice ID
+
+    if razorpay_signature:
+        transaction.razorpay_signature = razorpay_signature
+    transaction.status = models.TransactionStatus.COMPLETED
+    transaction.invoice_id = invoice.id
+    transaction.amount = gst_calc["credited"]  # Update to credited amount
+    transaction.description = description.format(invoice_number=invoice_number)
+
+    # Credit in SQL so concurrent message debits are not lost
+    user.balance = models.User.balance + gst_calc["credited"]
+    db.flush()
+    db.refresh(user, ["balance"])
+    rearm_low_balance_alert(db, user.id, user.balance)
+
+    db.add(payment_log_entry(
+        event_type=event_type,
+        source=source,
+        razorpay_payment_id=razorpay_payment_id,
+        razorpay_order_id=razorpay_order_id,
+        razorpay_signature=razorpay_signature,
+        user=user,
+        gst_calc=gst_calc,
+        invoice_number=invoice_number,
+        invoice_id=invoice.id,
+        new_balance=user.balance,
+        raw_data=raw_data
+    ))
+    db.commit()
+    return FinalizedPayment(transaction=transaction, user=user, invoice=invoice, created=True, gst_calc=gst_calc)
@@ -0,0 +1,84 @@
+"""
+Phone number normalisation and the cached portal customer lookup.
+
+Users store phone numbers in whatever format they were entered (8700762648,
++918700762648, 918700762648). User.phone_e164 holds the E.164 form
+(+918700762648), kept in sync by a validator on User.phone and covered by a
+unique index, so a portal lookup is a single index seek.
+
+The public portal looks customers up on every hit; results are cached per
+worker for PORTAL_LOOKUP_CACHE_SECONDS (an LRU of the most recent numbers).
+Admin and profile edits clear the cache of the process that made them.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+from sqlalchemy.orm import Session
+from .config import settings
+
+DEFAULT_COUNTRY_CODE = "91"
+
+# Portal lookups: phone_e164 -> (expires_at, customer)
+_PORTAL_CACHE_SIZE = 2048
+_portal_cache: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+_portal_cache_lock = threading.Lock()
+
+
+def normalize_phone(phone: Optional[str]) -> Optional[str]:
+    """E.164 form of a phone number (Indian numbers without country code get +91); None if invalid"""
+    if not phone:
+        return None
+    digits = "".join(filter(str.isdigit, phone))
+    if phone.strip().startswith("+"):
+        return f"+{digits}" if 8 <= len(digits) <= 15 else None
+    if len(digits) == 10:
+        return f"+{DEFAULT_COUNTRY_CODE}{digits}"
+    if len(digits) == 11 and digits.startswith("0"):
+        return f"+{DEFAULT_COUNTRY_CODE}{digits[1:]}"
+    if 11 <= len(digits) <= 15:
+        return f"+{digits}"
+    return None
+
+
+def find_portal_customer(db: Session, phone: str) -> Optional[dict]:
+    """Active, portal-enabled customer with this phone number (cached), or None"""
+    from . import models  # models imports this module for normalize_phone
+
+    phone_e164 = normalize_phone(phone)
+    if not phone_e164:
+        return None
+    now = time.monotonic()
+
+    with _portal_cache_lock:
+        cached = _portal_cache.get(phone_e164)
+        if cached and cached[0] > now:
+            _portal_cache.move_to_end(phone_e164)
+            return cached[1]
+
+    user = db.query(models.User).filter(
+        models.User.phone_e164 == phone_e164,
+        models.User.portal_enabled == True,
+        models.User.is_active == True
+    ).first()
+    if not user:
+        return None
+
+    customer = {
+        "id": user.id,
+        "name": user.name,
+        "phone": user.phone,
+        "email": user.email,
+        "portal_user_id": user.portal_user_id,
+    }
+    with _portal_cache_lock:
+        _portal_cache[phone_e164] = (now + settings.PORTAL_LOOKUP_CACHE_SECONDS, customer)
+        _portal_cache.move_to_end(phone_e164)
+        while len(_portal_cache) > _PORTAL_CACHE_SIZE:
+            _portal_cache.popitem(last=False)
+    return customer
+
+
+def clear_portal_cache():
+    with _portal_cache_lock:
+        _portal_cache.clear()
@@ -0,0 +1,191 @@
+"""
+Rate limiting for the unauthenticated public portal endpoints.
+
+Limits are sliding-window counters: a request is allowed while
+
+    previous_window_count * (1 - elapsed / window) + current_window_count <= limit
+
+which smooths the burst a fixed window allows at its boundary and needs only
+two counters per key. Keys are per client IP (rate_limit_middleware, rules in
+PORTAL_RULES) and per normalised phone number (check_phone_rate_limit, called
+by the portal endpoints once they have parsed the number).
+
+Counters live in process memory by default. Set RATE_LIMIT_STORAGE_URL to a
+redis:// URL to share them between workers and instances (needs the redis
+package). If the shared store is unreachable requests are let through.
+
+Over the limit, the response is 429 with a Retry-After header.
+"""
+import logging
+import math
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from fastapi import HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from .config import settings
+from .phones import normalize_phone
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMITED_DETAIL = "Too many requests, please try again later"
+
+UNITS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+def parse_rate(rate: str) -> Tuple[int, int]:
+    """"30/minute" -> (30, 60)"""
+    count, _, unit = rate.strip().partition("/")
+    unit = unit.strip().lower().rstrip("s")
+    if unit not in UNITS:
+        raise ValueError(f"Invalid rate {rate!r}, expected e.g. 30/minute")
+    return int(count), UNITS[unit]
+
+
+class MemoryBackend:
+    """Counters in this process: {key: (window index, current count, previous count)}"""
+    blocking = False
+    MAX_KEYS = 100_000
+
+    def __init__(self):
+        self._counters: Dict[str, Tuple[int, int, int]] = {}
+        self._lock = threading.Lock()
+
+    def hit(self, key: str, window: int, now: float) -> Tuple[int, int]:
+        """Count a request; returns (current, previous) window counts including it"""
+        index = int(now // window)
+        counter_key = f"{key}:{window}"
+        with self._lock:
+            stored_index, current, previous = self._counters.get(counter_key, (index, 0, 0))
+            if stored_index != index:
+                previous = current if stored_index == index - 1 else 0
+                current = 0
+            current += 1
+            self._counters[counter_key] = (index, current, previous)
+            if len(self._counters) > self.MAX_KEYS:
+                self._prune(now)
+            return current, previous
+
+    def _prune(self, now: float):
+        """Drop counters idle for two windows (they no longer affect any decision)"""
+        stale = [
+            counter_key for counter_key, (index, _, _) in self._counters.items()
+            if int(now // int(counter_key.rsplit(":", 1)[1])) - index > 1
+        ]
+        for counter_key in stale:
+            del self._counters[counter_key]
+
+
+class RedisBackend:
+    """Counters shared through Redis: one INCR'd key per window"""
+    blocking = True
+
+    def __init__(self, url: str):
+        import redis  # only needed for a shared rate limit store
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+    def hit(self, key: str, window: int, now: float) -> Tuple[int, int]:
+        index = int(now // window)
+        current_key = f"ratelimit:{key}:{window}:{index}"
+        pipe = self.client.pipeline()
+        pipe.incr(current_key)
+        pipe.expire(current_key, window * 2)
+        pipe.get(f"ratelimit:{key}:{window}:{index - 1}")
+        current, _, previous = pipe.execute()
+        return int(current), int(previous or 0)
+
+
+class RateLimiter:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def check(self, key: str, limit: int, window: int) -> Optional[int]:
+        """Count a request for key; returns None if allowed, else seconds until retry"""
+        now = time.time()
+        try:
+            current, previous = self.backend.hit(key, window, now)
+        except Exception as e:
+            logger.error(f"Rate limit store unavailable, allowing request: {e}")
+            return None
+        elapsed = now % window
+        weighted = previous * (1 - elapsed / window) + current
+        if weighted <= limit:
+            return None
+        # Until the previous window's share has decayed enough (at most the rest of this window)
+        if previous and current <= limit:
+            wait = window * (1 - (limit - current) / previous) - elapsed
+        else:
+            wait = window - elapsed
+        return max(1, math.ceil(wait))
+
+
+def _create_limiter() -> RateLimiter:
+    url = settings.RATE_LIMIT_STORAGE_URL
+    if url.startswith(("redis://", "rediss://")):
+        return RateLimiter(RedisBackend(url))
+    return RateLimiter(MemoryBackend())
+
+
+limiter = _create_limiter()
+
+# (path prefix, rule name, rate): every matching rule applies, per client IP
+PORTAL_RULES: List[Tuple[str, str, Tuple[int, int]]] = [
+    ("/payments/public/create-order", "portal-order", parse_rate(settings.PORTAL_RATE_LIMIT_ORDER_IP)),
+    ("/payments/public/", "portal", parse_rate(settings.PORTAL_RATE_LIMIT_IP)),
+]
+PHONE_RATE = parse_rate(settings.PORTAL_RATE_LIMIT_PHONE)
+
+
+def client_ip(request: Request) -> str:
+    """
+    Each trusted proxy appends the address it received the request from to
+    X-Forwarded-For, so the client is RATE_LIMIT_TRUSTED_PROXIES entries from
+    the right; anything further left was sent by the client and can be forged.
+    """
+    hops = settings.RATE_LIMIT_TRUSTED_PROXIES
+    if hops > 0:
+        forwarded = [ip.strip() for ip in ",".join(request.headers.getlist("x-forwarded-for")).split(",") if ip.strip()]
+        if len(forwarded) >= hops:
+            return forwarded[-hops]
+    return request.client.host if request.client else "unknown"
+
+
+def _too_many_requests(retry_after: int) -> JSONResponse:
+    return JSONResponse(
+        status_code=429,
+        content={"detail": RATE_LIMITED_DETAIL},
+        headers={"Retry-After": str(retry_after)}
+    )
+
+
+async def rate_limit_middleware(request: Request, call_next):
+    path = request.url.path
+    rules = [(name, rate) for prefix, name, rate in PORTAL_RULES if path.startswith(prefix)]
+    if rules and request.method != "OPTIONS":
+        ip = client_ip(request)
+        for name, (limit, window) in rules:
+            key = f"{name}:ip:{ip}"
+            if limiter.backend.blocking:
+                retry_after = await run_in_threadpool(limiter.check, key, limit, window)
+            else:
+                retry_after = limiter.check(key, limit, window)
+            if retry_after:
+                logger.warning(f"Rate limited {ip} on {path} ({name})")
+                return _too_many_requests(retry_after)
+    return await call_next(request)
+
+
+def check_phone_rate_limit(phone: str):
+    """Raise 429 when this phone number has been looked up too often"""
+    key = normalize_phone(phone)
+    if not key:
+        return
+    limit, window = PHONE_RATE
+    retry_after = limiter.check(f"portal:phone:{key}", limit, window)
+    if retry_after:
+        raise HTTPException(
+            status_code=429,
+            detail=RATE_LIMITED_DETAIL,
+            headers={"Retry-After": str(retry_after)}
+        )
@@ -0,0 +1,234 @@
+"""
+Batch reconciliation of pending Razorpay orders.
+
+Instead of two Razorpay calls per pending order, one run pages through every
+Razorpay payment created in the window (GET /payments, 100 per page, pages
+fetched RECONCILE_CONCURRENCY at a time) and matches them against the pending
+credit transactions of the same window through an order id index:
+
+  - captured payment  -> finalize_payment (invoice + wallet credit, idempotent)
+  - authorized only   -> reported, left pending (needs capture in Razorpay)
+  - nothing, and the order is older than RECONCILE_EXPIRE_HOURS -> expired
+
+Runs from the admin endpoint, reconcile_payments.py, or every
+RECONCILE_INTERVAL_MINUTES in the app (0 disables the schedule).
+"""
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+import razorpay
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import update
+from . import models
+from .config import settings
+from .database import SessionLocal
+from .invoices import prerender_invoice
+from .metrics import provider_call
+from .payment_finalization import finalize_payment
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 100  # Razorpay maximum
+
+
+def _razorpay_client():
+    if not settings.RAZORPAY_KEY_ID or not settings.RAZORPAY_KEY_SECRET:
+        raise RuntimeError("Razorpay not configured")
+    return razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
+
+
+def fetch_payments(client, start: datetime, end: datetime, concurrency: int) -> List[dict]:
+    """All Razorpay payments created in [start, end], fetching pages concurrently"""
+    params = {"from": int(start.timestamp()), "to": int(end.timestamp()), "count": PAGE_SIZE}
+
+    def page(skip: int) -> List[dict]:
+        with provider_call("razorpay"):
+            return client.payment.all({**params, "skip": skip}).get("items", [])
+
+    payments = []
+    skip = 0
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="reconcile-fetch") as pool:
+        while True:
+            pages = list(pool.map(page, [skip + i * PAGE_SIZE for i in range(concurrency)]))
+            for items in pages:
+                payments.extend(items)
+            if len(pages[-1]) < PAGE_SIZE:
+                return payments
+            skip += concurrency * PAGE_SIZE
+
+
+def _pending_orders(start: datetime) -> Dict[str, dict]:
+    """Pending credit transactions of the window, by Razorpay order id"""
+    db = SessionLocal()
+    try:
+        rows = db.query(
+            models.Transaction.id, models.Transaction.razorpay_order_id,
+            models.Transaction.user_id, models.Transaction.created_at
+        ).filter(
+            models.Transaction.type == models.TransactionType.CREDIT,
+            models.Transaction.status == models.TransactionStatus.PENDING,
+            models.Transaction.razorpay_order_id.isnot(None),
+            models.Transaction.created_at >= start
+        ).all()
+        return {
+            row.razorpay_order_id: {"transaction_id": row.id, "user_id": row.user_id, "created_at": row.created_at}
+            for row in rows
+        }
+    finally:
+        db.close()
+
+
+def _finalize(order_id: str, payment: dict) -> dict:
+    db = SessionLocal()
+    try:
+        result = finalize_payment(
+            db,
+            razorpay_order_id=order_id,
+            razorpay_payment_id=payment["id"],
+            amount_paise=payment.get("amount"),
+            event_type="payment.reconciled",
+            source="reconciliation",
+            description="Wallet recharge - Invoice #{invoice_number}",
+            raw_data=payment
+        )
+        if result is None:
+            return {"order_id": order_id, "outcome": "missing"}
+        if not result.created:
+            return {"order_id": order_id, "outcome": "already_completed"}
+        prerender_invoice(result.invoice.id)
+        return {
+            "order_id": order_id,
+            "outcome": "completed",
+            "payment_id": payment["id"],
+            "invoice_number": result.invoice.invoice_number,
+            "credited_paise": result.gst_calc["credited"],
+            "user_id": result.user.id
+        }
+    except Exception as e:
+        logger.error(f"Reconciliation could not finalise order {order_id}: {e}")
+        return {"order_id": order_id, "outcome": "error", "error": str(e)}
+    finally:
+        db.close()
+
+
+def _expire(transaction_ids: List[int]) -> int:
+    if not transaction_ids:
+        return 0
+    db = SessionLocal()
+    try:
+        # Only still-pending rows: a callback may have completed one meanwhile
+        expired = db.execute(
+            update(models.Transaction)
+            .where(
+                models.Transaction.id.in_(transaction_ids),
+                models.Transaction.status == models.TransactionStatus.PENDING
+            )
+            .values(status=models.TransactionStatus.EXPIRED)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.commit()
+        return expired
+    finally:
+        db.close()
+
+
+def reconcile_payments(window_hours: Optional[float] = None, expire_after_hours: Optional[float] = None,
+                       dry_run: bool = False, client=None) -> dict:
+    """Match pending orders of the last window_hours against Razorpay; returns the report"""
+    if window_hours is None:
+        window_hours = settings.RECONCILE_WINDOW_HOURS
+    if expire_after_hours is None:
+        expire_after_hours = settings.RECONCILE_EXPIRE_HOURS
+    concurrency = max(1, settings.RECONCILE_CONCURRENCY)
+    started = time.perf_counter()
+    end = datetime.now(timezone.utc)
+    start = end - timedelta(hours=window_hours)
+
+    pending = _pending_orders(start)
+    report = {
+        "window_start": start.isoformat(),
+        "window_end": end.isoformat(),
+        "dry_run": dry_run,
+        "pending_orders": len(pending),
+        "razorpay_payments": 0,
+        "completed": [],
+        "already_completed": 0,
+        "authorized": [],
+        "expired": [],
+        "still_pending": 0,
+        "errors": [],
+    }
+    if not pending:
+        report["duration_seconds"] = round(time.perf_counter() - started, 3)
+        return report
+
+    payments = fetch_payments(client or _razorpay_client(), start, end, concurrency)
+    report["razorpay_payments"] = len(payments)
+
+    captured: Dict[str, dict] = {}
+    authorized = set()
+    for payment in payments:
+        order_id = payment.get("order_id")
+        if order_id not in pending:
+            continue
+        if payment.get("status") == "captured":
+            captured[order_id] = payment
+        elif payment.get("status") == "authorized":
+            authorized.add(order_id)
+
+    if dry_run:
+        report["completed"] = [
+            {"order_id": order_id, "outcome": "would_complete", "payment_id": payment["id"]}
+            for order_id, payment in captured.items()
+        ]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="reconcile-finalize") as pool:
+            results = list(pool.map(lambda item: _finalize(*item), captured.items()))
+        for result in results:
+            if result["outcome"] == "completed":
+                report["completed"].append(result)
+            elif result["outcome"] == "error":
+                report["errors"].append(result)
+            else:
+                report["already_completed"] += 1
+
+    expire_before = end - timedelta(hours=expire_after_hours)
+    stale = []
+    for order_id, order in pending.items():
+        if order_id in captured:
+            continue
+        if order_id in authorized:
+            report["authorized"].append(order_id)
+            continue
+        created_at = order["created_at"]
+        if created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=timezone.utc)  # SQLite
+        if created_at < expire_before:
+            stale.append(order)
+            report["expired"].append(order_id)
+        else:
+            report["still_pending"] += 1
+
+    if not dry_run:
+        _expire([order["transaction_id"] for order in stale])
+
+    report["duration_seconds"] = round(time.perf_counter() - started, 3)
+    logger.info(
+        f"Reconciliation: {len(pending)} pending, {len(report['completed'])} completed, "
+        f"{len(report['expired'])} expired, {len(report['errors'])} errors"
+    )
+    return report
+
+
+async def reconciliation_loop():
+    """Background task reconciling pending orders every RECONCILE_INTERVAL_MINUTES"""
+    interval = settings.RECONCILE_INTERVAL_MINUTES * 60
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_in_threadpool(reconcile_payments)
+        except Exception as e:
+            logger.error(f"Payment reconciliation failed: {e}")
@@ -1,7 +1,7 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, File, BackgroundTasks
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, File, BackgroundTasks, Request, Response
+from sqlalchemy.orm import Session, joinedload
 from sqlalchemy import func
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from typing import List, Optional
 from pydantic import BaseModel
 import csv
@@ -9,10 +9,19 @@ import io
 import os
 import razorpay
 from .. import models, schemas
-from ..database import get_db
+from ..counters import platform_counter, reconcile_counters
+from ..database import get_db, get_read_db, async_engine, replica_engine, replica_lag, pool_stats
+from ..pagination import keyset_page, page_total, NEXT_CURSOR_HEADER
 from ..auth import get_current_admin
 from ..config import settings
-from ..email_utils import check_and_send_low_balance_alert
+from ..balance_alerts import rearm_low_balance_alert, record_alerts, schedule_low_balance_check
+from ..metrics import provider_call
+from ..archive import archived_field
+from ..exports import payment_logs_csv_response
+from ..invoices import invalidate_company_cache, invoice_bundle_response, prerender_invoice, regenerate_invoices
+from ..payment_finalization import finalize_payment
+from ..phones import clear_portal_cache, normalize_phone
+from ..reconciliation import reconcile_payments
 
 # Twilio configuration
 TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
@@ -45,14 +54,11 @@ def get_admin_dashboard(
         models.User.is_active == True
     ).count()
 
-    # Total revenue (all completed credit transactions)
-    total_revenue = db.query(func.sum(models.Transaction.amount)).filter(
-        models.Transaction.type == "credit",
-        models.Transaction.status == "completed"
-    ).scalar() or 0
-
-    # Total messages
-    total_messages = db.query(models.Message).count()
+    # Total revenue (all completed credit transactions) and total messages
+    # are summed from the per-tenant counter rows
+    counter = platform_counter(db)
+    total_revenue = counter.revenue_total
+    total_messages = counter.messages_total
 
     # Messages today
     today = datetime.utcnow().date()
@@ -69,6 +75,27 @@ def get_admin_dashboard(
         messages_today=messages_today
     )
 
+@router.post("/counters/reconcile")
+def reconcile_tenant_counters(
+    fix: bool = Query(False, description="Overwrite drifted counters with recomputed values"),
+    admin: models.User = Depends(get_current_admin),
+    db: Session = Depends(get_db)
+):
+    """
+    Recompute dashboard counters from messages and transactions and report drift.
+    Use fix=true to repair drifted counters.
+    """
+    return reconcile_counters(db, fix=fix)
+
+
+@router.get("/db/pool-stats")
+def get_pool_stats(admin: models.User = Depends(get_current_admin)):
+    """Connection pool usage and checkout wait times of the worker serving this request"""
+    stats = {**pool_stats(), "async": pool_stats(async_engine)}
+    if replica_engine is not None:
+        stats["replica"] = {**pool_stats(replica_engine), "lag_seconds": replica_lag()}
+    return stats
+
 @router.get("/customers", response_model=List[schemas.UserResponse])
 def get_customers(
     skip: int = Query(0, ge=0),
@@ -111,6 +138,10 @@ def create_customer(
         phone = ''.join(filter(str.isdigit, customer.phone))
         if len(phone) == 12 and phone.startswith('91'):
             phone = phone[2:]
+        if normalize_phone(phone) and db.query(models.User).filter(
+            models.User.phone_e164 == normalize_phone(phone)
+        ).first():
+            raise HTTPException(status_code=400, detail="Phone number already registered")
 
     # Generate password if not provided
     password = customer.password or secrets.token_urlsafe(8)
@@ -212,6 +243,7 @@ def impersonate_customer(
 def update_customer(
     user_id: int,
     update_data: schemas.AdminUserUpdate,
+    background_tasks: BackgroundTasks,
     admin: models.User = Depends(get_current_admin),
     db: Session = Depends(get_db)
 ):
@@ -234,6 +266,11 @@ def update_customer(
         phone = ''.join(filter(str.isdigit, update_data.phone))
         if len(phone) == 12 and phone.startswith('91'):
             phone = phone[2:]
+        if normalize_phone(phone) and db.query(models.User).filter(
+            models.User.phone_e164 == normalize_phone(phone),
+            models.User.id != user.id
+        ).first():
+            raise HTTPException(status_code=400, detail="Phone number already in use")
         user.phone = phone
 
     if update_data.balance_adjustment:
@@ -252,7 +289,12 @@ def update_customer(
         if user.balance < 0:
             user.balance = 0  # Don't allow negative balance
 
+        rearm_low_balance_alert(db, user.id, user.balance)
+        # A debit adjustment may take the balance below the threshold
+        schedule_low_balance_check(background_tasks, user.id)
+
     db.commit()
+    clear_portal_cache()  # portal access or phone may have changed
     db.refresh(user)
 
     return {
@@ -655,8 +697,8 @@ def import_messages_csv(
             )
             db.add(transaction)
 
-            # Check for low balance and send alert in background
-            background_tasks.add_task(check_and_send_low_balance_alert, user)
+            # Alert in the background if the balance crossed the low threshold
+            schedule_low_balance_check(background_tasks, user.id)
 
         db.commit()
 
@@ -681,18 +723,22 @@ def import_messages_csv(
 # All transactions (for admin overview)
 @router.get("/transactions", response_model=List[schemas.TransactionResponse])
 def get_all_transactions(
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(50, ge=1, le=100),
     type: str = Query(None),
+    cursor: Optional[str] = Query(None, description="Cursor from the X-Next-Cursor header of the previous page"),
     admin: models.User = Depends(get_current_admin),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     query = db.query(models.Transaction)
 
     if type:
         query = query.filter(models.Transaction.type == type)
 
-    transactions = query.order_by(models.Transaction.created_at.desc()).offset(skip).limit(limit).all()
+    transactions, next_cursor = keyset_page(query, models.Transaction, limit, cursor=cursor, skip=skip)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
 
     result = []
     for t in transactions:
@@ -715,14 +761,18 @@ def get_all_transactions(
 # All messages (for admin overview)
 @router.get("/messages", response_model=List[schemas.MessageResponse])
 def get_all_messages(
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(50, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="Cursor from the X-Next-Cursor header of the previous page"),
     admin: models.User = Depends(get_current_admin),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    messages = db.query(models.Message).order_by(
-        models.Message.created_at.desc()
-    ).offset(skip).limit(limit).all()
+    messages, next_cursor = keyset_page(
+        db.query(models.Message), models.Message, limit, cursor=cursor, skip=skip
+    )
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
 
     result = []
     for m in messages:
@@ -857,11 +907,13 @@ def get_phone_mappings(
     db: Session = Depends(get_db)
 ):
     """Get all phone number to customer mappings"""
-    mappings = db.query(models.PhoneMapping).all()
+    mappings = db.query(models.PhoneMapping).options(
+        joinedload(models.PhoneMapping.user)
+    ).all()
 
     result = []
     for m in mappings:
-        user = db.query(models.User).filter(models.User.id == m.user_id).first()
+        user = m.user
         result.append({
             "id": m.id,
             "phone_number": m.phone_number,
@@ -1011,10 +1063,11 @@ def sync_twilio_messages(
 
         # Fetch messages from this Twilio account
         try:
-            twilio_messages = client.messages.list(
-                date_sent_after=date_from,
-                limit=1000
-            )
+            with provider_call("twilio"):
+                twilio_messages = client.messages.list(
+                    date_sent_after=date_from,
+                    limit=1000
+                )
         except Exception as e:
             continue  # Skip this credential group if fetch fails
 
@@ -1127,8 +1180,8 @@ def sync_twilio_messages(
                 )
                 db.add(transaction)
 
-                # Check for low balance and send alert in background
-                background_tasks.add_task(check_and_send_low_balance_alert, user)
+                # Alert in the background if the balance crossed the low threshold
+                schedule_low_balance_check(background_tasks, user.id)
 
     db.commit()
 
@@ -1156,8 +1209,10 @@ def get_payment_logs(
     skip: int = Query(0, ge=0),
     limit: int = Query(50, ge=1, le=200),
     user_id: int = Query(None, description="Filter by user ID"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    exact_total: bool = Query(False, description="Run an exact COUNT(*) instead of estimating total"),
     admin: models.User = Depends(get_current_admin),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Get all payment logs for auditing/reporting"""
     query = db.query(models.PaymentLog)
@@ -1165,11 +1220,14 @@ def get_payment_logs(
     if user_id:
         query = query.filter(models.PaymentLog.user_id == user_id)
 
-    total = query.count()
-    logs = query.order_by(models.PaymentLog.created_at.desc()).offset(skip).limit(limit).all()
+    total, total_is_estimate = page_total(query, models.PaymentLog, exact=exact_total, filtered=bool(user_id))
+    logs, next_cursor = keyset_page(query, models.PaymentLog, limit, cursor=cursor, skip=skip)
 
     return {
         "total": total,
+        "total_is_estimate": total_is_estimate,
+        "has_more": next_cursor is not None,
+        "next_cursor": next_cursor,
         "logs": [
             {
                 "id": log.id,
@@ -1204,7 +1262,7 @@ def get_payment_logs(
 def get_payment_log_detail(
     log_id: int,
     admin: models.User = Depends(get_current_admin),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Get detailed payment log including raw data"""
     log = db.query(models.PaymentLog).filter(models.PaymentLog.id == log_id).first()
@@ -1213,6 +1271,7 @@ def get_payment_log_detail(
         raise HTTPException(status_code=404, detail="Payment log not found")
 
     import json
+    raw_data = archived_field(log, "raw_data")  # read-through for archived logs
     return {
         "id": log.id,
         "event_type": log.event_type,
@@ -1244,39 +1303,22 @@ def get_payment_log_detail(
         "invoice_id": log.invoice_id,
         "new_balance_paise": log.new_balance,
         "new_balance_rupees": log.new_balance / 100 if log.new_balance else None,
-        "raw_data": json.loads(log.raw_data) if log.raw_data else None,
+        "raw_data": json.loads(raw_data) if raw_data else None,
         "created_at": log.created_at
     }
 
 
 @router.get("/payment-logs/export/csv")
 def export_payment_logs_csv(
-    admin: models.User = Depends(get_current_admin),
-    db: Session = Depends(get_db)
+    request: Request,
+    date_from: Optional[date] = Query(None, description="Only logs created on or after this date"),
+    date_to: Optional[date] = Query(None, description="Only logs created on or before this date"),
+    user_id: Optional[int] = Query(None, description="Filter by user ID"),
+    gzip: bool = Query(False, description="Download as .csv.gz"),
+    admin: models.User = Depends(get_current_admin)
 ):
-    """Export all payment logs as CSV"""
-    logs = db.query(models.PaymentLog).order_by(models.PaymentLog.created_at.desc()).all()
-
-    # Build CSV content
-    csv_lines = [
-        "ID,Event,Source,Razorpay Payment ID,Razorpay Order ID,User ID,User Email,User Name,Phone,Company,GST Number,Total (Paise),Total (Rs),Subtotal,GST,Credited,Invoice Number,New Balance,Created At"
-    ]
-
-    for log in logs:
-        csv_lines.append(
-            f"{log.id},{log.event_type},{log.source},{log.razorpay_payment_id},{log.razorpay_order_id},"
-            f"{log.user_id},{log.user_email},{log.user_name},{log.user_phone},{log.company_name},{log.gst_number},"
-            f"{log.total_amount},{log.total_amount / 100 if log.total_amount else ''},"
-            f"{log.subtotal_amount},{log.gst_amount},{log.credited_amount},"
-            f"{log.invoice_number},{log.new_balance},{log.created_at}"
-        )
-
-    from fastapi.responses import PlainTextResponse
-    return PlainTextResponse(
-        content="\n".join(csv_lines),
-        media_type="text/csv",
-        headers={"Content-Disposition": "attachment; filename=payment_logs.csv"}
-    )
+    """Export payment logs as CSV (streamed)"""
+    return payment_logs_csv_response(request, date_from, date_to, user_id, compress=gzip)
 
 
 # ========== Public Payment Logs API (API Key Authentication) ==========
@@ -1301,13 +1343,17 @@ def get_public_payment_logs(
     skip: int = Query(0, ge=0),
     limit: int = Query(50, ge=1, le=200),
     user_id: int = Query(None, description="Filter by user ID"),
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    exact_total: bool = Query(False, description="Run an exact COUNT(*) instead of estimating total"),
+    db: Session = Depends(get_read_db)
 ):
     """
     Public endpoint to get payment logs using API key.
 
     Share this URL with others:
     GET /api/admin/public/payment-logs?api_key=YOUR_API_KEY&limit=50
+    Follow next_cursor (&cursor=...) to fetch further pages.
+    total is an estimate unless exact_total=true is passed.
     """
     verify_api_key(api_key)
 
@@ -1316,11 +1362,14 @@ def get_public_payment_logs(
     if user_id:
         query = query.filter(models.PaymentLog.user_id == user_id)
 
-    total = query.count()
-    logs = query.order_by(models.PaymentLog.created_at.desc()).offset(skip).limit(limit).all()
+    total, total_is_estimate = page_total(query, models.PaymentLog, exact=exact_total, filtered=bool(user_id))
+    logs, next_cursor = keyset_page(query, models.PaymentLog, limit, cursor=cursor, skip=skip)
 
     return {
         "total": total,
+        "total_is_estimate": total_is_estimate,
+        "has_more": next_cursor is not None,
+        "next_cursor": next_cursor,
         "logs": [
             {
                 "id": log.id,
@@ -1355,7 +1404,7 @@ def get_public_payment_logs(
 def get_public_payment_log_detail(
     log_id: int,
     api_key: str = Query(..., description="API key for authentication"),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Public endpoint to get detailed payment log using API key.
@@ -1371,6 +1420,7 @@ def get_public_payment_log_detail(
         raise HTTPException(status_code=404, detail="Payment log not found")
 
     import json
+    raw_data = archived_field(log, "raw_data")  # read-through for archived logs
     return {
         "id": log.id,
         "event_type": log.event_type,
@@ -1402,80 +1452,35 @@ def get_public_payment_log_detail(
         "invoice_id": log.invoice_id,
         "new_balance_paise": log.new_balance,
         "new_balance_rupees": log.new_balance / 100 if log.new_balance else None,
-        "raw_data": json.loads(log.raw_data) if log.raw_data else None,
+        "raw_data": json.loads(raw_data) if raw_data else None,
         "created_at": log.created_at.isoformat() if log.created_at else None
     }
 
 
 @router.get("/public/payment-logs/export/csv")
 def export_public_payment_logs_csv(
+    request: Request,
     api_key: str = Query(..., description="API key for authentication"),
-    db: Session = Depends(get_db)
+    date_from: Optional[date] = Query(None, description="Only logs created on or after this date"),
+    date_to: Optional[date] = Query(None, description="Only logs created on or before this date"),
+    user_id: Optional[int] = Query(None, description="Filter by user ID"),
+    gzip: bool = Query(False, description="Download as .csv.gz")
 ):
     """
     Public endpoint to export payment logs as CSV using API key.
 
     Share this URL:
     GET /api/admin/public/payment-logs/export/csv?api_key=YOUR_API_KEY
+    Optional: date_from / date_to (YYYY-MM-DD), user_id, gzip=true
     """
     verify_api_key(api_key)
-
-    logs = db.query(models.PaymentLog).order_by(models.PaymentLog.created_at.desc()).all()
-
-    csv_lines = [
-        "ID,Event,Source,Razorpay Payment ID,Razorpay Order ID,User ID,User Email,User Name,Phone,Company,GST Number,Total (Paise),Total (Rs),Subtotal,GST,Credited,Invoice Number,New Balance,Created At"
-    ]
-
-    for log in logs:
-        csv_lines.append(
-            f"{log.id},{log.event_type},{log.source},{log.razorpay_payment_id},{log.razorpay_order_id},"
-            f"{log.user_id},{log.user_email},{log.user_name},{log.user_phone},{log.company_name},{log.gst_number},"
-            f"{log.total_amount},{log.total_amount / 100 if log.total_amount else ''},"
-            f"{log.subtotal_amount},{log.gst_amount},{log.credited_amount},"
-            f"{log.invoice_number},{log.new_balance},{log.created_at}"
-        )
-
-    from fastapi.responses import PlainTextResponse
-    return PlainTextResponse(
-        content="\n".join(csv_lines),
-        media_type="text/csv",
-        headers={"Content-Disposition": "attachment; filename=payment_logs.csv"}
-    )
-
-
-# GST rate (same as in payments.py)
-GST_RATE = 0.18
-
-def calculate_gst(total_amount_paise: int):
-    """Calculate GST breakdown from total amount"""
-    subtotal = int(total_amount_paise / (1 + GST_RATE))
-    gst_amount = total_amount_paise - subtotal
-    cgst = gst_amount // 2
-    sgst = gst_amount - cgst
-    return {
-        "subtotal": subtotal,
-        "cgst": cgst,
-        "sgst": sgst,
-        "igst": 0,
-        "total": total_amount_paise,
-        "credited": subtotal
-    }
-
-
-def generate_invoice_number_admin(db: Session) -> str:
-    """Generate unique invoice number like TZ-2024-0001"""
-    year = datetime.now().year
-    company = db.query(models.CompanyConfig).first()
-    prefix = company.invoice_prefix if company else "TZ"
-    count = db.query(models.Invoice).filter(
-        models.Invoice.invoice_number.like(f"{prefix}-{year}-%")
-    ).count()
-    return f"{prefix}-{year}-{str(count + 1).zfill(4)}"
+    return payment_logs_csv_response(request, date_from, date_to, user_id, compress=gzip)
 
 
 @router.post("/complete-pending-payment/{order_id}")
 def complete_pending_payment(
     order_id: str,
+    background_tasks: BackgroundTasks,
     admin: models.User = Depends(get_current_admin),
     db: Session = Depends(get_db)
 ):
@@ -1512,7 +1517,8 @@ def complete_pending_payment(
 
     # Fetch order from Razorpay
     try:
-        razorpay_order = client.order.fetch(order_id)
+        with provider_call("razorpay"):
+            razorpay_order = client.order.fetch(order_id)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Failed to fetch order from Razorpay: {str(e)}")
 
@@ -1526,7 +1532,8 @@ def complete_pending_payment(
 
     # Order is paid, fetch payments for this order
     try:
-        payments = client.order.payments(order_id)
+        with provider_call("razorpay"):
+            payments = client.order.payments(order_id)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Failed to fetch payments: {str(e)}")
 
@@ -1544,65 +1551,27 @@ def complete_pending_payment(
             "payments": payments
         }
 
-    # Get the user
-    user = db.query(models.User).filter(models.User.id == transaction.user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found for this transaction")
-
-    # Calculate GST based on original transaction amount (which is total paid)
-    original_amount = razorpay_order.get("amount", transaction.amount)
-    gst_calc = calculate_gst(original_amount)
-
-    # Generate invoice
-    invoice_number = generate_invoice_number_admin(db)
-
-    # Build customer address
-    customer_address = None
-    if user.billing_address:
-        parts = [user.billing_address]
-        if user.city:
-            parts.append(user.city)
-        if user.state:
-            parts.append(user.state)
-        if user.pincode:
-            parts.append(user.pincode)
-        customer_address = ", ".join(parts)
-
-    # Create invoice
-    invoice = models.Invoice(
-        user_id=user.id,
-        invoice_number=invoice_number,
-        customer_name=user.name,
-        customer_email=user.email,
-        customer_company=user.company_name,
-        customer_gst=user.gst_number,
-        customer_address=customer_address,
-        subtotal=gst_calc["subtotal"],
-        cgst_amount=gst_calc["cgst"],
-        sgst_amount=gst_calc["sgst"],
-        igst_amount=gst_calc["igst"],
-        total_amount=gst_calc["total"],
-        credited_amount=gst_calc["credited"],
+    # GST is based on the amount Razorpay collected for the order (the total paid)
+    old_balance = db.query(models.User.balance).filter(models.User.id == transaction.user_id).scalar()
+    result = finalize_payment(
+        db,
+        razorpay_order_id=order_id,
         razorpay_payment_id=captured_payment["id"],
-        payment_date=datetime.utcnow(),
-        status="paid"
+        amount_paise=razorpay_order.get("amount", transaction.amount),
+        source="admin_complete_payment",
+        description="Wallet recharge - Invoice #{invoice_number} (Admin completed)",
+        raw_data={"razorpay_order": razorpay_order, "razorpay_payment": captured_payment, "admin_id": admin.id}
     )
-    db.add(invoice)
-    db.flush()
-
-    # Update transaction
-    transaction.razorpay_payment_id = captured_payment["id"]
-    transaction.status = "completed"
-    transaction.invoice_id = invoice.id
-    transaction.amount = gst_calc["credited"]
-    transaction.description = f"Wallet recharge - Invoice #{invoice_number} (Admin completed)"
-
-    # Add credited amount to user balance
-    old_balance = user.balance
-    user.balance += gst_calc["credited"]
-
-    db.commit()
-    db.refresh(user)
+    if not result.created:
+        # Completed by the customer's callback or the webhook meanwhile
+        return {
+            "status": "already_completed",
+            "message": "This transaction is already completed",
+            "transaction_id": result.transaction.id,
+            "user_balance": result.user.balance / 100 if result.user else None
+        }
+    gst_calc, user, invoice_number = result.gst_calc, result.user, result.invoice.invoice_number
+    background_tasks.add_task(prerender_invoice, result.invoice.id)
 
     return {
         "status": "success",
@@ -1617,6 +1586,126 @@ def complete_pending_payment(
     }
 
 
+@router.get("/company-config", response_model=schemas.CompanyConfigResponse)
+def get_company_config(
+    admin: models.User = Depends(get_current_admin),
+    db: Session = Depends(get_db)
+):
+    """Company details printed on invoices"""
+    company = db.query(models.CompanyConfig).first()
+    if not company:
+        raise HTTPException(status_code=404, detail="Company config not found")
+    return company
+
+
+@router.put("/company-config", response_model=schemas.CompanyConfigResponse)
+def update_company_config(
+    update: schemas.CompanyConfigUpdate,
+    background_tasks: BackgroundTasks,
+    admin: models.User = Depends(get_current_admin),
+    db: Session = Depends(get_db)
+):
+    """Update company details; stored invoice documents are regenerated in the background"""
+    company = db.query(models.CompanyConfig).first()
+    if not company:
+        raise HTTPException(status_code=404, detail="Company config not found")
+
+    for field, value in update.model_dump(exclude_unset=True).items():
+        setattr(company, field, value)
+    db.commit()
+    db.refresh(company)
+
+    invalidate_company_cache()
+    background_tasks.add_task(regenerate_invoices)
+    return company
+
+
+@router.post("/invoices/regenerate")
+def regenerate_invoice_documents(
+    background_tasks: BackgroundTasks,
+    admin: models.User = Depends(get_current_admin)
+):
+    """Re-render stored invoice documents made with outdated company details"""
+    background_tasks.add_task(regenerate_invoices)
+    return {"status": "started"}
+
+
+@router.get("/invoices/bundle")
+def download_invoice_bundle(
+    user_id: Optional[int] = Query(None, description="Only this user's invoices (default: all users)"),
+    date_from: Optional[date] = Query(None, description="Invoices issued on or after this date"),
+    date_to: Optional[date] = Query(None, description="Invoices issued on or before this date"),
+    format: str = Query("pdf", pattern="^(html|pdf)$", description="pdf or html files in the zip"),
+    admin: models.User = Depends(get_current_admin),
+    db: Session = Depends(get_db)
+):
+    """Zip of all invoices issued in a period (e.g. a month for GST filing)"""
+    return invoice_bundle_response(db, format, user_id=user_id, date_from=date_from, date_to=date_to)
+
+
+@router.get("/webhook-inbox")
+def list_webhook_events(
+    status: Optional[str] = Query(None, description="pending, processing, processed or failed"),
+    limit: int = Query(50, ge=1, le=500),
+    admin: models.User = Depends(get_current_admin),
+    db: Session = Depends(get_db)
+):
+    """Received Razorpay webhook events, newest first"""
+    query = db.query(models.WebhookEvent)
+    if status:
+        query = query.filter(models.WebhookEvent.status == status)
+    events = query.order_by(models.WebhookEvent.id.desc()).limit(limit).all()
+    return [{
+        "id": e.id,
+        "provider": e.provider,
+        "event_id": e.event_id,
+        "event_type": e.event_type,
+        "status": e.status,
+        "attempts": e.attempts,
+        "next_attempt_at": e.next_attempt_at,
+        "last_error": e.last_error,
+        "received_at": e.received_at,
+        "processed_at": e.processed_at
+    } for e in events]
+
+
+@router.post("/webhook-inbox/{event_id}/retry")
+def retry_webhook_event(
+    event_id: int,
+    admin: models.User = Depends(get_current_admin),
+    db: Session = Depends(get_db)
+):
+    """Queue a failed webhook event for processing again"""
+    event = db.query(models.WebhookEvent).filter(models.WebhookEvent.id == event_id).first()
+    if not event:
+        raise HTTPException(status_code=404, detail="Webhook event not found")
+    if event.status != "failed":
+        raise HTTPException(status_code=400, detail=f"Only failed events can be retried (status: {event.status})")
+
+    event.status = "pending"
+    event.attempts = 0
+    event.next_attempt_at = None
+    db.commit()
+    return {"status": "queued", "id": event.id}
+
+
+@router.post("/payments/reconcile")
+def reconcile_pending_payments(
+    window_hours: Optional[float] = Query(None, gt=0, description="Orders created in the last N hours (default RECONCILE_WINDOW_HOURS)"),
+    expire_after_hours: Optional[float] = Query(None, gt=0, description="Expire unpaid orders older than this"),
+    dry_run: bool = Query(False, description="Report only, change nothing"),
+    admin: models.User = Depends(get_current_admin)
+):
+    """
+    Match all pending orders of the window against Razorpay in one pass:
+    captured ones are credited, unpaid stale ones expired. Returns the report.
+    """
+    try:
+        return reconcile_payments(window_hours, expire_after_hours, dry_run=dry_run)
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.get("/pending-payments")
 def get_pending_payments(
     admin: models.User = Depends(get_current_admin),
@@ -1625,14 +1714,16 @@ def get_pending_payments(
     """
     Get all pending payment transactions (credit transactions with pending status).
     """
-    transactions = db.query(models.Transaction).filter(
+    transactions = db.query(models.Transaction).options(
+        joinedload(models.Transaction.user)
+    ).filter(
         models.Transaction.type == "credit",
         models.Transaction.status == "pending"
     ).order_by(models.Transaction.created_at.desc()).all()
 
     result = []
     for t in transactions:
-        user = db.query(models.User).filter(models.User.id == t.user_id).first()
+        user = t.user
         result.append({
             "id": t.id,
             "razorpay_order_id": t.razorpay_order_id,
@@ -1653,7 +1744,8 @@ def get_pending_payments(
 
 # ========== Low Balance Alerts ==========
 
-from ..email_utils import LOW_BALANCE_THRESHOLD, send_low_balance_alert
+from ..email_utils import low_balance_alert_message
+from ..mailer import enqueue
 
 @router.get("/low-balance-users")
 def get_low_balance_users(
@@ -1663,17 +1755,17 @@ def get_low_balance_users(
     """
     Get all customers with balance below the threshold (Rs.200).
     """
-    threshold_rupees = LOW_BALANCE_THRESHOLD / 100
+    threshold_rupees = settings.LOW_BALANCE_THRESHOLD / 100
 
     # Get all active customers with balance below threshold
     users = db.query(models.User).filter(
-        models.User.balance < LOW_BALANCE_THRESHOLD,
+        models.User.balance < settings.LOW_BALANCE_THRESHOLD,
         models.User.role == "customer",
         models.User.is_active == True
     ).order_by(models.User.balance.asc()).all()
 
     return {
-        "threshold_paise": LOW_BALANCE_THRESHOLD,
+        "threshold_paise": settings.LOW_BALANCE_THRESHOLD,
         "threshold_rupees": threshold_rupees,
         "total": len(users),
         "users": [
@@ -1698,14 +1790,17 @@ def send_low_balance_alerts(
     db: Session = Depends(get_db)
 ):
     """
-    Send low balance alert emails to customers.
+    Queue low balance alert emails to customers; returns the email job to poll.
 
     - If user_ids is provided, send only to those users
     - If user_ids is None/empty, send to all users below threshold
     """
     # Build query
-    query = db.query(models.User).filter(
-        models.User.balance < LOW_BALANCE_THRESHOLD,
+    query = db.query(
+        models.User.id, models.User.email, models.User.name,
+        models.User.balance, models.User.company_name
+    ).filter(
+        models.User.balance < settings.LOW_BALANCE_THRESHOLD,
         models.User.role == "customer",
         models.User.is_active == True
     )
@@ -1719,42 +1814,68 @@ def send_low_balance_alerts(
     if not users:
         return {
             "message": "No users to send alerts to",
-            "sent": 0,
-            "failed": 0
+            "job_id": None,
+            "queued": 0
         }
 
-    sent_count = 0
-    failed_count = 0
-    results = []
+    record_alerts(db, [(user.id, user.balance) for user in users])
+    job = enqueue(db, (
+        {
+            "user_id": user.id,
+            **low_balance_alert_message(
+                user_email=user.email,
+                user_name=user.name,
+                balance_paise=user.balance,
+                company_name=user.company_name
+            )
+        }
+        for user in users
+    ), kind="low_balance_alert", requested_by=admin.id)
 
-    for user in users:
-        success = send_low_balance_alert(
-            user_email=user.email,
-            user_name=user.name,
-            balance_paise=user.balance,
-            company_name=user.company_name
-        )
+    return {
+        "message": f"Queued {len(users)} alert(s)",
+        "job_id": job.id,
+        "queued": len(users)
+    }
 
-        if success:
-            sent_count += 1
-            results.append({
-                "user_id": user.id,
-                "email": user.email,
-                "status": "sent"
-            })
-        else:
-            failed_count += 1
-            results.append({
-                "user_id": user.id,
-                "email": user.email,
-                "status": "failed"
-            })
+
+@router.get("/email-jobs/{job_id}")
+def get_email_job(
+    job_id: int,
+    admin: models.User = Depends(get_current_admin),
+    db: Session = Depends(get_db)
+):
+    """Progress of a queued email job and the outcome per recipient"""
+    job = db.query(models.EmailJob).filter(models.EmailJob.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Email job not found")
+
+    deliveries = db.query(
+        models.EmailDelivery.id, models.EmailDelivery.user_id, models.EmailDelivery.to_email,
+        models.EmailDelivery.status, models.EmailDelivery.attempts, models.EmailDelivery.error,
+        models.EmailDelivery.sent_at
+    ).filter(models.EmailDelivery.job_id == job.id).order_by(models.EmailDelivery.id).all()
 
     return {
-        "message": f"Sent {sent_count} alert(s), {failed_count} failed",
-        "sent": sent_count,
-        "failed": failed_count,
-        "results": results
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "total": job.total,
+        "sent": job.sent,
+        "failed": job.failed,
+        "created_at": job.created_at,
+        "completed_at": job.completed_at,
+        "results": [
+            {
+                "user_id": d.user_id,
+                "email": d.to_email,
+                "status": d.status,
+                "attempts": d.attempts,
+                "error": d.error,
+                "sent_at": d.sent_at
+            }
+            for d in deliveries
+        ]
     }
 
 
@@ -1766,7 +1887,7 @@ def get_admin_campaign_overview(
     end_date: str = Query(..., description="End date in ISO format (YYYY-MM-DDTHH:MM:SS)"),
     user_id: Optional[int] = Query(None, description="Filter by specific user ID"),
     admin: models.User = Depends(get_current_admin),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Get campaign overview with message statistics for admin.
@@ -1900,6 +2021,7 @@ def get_public_customers(
     skip: int = Query(0, ge=0),
     limit: int = Query(50, ge=1, le=100),
     search: str = Query(None),
+    exact_total: bool = Query(False, description="Run an exact COUNT(*) instead of estimating total"),
     admin: models.User = Depends(get_current_admin),
     db: Session = Depends(get_db)
 ):
@@ -1913,14 +2035,20 @@ def get_public_customers(
             (models.PublicCustomer.name.ilike(search_filter))
         )
 
-    total = query.count()
-    customers = query.order_by(models.PublicCustomer.created_at.desc()).offset(skip).limit(limit).all()
+    total, total_is_estimate = page_total(query, models.PublicCustomer, exact=exact_total, filtered=bool(search))
+    customers, next_cursor = keyset_page(query, models.PublicCustomer, limit, skip=skip)
+
+    # user_id has no FK/relationship, so load the mapped users in one batch
+    user_ids = {c.user_id for c in customers if c.user_id}
+    users_by_id = {}
+    if user_ids:
+        users_by_id = {
+            u.id: u for u in db.query(models.User).filter(models.User.id.in_(user_ids))
+        }
 
     result = []
     for c in customers:
-        user = None
-        if c.user_id:
-            user = db.query(models.User).filter(models.User.id == c.user_id).first()
+        user = users_by_id.get(c.user_id)
 
         result.append({
             "id": c.id,
@@ -1936,7 +2064,12 @@ def get_public_customers(
             "updated_at": c.updated_at
         })
 
-    return {"total": total, "customers": result}
+    return {
+        "total": total,
+        "total_is_estimate": total_is_estimate,
+        "has_more": next_cursor is not None,
+        "customers": result
+    }
 
 
 @router.post("/public-customers")
@@ -2033,6 +2166,7 @@ def get_public_payments(
     limit: int = Query(50, ge=1, le=100),
     status: str = Query(None),
     processed: bool = Query(None),
+    exact_total: bool = Query(False, description="Run an exact COUNT(*) instead of estimating total"),
     admin: models.User = Depends(get_current_admin),
     db: Session = Depends(get_db)
 ):
@@ -2044,8 +2178,9 @@ def get_public_payments(
     if processed is not None:
         query = query.filter(models.PublicPayment.processed == processed)
 
-    total = query.count()
-    payments = query.order_by(models.PublicPayment.created_at.desc()).offset(skip).limit(limit).all()
+    filtered = bool(status) or processed is not None
+    total, total_is_estimate = page_total(query, models.PublicPayment, exact=exact_total, filtered=filtered)
+    payments, next_cursor = keyset_page(query, models.PublicPayment, limit, skip=skip)
 
     result = []
     for p in payments:
@@ -2070,7 +2205,12 @@ def get_public_payments(
             "created_at": p.created_at
         })
 
-    return {"total": total, "payments": result}
+    return {
+        "total": total,
+        "total_is_estimate": total_is_estimate,
+        "has_more": next_cursor is not None,
+        "payments": result
+    }
 
 
 @router.post("/public-payments/{payment_id}/process")
@@ -2121,6 +2261,7 @@ def process_public_payment(
     # Update user balance
     old_balance = user.balance
     user.balance += credited_amount
+    rearm_low_balance_alert(db, user.id, user.balance)
 
     # Mark payment as processed
     payment.processed = True
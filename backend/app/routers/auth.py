@@ -5,6 +5,7 @@ from .. import models, schemas
 from ..database import get_db
 from ..auth import verify_password, get_password_hash, create_access_token, get_current_user
 from ..config import settings
+from ..phones import clear_portal_cache, normalize_phone
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 
@@ -19,8 +20,10 @@ def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
         )
 
     # Check phone if provided
-    if user.phone:
-        db_phone = db.query(models.User).filter(models.User.phone == user.phone).first()
+    if normalize_phone(user.phone):
+        db_phone = db.query(models.User).filter(
+            models.User.phone_e164 == normalize_phone(user.phone)
+        ).first()
         if db_phone:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -83,7 +86,7 @@ def update_me(
     if user_update.phone:
         # Check if phone is taken
         existing = db.query(models.User).filter(
-            models.User.phone == user_update.phone,
+            models.User.phone_e164 == normalize_phone(user_update.phone),
             models.User.id != current_user.id
         ).first()
         if existing:
@@ -92,6 +95,7 @@ def update_me(
                 detail="Phone number already in use"
             )
         current_user.phone = user_update.phone
+        clear_portal_cache()
     if user_update.company_name is not None:
         current_user.company_name = user_update.company_name
 
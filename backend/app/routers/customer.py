@@ -1,16 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, Query, BackgroundTasks, Response
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 from datetime import datetime, timedelta
 from typing import List, Optional
 from pydantic import BaseModel
+import httpx
 import os
 import requests
 from twilio.rest import Client as TwilioClient
 from .. import models, schemas
-from ..database import get_db
-from ..auth import get_current_user
-from ..email_utils import check_and_send_low_balance_alert
+from ..counters import get_counter
+from ..database import get_db, get_read_db, get_async_db
+from ..pagination import keyset_page, NEXT_CURSOR_HEADER
+from ..auth import get_current_user, get_current_user_async
+from ..balance_alerts import schedule_low_balance_check
+from ..metrics import provider_call
+from ..template_catalogue import CatalogueError, get_catalogue, refresh_account, remove_template
 
 # Twilio configuration - set these in Railway environment variables
 TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
@@ -24,10 +30,9 @@ def get_dashboard_stats(
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    # Get message counts
-    total_messages = db.query(models.Message).filter(
-        models.Message.user_id == current_user.id
-    ).count()
+    # Lifetime totals come from the materialised counter row
+    counter = get_counter(db, current_user.id)
+    total_messages = counter.messages_total
 
     today = datetime.utcnow().date()
     messages_today = db.query(models.Message).filter(
@@ -42,12 +47,8 @@ def get_dashboard_stats(
         models.Message.created_at >= first_of_month
     ).count()
 
-    # Total spent (sum of all debit transactions)
-    total_spent = db.query(func.sum(models.Transaction.amount)).filter(
-        models.Transaction.user_id == current_user.id,
-        models.Transaction.type == "debit",
-        models.Transaction.status == "completed"
-    ).scalar() or 0
+    # Total spent (sum of all completed debit transactions)
+    total_spent = counter.spent_total
 
     return schemas.DashboardStats(
         balance=current_user.balance,
@@ -61,14 +62,19 @@ def get_dashboard_stats(
 
 @router.get("/transactions", response_model=List[schemas.TransactionResponse])
 def get_transactions(
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(50, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="Cursor from the X-Next-Cursor header of the previous page"),
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    transactions = db.query(models.Transaction).filter(
+    query = db.query(models.Transaction).filter(
         models.Transaction.user_id == current_user.id
-    ).order_by(models.Transaction.created_at.desc()).offset(skip).limit(limit).all()
+    )
+    transactions, next_cursor = keyset_page(query, models.Transaction, limit, cursor=cursor, skip=skip)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
 
     result = []
     for t in transactions:
@@ -90,18 +96,22 @@ def get_transactions(
 
 @router.get("/messages", response_model=List[schemas.MessageResponse])
 def get_messages(
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(50, ge=1, le=1000),
     status: str = Query(None),
+    cursor: Optional[str] = Query(None, description="Cursor from the X-Next-Cursor header of the previous page"),
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     query = db.query(models.Message).filter(models.Message.user_id == current_user.id)
 
     if status:
         query = query.filter(models.Message.status == status)
 
-    messages = query.order_by(models.Message.created_at.desc()).offset(skip).limit(limit).all()
+    messages, next_cursor = keyset_page(query, models.Message, limit, cursor=cursor, skip=skip)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
 
     result = []
     for m in messages:
@@ -191,11 +201,12 @@ def send_message(
             recipient = '+' + recipient
 
         # Send WhatsApp message via Twilio
-        twilio_message = twilio_client.messages.create(
-            body=message.message_content,
-            from_=f'whatsapp:{TWILIO_WHATSAPP_NUMBER}',
-            to=f'whatsapp:{recipient}'
-        )
+        with provider_call("twilio"):
+            twilio_message = twilio_client.messages.create(
+                body=message.message_content,
+                from_=f'whatsapp:{TWILIO_WHATSAPP_NUMBER}',
+                to=f'whatsapp:{recipient}'
+            )
 
         db_message.whatsapp_message_id = twilio_message.sid
         db_message.status = "sent"
@@ -221,8 +232,8 @@ def send_message(
         )
         db.add(transaction)
 
-        # Check for low balance and send alert in background
-        background_tasks.add_task(check_and_send_low_balance_alert, current_user)
+        # Alert in the background if the balance crossed the low threshold
+        schedule_low_balance_check(background_tasks, current_user.id)
 
     db.commit()
     db.refresh(db_message)
@@ -322,10 +333,11 @@ def sync_customer_messages(
 
     try:
         # Fetch messages involving this phone number
-        twilio_messages = twilio_client.messages.list(
-            date_sent_after=date_from,
-            limit=500
-        )
+        with provider_call("twilio"):
+            twilio_messages = twilio_client.messages.list(
+                date_sent_after=date_from,
+                limit=500
+            )
     except Exception as e:
         return {"synced": 0, "message": f"Failed to fetch: {str(e)}"}
 
@@ -415,8 +427,8 @@ def sync_customer_messages(
         )
         db.add(transaction)
 
-        # Check for low balance and send alert in background
-        background_tasks.add_task(check_and_send_low_balance_alert, current_user)
+        # Alert in the background if the balance crossed the low threshold
+        schedule_low_balance_check(background_tasks, current_user.id)
 
     if imported_count > 0:
         db.commit()
@@ -486,93 +498,37 @@ def get_user_twilio_credentials(current_user: models.User, db: Session):
 
 
 @router.get("/templates")
-def get_templates(
-    current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+async def get_templates(
+    refresh: bool = Query(False, description="Refresh the catalogue from Twilio first"),
+    current_user: models.User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get all WhatsApp content templates for the user's Twilio account.
-    Uses per-customer Twilio credentials if configured.
+    Uses per-customer Twilio credentials if configured. Served from the local
+    template catalogue, which is refreshed in the background.
     """
-    account_sid, auth_token = get_user_twilio_credentials(current_user, db)
+    account_sid, auth_token = await db.run_sync(
+        lambda session: get_user_twilio_credentials(current_user, session)
+    )
 
     if not account_sid or not auth_token:
         raise HTTPException(status_code=400, detail="Twilio credentials not configured")
 
     try:
-        # Use Twilio Content API to fetch templates
-        url = f"https://content.twilio.com/v1/Content"
-        response = requests.get(
-            url,
-            auth=(account_sid, auth_token)
-        )
-
-        if response.status_code != 200:
-            raise HTTPException(
-                status_code=response.status_code,
-                detail=f"Twilio API error: {response.text}"
-            )
-
-        data = response.json()
-        contents = data.get("contents", [])
-
-        # Format response
-        templates = []
-        for content in contents:
-            content_sid = content.get("sid")
-
-            # Get approval status - try multiple locations
-            approval_status = None
-            approval_requests = content.get("approval_requests", {})
-
-            # Method 1: Check approval_requests.whatsapp.status
-            if approval_requests and "whatsapp" in approval_requests:
-                wa_approval = approval_requests.get("whatsapp", {})
-                if isinstance(wa_approval, dict):
-                    approval_status = wa_approval.get("status")
-
-            # Method 2: If not found, fetch approval status separately
-            if not approval_status and content_sid:
-                try:
-                    approval_url = f"https://content.twilio.com/v1/Content/{content_sid}/ApprovalRequests"
-                    approval_response = requests.get(
-                        approval_url,
-                        auth=(account_sid, auth_token)
-                    )
-                    if approval_response.status_code == 200:
-                        approval_data = approval_response.json()
-                        # Check for whatsapp approval in the list
-                        for approval in approval_data.get("approval_requests", []):
-                            if approval.get("channel_type") == "whatsapp":
-                                approval_status = approval.get("status")
-                                break
-                        # Also check direct whatsapp key
-                        if not approval_status and "whatsapp" in approval_data:
-                            approval_status = approval_data["whatsapp"].get("status")
-                except:
-                    pass  # Silently continue if approval fetch fails
-
-            templates.append({
-                "sid": content_sid,
-                "friendly_name": content.get("friendly_name"),
-                "language": content.get("language"),
-                "date_created": content.get("date_created"),
-                "date_updated": content.get("date_updated"),
-                "types": content.get("types", {}),
-                "variables": content.get("variables", {}),
-                "approval_status": approval_status,
-                "approval_requests": approval_requests
-            })
-
-        return {
-            "templates": templates,
-            "count": len(templates),
-            "account_sid": account_sid[:10] + "..." if account_sid else None
-        }
-
-    except requests.RequestException as e:
+        catalogue = await get_catalogue(db, account_sid, auth_token, refresh=refresh)
+    except CatalogueError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except httpx.HTTPError as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch templates: {str(e)}")
 
+    return {
+        "templates": catalogue["templates"],
+        "count": len(catalogue["templates"]),
+        "synced_at": catalogue["synced_at"],
+        "account_sid": account_sid[:10] + "..." if account_sid else None
+    }
+
 
 @router.get("/templates/{template_sid}")
 def get_template_detail(
@@ -588,10 +544,11 @@ def get_template_detail(
 
     try:
         url = f"https://content.twilio.com/v1/Content/{template_sid}"
-        response = requests.get(
-            url,
-            auth=(account_sid, auth_token)
-        )
+        with provider_call("twilio"):
+            response = requests.get(
+                url,
+                auth=(account_sid, auth_token)
+            )
 
         if response.status_code == 404:
             raise HTTPException(status_code=404, detail="Template not found")
@@ -611,6 +568,7 @@ def get_template_detail(
 @router.post("/templates")
 def create_template(
     template: TemplateCreateRequest,
+    background_tasks: BackgroundTasks,
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -678,11 +636,12 @@ def create_template(
 
         # Create content via Twilio API
         url = "https://content.twilio.com/v1/Content"
-        response = requests.post(
-            url,
-            json=payload,
-            auth=(account_sid, auth_token)
-        )
+        with provider_call("twilio"):
+            response = requests.post(
+                url,
+                json=payload,
+                auth=(account_sid, auth_token)
+            )
 
         if response.status_code not in [200, 201]:
             error_detail = response.text
@@ -706,11 +665,12 @@ def create_template(
             "category": template.category
         }
 
-        approval_response = requests.post(
-            approval_url,
-            json=approval_payload,
-            auth=(account_sid, auth_token)
-        )
+        with provider_call("twilio"):
+            approval_response = requests.post(
+                approval_url,
+                json=approval_payload,
+                auth=(account_sid, auth_token)
+            )
 
         approval_status = "not_submitted"
         if approval_response.status_code in [200, 201]:
@@ -720,6 +680,9 @@ def create_template(
             # Template created but approval submission failed
             approval_status = f"approval_failed: {approval_response.text}"
 
+        # Pick up the new template (and its approval request) in the catalogue
+        background_tasks.add_task(refresh_account, account_sid, auth_token)
+
         return {
             "success": True,
             "template_sid": content_sid,
@@ -760,6 +723,8 @@ def delete_template(
                 detail=f"Failed to delete template: {response.text}"
             )
 
+        remove_template(db, account_sid, template_sid)
+
         return {"success": True, "message": "Template deleted successfully"}
 
     except requests.RequestException as e:
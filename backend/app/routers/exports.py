@@ -0,0 +1,122 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, BackgroundTasks, Request
+from fastapi.responses import FileResponse
+from sqlalchemy.orm import Session
+from datetime import date
+from typing import List, Optional
+import os
+from .. import models, schemas
+from ..database import get_db
+from ..auth import get_current_user
+from ..exports import (
+    export_job_response, message_export_response, purge_expired_exports, run_message_export_job, pyarrow
+)
+
+router = APIRouter(prefix="/exports", tags=["Exports"])
+
+
+def scope_filters(filters: schemas.MessageExportFilters, user: models.User) -> schemas.MessageExportFilters:
+    """Customers can only export their own messages; admins any user's (or all)"""
+    if user.role == "admin":
+        return filters
+    if filters.user_id and filters.user_id != user.id:
+        raise HTTPException(status_code=403, detail="Not allowed to export another user's messages")
+    filters.user_id = user.id
+    return filters
+
+
+def get_export_job(job_id: int, user: models.User, db: Session) -> models.ExportJob:
+    job = db.query(models.ExportJob).filter(models.ExportJob.id == job_id).first()
+    if not job or (job.user_id != user.id and user.role != "admin"):
+        raise HTTPException(status_code=404, detail="Export not found")
+    return job
+
+
+@router.get("/messages")
+def export_messages(
+    request: Request,
+    format: schemas.ExportFormat = Query(schemas.ExportFormat.CSV, description="csv or jsonl"),
+    gzip: bool = Query(False, description="Download gzip-compressed"),
+    user_id: Optional[int] = Query(None, description="Admin only: filter by user ID"),
+    date_from: Optional[date] = Query(None, description="Only messages created on or after this date"),
+    date_to: Optional[date] = Query(None, description="Only messages created on or before this date"),
+    status: Optional[str] = Query(None),
+    template_name: Optional[str] = Query(None),
+    include_content: bool = Query(False, description="Include the message body"),
+    current_user: models.User = Depends(get_current_user)
+):
+    """Stream message history as CSV or JSON lines"""
+    if format == schemas.ExportFormat.PARQUET:
+        raise HTTPException(
+            status_code=400,
+            detail="Parquet exports are generated in the background, use POST /exports/messages"
+        )
+    filters = scope_filters(schemas.MessageExportFilters(
+        user_id=user_id, date_from=date_from, date_to=date_to, status=status,
+        template_name=template_name, include_content=include_content
+    ), current_user)
+    return message_export_response(request, filters, format.value, compress=gzip)
+
+
+@router.post("/messages", response_model=schemas.ExportJobResponse, status_code=202)
+def create_message_export(
+    export: schemas.MessageExportRequest,
+    background_tasks: BackgroundTasks,
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Generate a message export in the background; poll the job for its download link"""
+    if export.format == schemas.ExportFormat.PARQUET and pyarrow is None:
+        raise HTTPException(status_code=400, detail="Parquet export is not available on this server")
+
+    purge_expired_exports(db)
+    filters = scope_filters(schemas.MessageExportFilters(**export.model_dump(exclude={"format"})), current_user)
+    job = models.ExportJob(
+        user_id=current_user.id,
+        format=export.format.value,
+        filters=filters.model_dump_json(),
+        status="pending"
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+
+    background_tasks.add_task(run_message_export_job, job.id)
+    return export_job_response(job)
+
+
+@router.get("/jobs", response_model=List[schemas.ExportJobResponse])
+def list_export_jobs(
+    limit: int = Query(20, ge=1, le=100),
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """The current user's exports, newest first"""
+    jobs = db.query(models.ExportJob).filter(
+        models.ExportJob.user_id == current_user.id
+    ).order_by(models.ExportJob.id.desc()).limit(limit).all()
+    return [export_job_response(job) for job in jobs]
+
+
+@router.get("/jobs/{job_id}", response_model=schemas.ExportJobResponse)
+def get_export_job_status(
+    job_id: int,
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    return export_job_response(get_export_job(job_id, current_user, db))
+
+
+@router.get("/jobs/{job_id}/download")
+def download_export(
+    job_id: int,
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    job = get_export_job(job_id, current_user, db)
+    if job.status == "expired":
+        raise HTTPException(status_code=410, detail="Export has expired, please generate it again")
+    if job.status != "completed" or not job.file_path or not os.path.exists(job.file_path):
+        raise HTTPException(status_code=409, detail=f"Export is not ready (status: {job.status})")
+
+    media_type = "application/vnd.apache.parquet" if job.format == "parquet" else "application/gzip"
+    return FileResponse(job.file_path, media_type=media_type, filename=os.path.basename(job.file_path))
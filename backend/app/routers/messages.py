@@ -1,4 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, Query, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from datetime import datetime
 from typing import List
@@ -6,10 +9,12 @@ import httpx
 import os
 from twilio.rest import Client as TwilioClient
 from .. import models, schemas
-from ..database import get_db
-from ..auth import get_current_user
+from ..database import get_db, get_read_db, get_async_db
+from ..auth import get_current_user, get_current_user_async
 from ..config import settings
-from ..email_utils import check_and_send_low_balance_alert
+from ..balance_alerts import schedule_low_balance_check
+from ..metrics import provider_call
+from ..archive import archived_field
 
 # Twilio configuration - set these in Railway environment variables
 TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
@@ -36,11 +41,11 @@ def get_message_price(message_type: str, db: Session) -> int:
 async def send_message(
     message: schemas.MessageCreate,
     background_tasks: BackgroundTasks,
-    current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: models.User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Get price
-    price = get_message_price(message.message_type, db)
+    price = await db.run_sync(lambda session: get_message_price(message.message_type, session))
 
     # Check balance
     if current_user.balance < price:
@@ -61,7 +66,7 @@ async def send_message(
         status="pending"
     )
     db.add(db_message)
-    db.flush()  # Get the message ID
+    await db.flush()  # Get the message ID
 
     # Send via Twilio WhatsApp API
     send_success = False
@@ -76,12 +81,14 @@ async def send_message(
         if not recipient.startswith('+'):
             recipient = '+' + recipient
 
-        # Send WhatsApp message via Twilio
-        twilio_message = twilio_client.messages.create(
-            body=message.message_content,
-            from_=f'whatsapp:{TWILIO_WHATSAPP_NUMBER}',
-            to=f'whatsapp:{recipient}'
-        )
+        # Send WhatsApp message via Twilio (blocking client, run off the event loop)
+        with provider_call("twilio"):
+            twilio_message = await run_in_threadpool(
+                twilio_client.messages.create,
+                body=message.message_content,
+                from_=f'whatsapp:{TWILIO_WHATSAPP_NUMBER}',
+                to=f'whatsapp:{recipient}'
+            )
 
         db_message.whatsapp_message_id = twilio_message.sid
         db_message.status = "sent"
@@ -108,11 +115,11 @@ async def send_message(
         )
         db.add(transaction)
 
-        # Check for low balance and send alert in background
-        background_tasks.add_task(check_and_send_low_balance_alert, current_user)
+        # Alert in the background if the balance crossed the low threshold
+        schedule_low_balance_check(background_tasks, current_user.id)
 
-    db.commit()
-    db.refresh(db_message)
+    await db.commit()
+    await db.refresh(db_message)
 
     return schemas.MessageResponse(
         id=db_message.id,
@@ -137,7 +144,7 @@ def get_campaign_overview(
     start_date: str = Query(..., description="Start date in ISO format (YYYY-MM-DDTHH:MM:SS)"),
     end_date: str = Query(..., description="End date in ISO format (YYYY-MM-DDTHH:MM:SS)"),
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Get campaign overview with message statistics and status breakdown
@@ -255,7 +262,7 @@ def get_message(
         recipient_name=message.recipient_name,
         message_type=message.message_type,
         template_name=message.template_name,
-        message_content=message.message_content,
+        message_content=archived_field(message, "message_content"),
         status=message.status,
         direction=message.direction or "outbound",
         whatsapp_message_id=message.whatsapp_message_id,
@@ -272,7 +279,7 @@ def get_message(
 @router.post("/webhook/status")
 async def message_status_webhook(
     request_data: dict,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Webhook to receive message status updates from WhatsApp API
@@ -284,9 +291,9 @@ async def message_status_webhook(
     if not message_id or not status:
         raise HTTPException(status_code=400, detail="Invalid webhook data")
 
-    message = db.query(models.Message).filter(
-        models.Message.whatsapp_message_id == message_id
-    ).first()
+    message = (await db.execute(
+        select(models.Message).where(models.Message.whatsapp_message_id == message_id)
+    )).scalars().first()
 
     if not message:
         return {"status": "message not found"}
@@ -303,6 +310,6 @@ async def message_status_webhook(
         message.status = "failed"
         message.error_message = request_data.get("error", "Unknown error")
 
-    db.commit()
+    await db.commit()
 
     return {"status": "updated"}
\ No newline at end of file
@@ -1,76 +1,31 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request
 from fastapi.responses import FileResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import func, select
 import razorpay
 import hmac
 import hashlib
 import httpx
 import os
 import json
-from datetime import datetime
-from typing import List
+from datetime import date, datetime
+from typing import List, Optional
 from io import BytesIO
 from .. import models, schemas
-from ..database import get_db
-from ..auth import get_current_user
+from ..database import get_db, get_async_db
+from ..auth import get_current_user, get_current_user_async
 from ..config import settings
+from ..metrics import provider_call
+from ..payment_finalization import calculate_gst, finalize_payment, mark_payment_failed
+from ..phones import find_portal_customer
+from ..rate_limit import check_phone_rate_limit
+from ..webhook_inbox import PROVIDER_RAZORPAY, notify_worker, store_event
+from ..invoices import invoice_bundle_response, invoice_download_response, prerender_invoice
 
 router = APIRouter(prefix="/payments", tags=["Payments"])
 
 
-def save_payment_log(
-    db: Session,
-    event_type: str,
-    source: str,
-    razorpay_payment_id: str,
-    razorpay_order_id: str,
-    razorpay_signature: str = None,
-    user: models.User = None,
-    gst_calc: dict = None,
-    invoice_number: str = None,
-    invoice_id: int = None,
-    new_balance: int = None,
-    raw_data: dict = None
-):
-    """
-    Save payment data to PaymentLog table.
-    This stores all payment info for reporting/auditing.
-    """
-    try:
-        payment_log = models.PaymentLog(
-            event_type=event_type,
-            source=source,
-            razorpay_payment_id=razorpay_payment_id,
-            razorpay_order_id=razorpay_order_id,
-            razorpay_signature=razorpay_signature,
-            user_id=user.id if user else None,
-            user_email=user.email if user else None,
-            user_name=user.name if user else None,
-            user_phone=user.phone if user else None,
-            company_name=user.company_name if user else None,
-            gst_number=user.gst_number if user else None,
-            total_amount=gst_calc["total"] if gst_calc else None,
-            subtotal_amount=gst_calc["subtotal"] if gst_calc else None,
-            gst_amount=(gst_calc["cgst"] + gst_calc["sgst"]) if gst_calc else None,
-            cgst_amount=gst_calc["cgst"] if gst_calc else None,
-            sgst_amount=gst_calc["sgst"] if gst_calc else None,
-            credited_amount=gst_calc["credited"] if gst_calc else None,
-            invoice_number=invoice_number,
-            invoice_id=invoice_id,
-            new_balance=new_balance,
-            raw_data=json.dumps(raw_data) if raw_data else None
-        )
-        db.add(payment_log)
-        db.commit()
-        print(f"Payment log saved: {razorpay_payment_id}")
-    except Exception as e:
-        print(f"Failed to save payment log: {str(e)}")
-        # Don't fail the main payment flow
-
-# GST rate
-GST_RATE = 0.18  # 18%
-
 def get_razorpay_client():
     if not settings.RAZORPAY_KEY_ID or not settings.RAZORPAY_KEY_SECRET:
         raise HTTPException(
@@ -79,44 +34,6 @@ def get_razorpay_client():
         )
     return razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
 
-def generate_invoice_number(db: Session) -> str:
-    """Generate unique invoice number like TZ-2024-0001"""
-    year = datetime.now().year
-
-    # Get company config for prefix
-    company = db.query(models.CompanyConfig).first()
-    prefix = company.invoice_prefix if company else "TZ"
-
-    # Count existing invoices this year
-    count = db.query(models.Invoice).filter(
-        models.Invoice.invoice_number.like(f"{prefix}-{year}-%")
-    ).count()
-
-    return f"{prefix}-{year}-{str(count + 1).zfill(4)}"
-
-def calculate_gst(total_amount_paise: int):
-    """
-    Calculate GST breakdown from total amount
-    If customer pays ₹1000, GST is included, so:
-    - Subtotal = 1000 / 1.18 = 847.46
-    - GST = 152.54 (18%)
-    - Credited to wallet = 847.46
-    """
-    subtotal = int(total_amount_paise / (1 + GST_RATE))
-    gst_amount = total_amount_paise - subtotal
-    # Split GST into CGST and SGST (9% each) for intra-state
-    cgst = gst_amount // 2
-    sgst = gst_amount - cgst
-
-    return {
-        "subtotal": subtotal,
-        "cgst": cgst,
-        "sgst": sgst,
-        "igst": 0,  # For inter-state, we'd use IGST instead
-        "total": total_amount_paise,
-        "credited": subtotal  # Amount added to wallet
-    }
-
 # ==================== PUBLIC ENDPOINTS (No Auth Required) ====================
 
 def clean_phone_number(phone: str) -> str:
@@ -138,28 +55,21 @@ def public_find_customer(
     if len(phone) != 10:
         raise HTTPException(status_code=400, detail="Please enter a valid 10-digit phone number")
 
-    # Find user by phone with portal enabled (check multiple formats)
-    from sqlalchemy import or_
-    user = db.query(models.User).filter(
-        or_(
-            models.User.phone == phone,              # 8700762648
-            models.User.phone == f"+91{phone}",      # +918700762648
-            models.User.phone == f"91{phone}",       # 918700762648
-        ),
-        models.User.portal_enabled == True,
-        models.User.is_active == True
-    ).first()
+    check_phone_rate_limit(phone)
 
-    if not user:
+    # Find user by phone with portal enabled (normalised, cached)
+    customer = find_portal_customer(db, phone)
+
+    if not customer:
         raise HTTPException(status_code=404, detail="No account found with this phone number. Please contact support to register.")
 
     return {
-        "id": user.id,
-        "name": user.name,
-        "phone": user.phone,
-        "user_id": user.id,
-        "email": user.email,
-        "portal_user_id": user.portal_user_id
+        "id": customer["id"],
+        "name": customer["name"],
+        "phone": customer["phone"],
+        "user_id": customer["id"],
+        "email": customer["email"],
+        "portal_user_id": customer["portal_user_id"]
     }
 
 
@@ -169,7 +79,6 @@ def public_create_order(
     db: Session = Depends(get_db)
 ):
     """Create Razorpay order for public portal recharge - uses users table directly"""
-    from sqlalchemy import or_
     phone = data.get("phone", "").strip()
     amount = data.get("amount", 0)
     phone = clean_phone_number(phone)
@@ -177,18 +86,12 @@ def public_create_order(
     if len(phone) != 10:
         raise HTTPException(status_code=400, detail="Invalid phone number")
 
-    # Find user by phone with portal enabled (check multiple formats)
-    user = db.query(models.User).filter(
-        or_(
-            models.User.phone == phone,              # 8700762648
-            models.User.phone == f"+91{phone}",      # +918700762648
-            models.User.phone == f"91{phone}",       # 918700762648
-        ),
-        models.User.portal_enabled == True,
-        models.User.is_active == True
-    ).first()
+    check_phone_rate_limit(phone)
 
-    if not user:
+    # Find user by phone with portal enabled (normalised, cached)
+    customer = find_portal_customer(db, phone)
+
+    if not customer:
         raise HTTPException(status_code=404, detail="User not found or portal not enabled")
 
     client = get_razorpay_client()
@@ -204,25 +107,26 @@ def public_create_order(
 
     # Create Razorpay order
     try:
-        razorpay_order = client.order.create({
-            "amount": amount_paise,
-            "currency": "INR",
-            "receipt": f"portal_{user.id}_{int(datetime.now().timestamp())}",
-            "notes": {
-                "phone": phone,
-                "user_id": str(user.id),
-                "user_email": user.email,
-                "source": "public_portal",
-                "subtotal": str(gst_calc["subtotal"]),
-                "gst": str(gst_calc["cgst"] + gst_calc["sgst"])
-            }
-        })
+        with provider_call("razorpay"):
+            razorpay_order = client.order.create({
+                "amount": amount_paise,
+                "currency": "INR",
+                "receipt": f"portal_{customer['id']}_{int(datetime.now().timestamp())}",
+                "notes": {
+                    "phone": phone,
+                    "user_id": str(customer["id"]),
+                    "user_email": customer["email"],
+                    "source": "public_portal",
+                    "subtotal": str(gst_calc["subtotal"]),
+                    "gst": str(gst_calc["cgst"] + gst_calc["sgst"])
+                }
+            })
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to create order: {str(e)}")
 
     # Create pending transaction (same as regular payment flow)
     transaction = models.Transaction(
-        user_id=user.id,
+        user_id=customer["id"],
         amount=amount_paise,
         type="credit",
         status="pending",
@@ -243,6 +147,7 @@ def public_create_order(
 @router.post("/public/verify-payment")
 def public_verify_payment(
     data: dict,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
     """Verify payment for public portal recharge - creates proper invoice like regular payments"""
@@ -276,82 +181,21 @@ def public_verify_payment(
         ).hexdigest()
 
         if expected_signature != razorpay_signature:
-            transaction.status = "failed"
-            db.commit()
+            mark_payment_failed(db, transaction.id)
             raise HTTPException(status_code=400, detail="Invalid signature")
     except HTTPException:
         raise
     except Exception as e:
-        transaction.status = "failed"
-        db.commit()
+        mark_payment_failed(db, transaction.id)
         raise HTTPException(status_code=400, detail=f"Verification failed: {str(e)}")
 
-    # Calculate GST
-    gst_calc = calculate_gst(transaction.amount)
-
-    # Generate invoice (same as regular payment)
-    invoice_number = generate_invoice_number(db)
-
-    # Build customer address
-    customer_address = None
-    if user.billing_address:
-        parts = [user.billing_address]
-        if user.city:
-            parts.append(user.city)
-        if user.state:
-            parts.append(user.state)
-        if user.pincode:
-            parts.append(user.pincode)
-        customer_address = ", ".join(parts)
-
-    invoice = models.Invoice(
-        user_id=user.id,
-        invoice_number=invoice_number,
-        customer_name=user.name,
-        customer_email=user.email,
-        customer_company=user.company_name,
-        customer_gst=user.gst_number,
-        customer_address=customer_address,
-        subtotal=gst_calc["subtotal"],
-        cgst_amount=gst_calc["cgst"],
-        sgst_amount=gst_calc["sgst"],
-        igst_amount=gst_calc["igst"],
-        total_amount=gst_calc["total"],
-        credited_amount=gst_calc["credited"],
-        razorpay_payment_id=razorpay_payment_id,
-        payment_date=datetime.utcnow(),
-        status="paid"
-    )
-    db.add(invoice)
-    db.flush()  # Get invoice ID
-
-    # Update transaction
-    transaction.razorpay_payment_id = razorpay_payment_id
-    transaction.razorpay_signature = razorpay_signature
-    transaction.status = "completed"
-    transaction.invoice_id = invoice.id
-    transaction.amount = gst_calc["credited"]  # Update to credited amount
-    transaction.description = f"Portal Recharge - Invoice #{invoice_number}"
-
-    # Add credited amount to user balance
-    user.balance += gst_calc["credited"]
-
-    db.commit()
-    db.refresh(user)
-
-    # Save payment log
-    save_payment_log(
-        db=db,
-        event_type="payment.verified",
-        source="portal_verify_payment",
-        razorpay_payment_id=razorpay_payment_id,
+    result = finalize_payment(
+        db,
         razorpay_order_id=razorpay_order_id,
+        razorpay_payment_id=razorpay_payment_id,
         razorpay_signature=razorpay_signature,
-        user=user,
-        gst_calc=gst_calc,
-        invoice_number=invoice_number,
-        invoice_id=invoice.id,
-        new_balance=user.balance,
+        source="portal_verify_payment",
+        description="Portal Recharge - Invoice #{invoice_number}",
         raw_data={
             "razorpay_payment_id": razorpay_payment_id,
             "razorpay_order_id": razorpay_order_id,
@@ -359,6 +203,11 @@ def public_verify_payment(
             "timestamp": datetime.utcnow().isoformat()
         }
     )
+    if not result.created:
+        return {"status": "already_verified", "message": "Payment already completed"}
+    gst_calc, invoice, user = result.gst_calc, result.invoice, result.user
+    invoice_number = invoice.invoice_number
+    background_tasks.add_task(prerender_invoice, invoice.id)
 
     return {
         "status": "success",
@@ -416,17 +265,18 @@ def create_order(
 
     # Create Razorpay order
     try:
-        razorpay_order = client.order.create({
-            "amount": amount_paise,
-            "currency": "INR",
-            "receipt": f"user_{current_user.id}_{int(datetime.now().timestamp())}",
-            "notes": {
-                "user_id": str(current_user.id),
-                "user_email": current_user.email,
-                "subtotal": str(gst_calc["subtotal"]),
-                "gst": str(gst_calc["cgst"] + gst_calc["sgst"])
-            }
-        })
+        with provider_call("razorpay"):
+            razorpay_order = client.order.create({
+                "amount": amount_paise,
+                "currency": "INR",
+                "receipt": f"user_{current_user.id}_{int(datetime.now().timestamp())}",
+                "notes": {
+                    "user_id": str(current_user.id),
+                    "user_email": current_user.email,
+                    "subtotal": str(gst_calc["subtotal"]),
+                    "gst": str(gst_calc["cgst"] + gst_calc["sgst"])
+                }
+            })
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -455,14 +305,17 @@ def create_order(
 @router.post("/verify-payment")
 async def verify_payment(
     payment_data: schemas.RazorpayPaymentVerify,
-    current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    background_tasks: BackgroundTasks,
+    current_user: models.User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Find the transaction
-    transaction = db.query(models.Transaction).filter(
-        models.Transaction.razorpay_order_id == payment_data.razorpay_order_id,
-        models.Transaction.user_id == current_user.id
-    ).first()
+    transaction = (await db.execute(
+        select(models.Transaction).where(
+            models.Transaction.razorpay_order_id == payment_data.razorpay_order_id,
+            models.Transaction.user_id == current_user.id
+        )
+    )).scalars().first()
 
     if not transaction:
         raise HTTPException(status_code=404, detail="Transaction not found")
@@ -480,89 +333,33 @@ async def verify_payment(
         ).hexdigest()
 
         if expected_signature != payment_data.razorpay_signature:
-            transaction.status = "failed"
-            db.commit()
+            await db.run_sync(mark_payment_failed, transaction.id)
             raise HTTPException(status_code=400, detail="Invalid signature")
     except HTTPException:
         raise
     except Exception as e:
-        transaction.status = "failed"
-        db.commit()
+        await db.run_sync(mark_payment_failed, transaction.id)
         raise HTTPException(status_code=400, detail=f"Verification failed: {str(e)}")
 
-    # Calculate GST
-    gst_calc = calculate_gst(transaction.amount)
-
-    # Generate invoice
-    invoice_number = generate_invoice_number(db)
-
-    # Build customer address
-    customer_address = None
-    if current_user.billing_address:
-        parts = [current_user.billing_address]
-        if current_user.city:
-            parts.append(current_user.city)
-        if current_user.state:
-            parts.append(current_user.state)
-        if current_user.pincode:
-            parts.append(current_user.pincode)
-        customer_address = ", ".join(parts)
-
-    invoice = models.Invoice(
-        user_id=current_user.id,
-        invoice_number=invoice_number,
-        customer_name=current_user.name,
-        customer_email=current_user.email,
-        customer_company=current_user.company_name,
-        customer_gst=current_user.gst_number,
-        customer_address=customer_address,
-        subtotal=gst_calc["subtotal"],
-        cgst_amount=gst_calc["cgst"],
-        sgst_amount=gst_calc["sgst"],
-        igst_amount=gst_calc["igst"],
-        total_amount=gst_calc["total"],
-        credited_amount=gst_calc["credited"],
-        razorpay_payment_id=payment_data.razorpay_payment_id,
-        payment_date=datetime.utcnow(),
-        status="paid"
-    )
-    db.add(invoice)
-    db.flush()  # Get invoice ID
-
-    # Update transaction
-    transaction.razorpay_payment_id = payment_data.razorpay_payment_id
-    transaction.razorpay_signature = payment_data.razorpay_signature
-    transaction.status = "completed"
-    transaction.invoice_id = invoice.id
-    transaction.amount = gst_calc["credited"]  # Update to credited amount
-    transaction.description = f"Wallet recharge - Invoice #{invoice_number}"
-
-    # Add credited amount (after GST) to user balance
-    current_user.balance += gst_calc["credited"]
-
-    db.commit()
-    db.refresh(current_user)
-
-    # Save payment to PaymentLog table for records/auditing
-    save_payment_log(
-        db=db,
-        event_type="payment.verified",
-        source="verify_payment",
-        razorpay_payment_id=payment_data.razorpay_payment_id,
+    result = await db.run_sync(
+        finalize_payment,
         razorpay_order_id=payment_data.razorpay_order_id,
+        razorpay_payment_id=payment_data.razorpay_payment_id,
         razorpay_signature=payment_data.razorpay_signature,
-        user=current_user,
-        gst_calc=gst_calc,
-        invoice_number=invoice_number,
-        invoice_id=invoice.id,
-        new_balance=current_user.balance,
+        user_id=current_user.id,
+        source="verify_payment",
+        description="Wallet recharge - Invoice #{invoice_number}",
         raw_data={
             "razorpay_payment_id": payment_data.razorpay_payment_id,
             "razorpay_order_id": payment_data.razorpay_order_id,
-            "amount": gst_calc,
             "timestamp": datetime.utcnow().isoformat()
         }
     )
+    if not result.created:
+        return {"status": "already_verified", "balance": result.user.balance}
+    gst_calc, invoice, current_user = result.gst_calc, result.invoice, result.user
+    invoice_number = invoice.invoice_number
+    background_tasks.add_task(prerender_invoice, invoice.id)
 
     return {
         "status": "success",
@@ -616,6 +413,17 @@ def get_invoices(
 
     return result
 
+@router.get("/invoices/bundle")
+def download_invoice_bundle(
+    date_from: Optional[date] = Query(None, description="Invoices issued on or after this date"),
+    date_to: Optional[date] = Query(None, description="Invoices issued on or before this date"),
+    format: str = Query("pdf", pattern="^(html|pdf)$", description="pdf or html files in the zip"),
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Download all your invoices for a period as one zip"""
+    return invoice_bundle_response(db, format, user_id=current_user.id, date_from=date_from, date_to=date_to)
+
 @router.get("/invoices/{invoice_id}", response_model=schemas.InvoiceResponse)
 def get_invoice(
     invoice_id: int,
@@ -660,10 +468,12 @@ def get_invoice(
 @router.get("/invoices/{invoice_id}/download")
 def download_invoice(
     invoice_id: int,
+    request: Request,
+    format: str = Query("html", pattern="^(html|pdf)$", description="html (printable) or pdf"),
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Download invoice as HTML (can be printed as PDF)"""
+    """Download invoice as HTML (can be printed as PDF) or PDF"""
     invoice = db.query(models.Invoice).filter(
         models.Invoice.id == invoice_id,
         models.Invoice.user_id == current_user.id
@@ -672,168 +482,12 @@ def download_invoice(
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
 
-    # Get company details
-    company = db.query(models.CompanyConfig).first()
-
-    if not company:
-        company_name = "TWOZERO"
-        company_legal = "MAHESH"
-        company_gst = "07ATPPM6940D1ZG"
-        company_address = "First Floor, A-784, G. D. Colony, Mayur Vihar, Phase - 3, East Delhi, Delhi, 110096"
-    else:
-        company_name = company.company_name
-        company_legal = company.legal_name
-        company_gst = company.gst_number
-        company_address = company.address
-
-    # Generate HTML invoice
-    html_content = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="UTF-8">
-        <title>Invoice {invoice.invoice_number}</title>
-        <style>
-            body {{ font-family: Arial, sans-serif; margin: 40px; color: #333; }}
-            .header {{ display: flex; justify-content: space-between; border-bottom: 2px solid #2563eb; padding-bottom: 20px; margin-bottom: 30px; }}
-            .company-name {{ font-size: 24px; font-weight: bold; color: #2563eb; }}
-            .invoice-title {{ font-size: 28px; color: #666; }}
-            .invoice-number {{ font-size: 14px; color: #666; }}
-            .section {{ margin-bottom: 30px; }}
-            .section-title {{ font-weight: bold; color: #2563eb; margin-bottom: 10px; border-bottom: 1px solid #ddd; padding-bottom: 5px; }}
-            .details-grid {{ display: grid; grid-template-columns: 1fr 1fr; gap: 20px; }}
-            .detail-item {{ margin-bottom: 8px; }}
-            .detail-label {{ color: #666; font-size: 12px; }}
-            .detail-value {{ font-weight: 500; }}
-            table {{ width: 100%; border-collapse: collapse; margin-top: 10px; }}
-            th, td {{ padding: 12px; text-align: left; border-bottom: 1px solid #ddd; }}
-            th {{ background: #f8f9fa; font-weight: 600; }}
-            .amount-row {{ font-weight: bold; }}
-            .total-row {{ background: #2563eb; color: white; }}
-            .total-row td {{ border: none; }}
-            .footer {{ margin-top: 40px; padding-top: 20px; border-top: 1px solid #ddd; font-size: 12px; color: #666; }}
-            .text-right {{ text-align: right; }}
-            @media print {{
-                body {{ margin: 20px; }}
-                .no-print {{ display: none; }}
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="header">
-            <div>
-                <div class="company-name">{company_name}</div>
-                <div style="font-size: 12px; color: #666; margin-top: 5px;">{company_legal}</div>
-                <div style="font-size: 12px; color: #666;">GSTIN: {company_gst}</div>
-                <div style="font-size: 11px; color: #888; max-width: 300px; margin-top: 5px;">{company_address}</div>
-            </div>
-            <div class="text-right">
-                <div class="invoice-title">TAX INVOICE</div>
-                <div class="invoice-number">#{invoice.invoice_number}</div>
-                <div style="font-size: 12px; color: #666; margin-top: 10px;">
-                    Date: {invoice.payment_date.strftime('%d %b %Y') if invoice.payment_date else invoice.created_at.strftime('%d %b %Y')}
-                </div>
-            </div>
-        </div>
-
-        <div class="section">
-            <div class="section-title">Bill To</div>
-            <div class="details-grid">
-                <div>
-                    <div class="detail-item">
-                        <div class="detail-label">Name</div>
-                        <div class="detail-value">{invoice.customer_company or invoice.customer_name}</div>
-                    </div>
-                    <div class="detail-item">
-                        <div class="detail-label">Email</div>
-                        <div class="detail-value">{invoice.customer_email}</div>
-                    </div>
-                </div>
-                <div>
-                    {f'<div class="detail-item"><div class="detail-label">GSTIN</div><div class="detail-value">{invoice.customer_gst}</div></div>' if invoice.customer_gst else ''}
-                    {f'<div class="detail-item"><div class="detail-label">Address</div><div class="detail-value">{invoice.customer_address}</div></div>' if invoice.customer_address else ''}
-                </div>
-            </div>
-        </div>
-
-        <div class="section">
-            <div class="section-title">Invoice Details</div>
-            <table>
-                <thead>
-                    <tr>
-                        <th>Description</th>
-                        <th>SAC Code</th>
-                        <th class="text-right">Amount</th>
-                    </tr>
-                </thead>
-                <tbody>
-                    <tr>
-                        <td>WhatsApp Messaging Service - Wallet Recharge</td>
-                        <td>998319</td>
-                        <td class="text-right">₹{invoice.subtotal / 100:.2f}</td>
-                    </tr>
-                    <tr>
-                        <td colspan="2">CGST @ 9%</td>
-                        <td class="text-right">₹{invoice.cgst_amount / 100:.2f}</td>
-                    </tr>
-                    <tr>
-                        <td colspan="2">SGST @ 9%</td>
-                        <td class="text-right">₹{invoice.sgst_amount / 100:.2f}</td>
-                    </tr>
-                    <tr class="total-row">
-                        <td colspan="2"><strong>Total Amount</strong></td>
-                        <td class="text-right"><strong>₹{invoice.total_amount / 100:.2f}</strong></td>
-                    </tr>
-                </tbody>
-            </table>
-        </div>
-
-        <div class="section">
-            <div class="section-title">Payment Details</div>
-            <div class="details-grid">
-                <div>
-                    <div class="detail-item">
-                        <div class="detail-label">Payment Method</div>
-                        <div class="detail-value">Online (Razorpay)</div>
-                    </div>
-                    <div class="detail-item">
-                        <div class="detail-label">Payment ID</div>
-                        <div class="detail-value">{invoice.razorpay_payment_id or 'N/A'}</div>
-                    </div>
-                </div>
-                <div>
-                    <div class="detail-item">
-                        <div class="detail-label">Status</div>
-                        <div class="detail-value" style="color: #16a34a; font-weight: bold;">PAID</div>
-                    </div>
-                    <div class="detail-item">
-                        <div class="detail-label">Wallet Credit</div>
-                        <div class="detail-value">₹{invoice.credited_amount / 100:.2f}</div>
-                    </div>
-                </div>
-            </div>
-        </div>
-
-        <div class="footer">
-            <p>This is a computer-generated invoice and does not require a signature.</p>
-            <p>For any queries, please contact us at support@twozero.in</p>
-        </div>
-
-        <div class="no-print" style="margin-top: 30px; text-align: center;">
-            <button onclick="window.print()" style="background: #2563eb; color: white; border: none; padding: 12px 24px; border-radius: 8px; cursor: pointer; font-size: 16px;">
-                Print / Save as PDF
-            </button>
-        </div>
-    </body>
-    </html>
-    """
-
-    from fastapi.responses import HTMLResponse
-    return HTMLResponse(content=html_content)
+    return invoice_download_response(db, invoice, format, request)
 
 # Webhook for Razorpay (optional, for reliability)
 @router.post("/webhook")
-async def razorpay_webhook(request: Request, db: Session = Depends(get_db)):
+async def razorpay_webhook(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Verify and store the event; the webhook inbox worker processes it"""
     payload = await request.body()
     signature = request.headers.get("X-Razorpay-Signature", "")
 
@@ -850,45 +504,17 @@ async def razorpay_webhook(request: Request, db: Session = Depends(get_db)):
     except:
         raise HTTPException(status_code=400, detail="Webhook verification failed")
 
-    data = await request.json()
-    event = data.get("event")
-
-    # Save webhook data to PaymentLog
-    if event == "payment.captured":
-        payment = data.get("payload", {}).get("payment", {}).get("entity", {})
-        save_payment_log(
-            db=db,
-            event_type=event,
-            source="razorpay_webhook",
-            razorpay_payment_id=payment.get("id"),
-            razorpay_order_id=payment.get("order_id"),
-            raw_data=data
-        )
-
-    if event == "payment.captured":
-        payment = data["payload"]["payment"]["entity"]
-        order_id = payment.get("order_id")
-
-        if order_id:
-            transaction = db.query(models.Transaction).filter(
-                models.Transaction.razorpay_order_id == order_id
-            ).first()
-
-            if transaction and transaction.status == "pending":
-                # Calculate GST
-                gst_calc = calculate_gst(transaction.amount)
-
-                transaction.razorpay_payment_id = payment["id"]
-                transaction.status = "completed"
-                transaction.amount = gst_calc["credited"]
-
-                user = db.query(models.User).filter(
-                    models.User.id == transaction.user_id
-                ).first()
-
-                if user:
-                    user.balance += gst_calc["credited"]
-
-                db.commit()
+    try:
+        data = json.loads(payload)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid webhook payload")
+
+    # Razorpay sends the same event id on every retry of a delivery
+    event_id = request.headers.get("X-Razorpay-Event-Id") or hashlib.sha256(payload).hexdigest()
+    stored = await db.run_sync(
+        store_event, PROVIDER_RAZORPAY, event_id, data.get("event"), payload.decode()
+    )
+    if stored:
+        notify_worker()
 
     return {"status": "ok"}
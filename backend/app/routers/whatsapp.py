@@ -9,6 +9,8 @@ This module handles:
 """
 
 from fastapi import APIRouter, Depends, HTTPException, Request, BackgroundTasks
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from typing import Optional
@@ -16,10 +18,11 @@ import httpx
 import os
 from datetime import datetime
 
-from ..database import get_db
-from ..auth import get_current_user
+from ..database import get_db, get_async_db
+from ..auth import get_current_user, get_current_user_async
 from ..models import User, Message
-from ..email_utils import check_and_send_low_balance_alert
+from ..balance_alerts import schedule_low_balance_check
+from ..metrics import provider_call
 
 router = APIRouter(prefix="/whatsapp", tags=["whatsapp"])
 
@@ -102,8 +105,8 @@ def get_oauth_url(current_user: User = Depends(get_current_user)):
 @router.post("/connect")
 async def connect_whatsapp(
     callback: OAuthCallback,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Handle the OAuth callback from Facebook.
@@ -118,15 +121,16 @@ async def connect_whatsapp(
     try:
         async with httpx.AsyncClient() as client:
             # Exchange code for access token
-            token_response = await client.get(
-                META_TOKEN_URL,
-                params={
-                    "client_id": META_APP_ID,
-                    "client_secret": META_APP_SECRET,
-                    "redirect_uri": META_REDIRECT_URI,
-                    "code": callback.code,
-                }
-            )
+            with provider_call("meta"):
+                token_response = await client.get(
+                    META_TOKEN_URL,
+                    params={
+                        "client_id": META_APP_ID,
+                        "client_secret": META_APP_SECRET,
+                        "redirect_uri": META_REDIRECT_URI,
+                        "code": callback.code,
+                    }
+                )
 
             if token_response.status_code != 200:
                 raise HTTPException(
@@ -145,19 +149,21 @@ async def connect_whatsapp(
 
             # Get WhatsApp Business Account ID
             # First, get the user's businesses
-            debug_response = await client.get(
-                f"{META_GRAPH_URL}/debug_token",
-                params={
-                    "input_token": access_token,
-                    "access_token": f"{META_APP_ID}|{META_APP_SECRET}"
-                }
-            )
+            with provider_call("meta"):
+                debug_response = await client.get(
+                    f"{META_GRAPH_URL}/debug_token",
+                    params={
+                        "input_token": access_token,
+                        "access_token": f"{META_APP_ID}|{META_APP_SECRET}"
+                    }
+                )
 
             # Get shared WhatsApp Business Accounts
-            waba_response = await client.get(
-                f"{META_GRAPH_URL}/me/businesses",
-                params={"access_token": access_token}
-            )
+            with provider_call("meta"):
+                waba_response = await client.get(
+                    f"{META_GRAPH_URL}/me/businesses",
+                    params={"access_token": access_token}
+                )
 
             businesses = waba_response.json().get("data", [])
 
@@ -172,10 +178,11 @@ async def connect_whatsapp(
                 business_id = business.get("id")
 
                 # Get WhatsApp Business Accounts for this business
-                waba_list_response = await client.get(
-                    f"{META_GRAPH_URL}/{business_id}/owned_whatsapp_business_accounts",
-                    params={"access_token": access_token}
-                )
+                with provider_call("meta"):
+                    waba_list_response = await client.get(
+                        f"{META_GRAPH_URL}/{business_id}/owned_whatsapp_business_accounts",
+                        params={"access_token": access_token}
+                    )
 
                 waba_list = waba_list_response.json().get("data", [])
 
@@ -184,10 +191,11 @@ async def connect_whatsapp(
                     business_name = business.get("name")
 
                     # Get phone numbers for this WABA
-                    phones_response = await client.get(
-                        f"{META_GRAPH_URL}/{waba_id}/phone_numbers",
-                        params={"access_token": access_token}
-                    )
+                    with provider_call("meta"):
+                        phones_response = await client.get(
+                            f"{META_GRAPH_URL}/{waba_id}/phone_numbers",
+                            params={"access_token": access_token}
+                        )
 
                     phones = phones_response.json().get("data", [])
 
@@ -213,7 +221,7 @@ async def connect_whatsapp(
             current_user.whatsapp_display_name = display_name
             current_user.whatsapp_connected_at = datetime.utcnow()
 
-            db.commit()
+            await db.commit()
 
             return ConnectionStatus(
                 connected=True,
@@ -277,7 +285,7 @@ def disconnect_whatsapp(
 
 @router.post("/test-connection")
 async def test_connection(
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user_async)
 ):
     """
     Test the WhatsApp connection by verifying the access token.
@@ -287,10 +295,11 @@ async def test_connection(
 
     try:
         async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{META_GRAPH_URL}/{current_user.whatsapp_phone_number_id}",
-                params={"access_token": current_user.whatsapp_access_token}
-            )
+            with provider_call("meta"):
+                response = await client.get(
+                    f"{META_GRAPH_URL}/{current_user.whatsapp_phone_number_id}",
+                    params={"access_token": current_user.whatsapp_access_token}
+                )
 
             if response.status_code == 200:
                 return {"success": True}
@@ -307,8 +316,8 @@ async def test_connection(
 async def send_message(
     request: SendMessageRequest,
     background_tasks: BackgroundTasks,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Send a WhatsApp message using a template.
@@ -323,7 +332,7 @@ async def send_message(
         )
 
     # Check user balance
-    message_cost = get_message_cost(db)  # Get from pricing config
+    message_cost = await db.run_sync(get_message_cost)  # Get from pricing config
 
     if current_user.balance < message_cost:
         raise HTTPException(
@@ -359,14 +368,15 @@ async def send_message(
                 ]
 
             # Send message via Meta Cloud API
-            response = await client.post(
-                f"{META_GRAPH_URL}/{current_user.whatsapp_phone_number_id}/messages",
-                headers={
-                    "Authorization": f"Bearer {current_user.whatsapp_access_token}",
-                    "Content-Type": "application/json"
-                },
-                json=payload
-            )
+            with provider_call("meta"):
+                response = await client.post(
+                    f"{META_GRAPH_URL}/{current_user.whatsapp_phone_number_id}/messages",
+                    headers={
+                        "Authorization": f"Bearer {current_user.whatsapp_access_token}",
+                        "Content-Type": "application/json"
+                    },
+                    json=payload
+                )
 
             response_data = response.json()
 
@@ -395,10 +405,10 @@ async def send_message(
                 sent_at=datetime.utcnow()
             )
             db.add(message)
-            db.commit()
+            await db.commit()
 
-            # Check for low balance and send alert in background
-            background_tasks.add_task(check_and_send_low_balance_alert, current_user)
+            # Alert in the background if the balance crossed the low threshold
+            schedule_low_balance_check(background_tasks, current_user.id)
 
             return {
                 "success": True,
@@ -419,10 +429,11 @@ async def send_message(
 async def send_bulk_messages(
     recipients: list[str],
     template_name: str,
+    background_tasks: BackgroundTasks,
     template_language: str = "en",
     template_params: Optional[list] = None,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Send bulk WhatsApp messages to multiple recipients.
@@ -433,7 +444,7 @@ async def send_bulk_messages(
             detail="WhatsApp not connected"
         )
 
-    message_cost = get_message_cost(db)
+    message_cost = await db.run_sync(get_message_cost)
     total_cost = message_cost * len(recipients)
 
     if current_user.balance < total_cost:
@@ -455,7 +466,7 @@ async def send_bulk_messages(
                 template_language=template_language,
                 template_params=template_params
             )
-            result = await send_message(request, current_user, db)
+            result = await send_message(request, background_tasks, current_user, db)
             results.append({"phone": phone, "status": "sent", "message_id": result["message_id"]})
             successful += 1
         except Exception as e:
@@ -486,7 +497,7 @@ def get_message_cost(db: Session) -> int:
 # ============ Webhooks ============
 
 @router.post("/webhook")
-async def webhook_handler(request: Request, db: Session = Depends(get_db)):
+async def webhook_handler(request: Request, db: AsyncSession = Depends(get_async_db)):
     """
     Handle incoming webhooks from Meta.
     This receives message status updates, delivery receipts, etc.
@@ -523,9 +534,9 @@ async def webhook_handler(request: Request, db: Session = Depends(get_db)):
                     status_value = status.get("status")  # sent, delivered, read, failed
 
                     # Update message status in database
-                    message = db.query(Message).filter(
-                        Message.whatsapp_message_id == message_id
-                    ).first()
+                    message = (await db.execute(
+                        select(Message).where(Message.whatsapp_message_id == message_id)
+                    )).scalars().first()
 
                     if message:
                         message.status = status_value
@@ -535,7 +546,7 @@ async def webhook_handler(request: Request, db: Session = Depends(get_db)):
                         elif status_value == "read":
                             message.read_at = datetime.utcnow()
 
-                        db.commit()
+                        await db.commit()
 
         return {"status": "ok"}
 
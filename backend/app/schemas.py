@@ -1,6 +1,6 @@
 from pydantic import BaseModel, EmailStr
 from typing import Optional, List
-from datetime import datetime
+from datetime import date, datetime
 from enum import Enum
 
 # Enums
@@ -16,6 +16,7 @@ class TransactionStatus(str, Enum):
     PENDING = "pending"
     COMPLETED = "completed"
     FAILED = "failed"
+    EXPIRED = "expired"  # Order never paid (set by reconciliation)
 
 class MessageType(str, Enum):
     TEMPLATE = "template"
@@ -308,3 +309,35 @@ class GSTCheckResponse(BaseModel):
     has_gst: bool
     gst_prompt_shown: bool
     gst_number: Optional[str] = None
+
+# Message export schemas
+class ExportFormat(str, Enum):
+    CSV = "csv"
+    JSONL = "jsonl"
+    PARQUET = "parquet"
+
+class MessageExportFilters(BaseModel):
+    user_id: Optional[int] = None  # Admin only; customers always export their own messages
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None  # Inclusive
+    status: Optional[str] = None
+    template_name: Optional[str] = None
+    include_content: bool = False
+
+class MessageExportRequest(MessageExportFilters):
+    format: ExportFormat = ExportFormat.CSV
+
+class ExportJobResponse(BaseModel):
+    id: int
+    format: str
+    status: str
+    row_count: Optional[int] = None
+    file_size: Optional[int] = None
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    completed_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
+    download_url: Optional[str] = None
+
+    class Config:
+        from_attributes = True
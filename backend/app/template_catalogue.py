@@ -0,0 +1,344 @@
+"""
+Local catalogue of Twilio Content API templates, per Twilio account.
+
+GET /customer/templates used to list /v1/Content and then fetch each
+template's ApprovalRequests one after another, on every page view. Templates
+now live in twilio_templates: the endpoint reads them from the database, and
+template_catalogue_loop refreshes every account that has a catalogue each
+TEMPLATE_REFRESH_MINUTES. The first view of an account (or ?refresh=true)
+refreshes inline.
+
+A refresh lists the account's templates, sending the stored ETag so an
+unchanged list comes back as 304 and the stored rows are reused. Approval
+requests are then fetched concurrently (at most TEMPLATE_FETCH_CONCURRENCY in
+flight) over one shared keep-alive client, and only for templates without an
+inline WhatsApp status whose date_updated changed or whose stored status is
+not final yet. Refreshes are coalesced per account: callers arriving while
+one is in flight wait for it instead of starting another.
+"""
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+import httpx
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from . import models
+from .config import settings
+from .database import SessionLocal
+from .metrics import provider_call
+
+logger = logging.getLogger(__name__)
+
+CONTENT_URL = "https://content.twilio.com/v1/Content"
+PAGE_SIZE = 500
+REQUEST_TIMEOUT = 20
+
+# Approval outcomes that no longer change on their own
+FINAL_STATUSES = {"approved", "rejected"}
+
+# Shared keep-alive client, tied to the event loop that created it
+_client: Optional[httpx.AsyncClient] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+# account_sid -> refresh in flight
+_in_flight: Dict[str, "asyncio.Task[int]"] = {}
+
+
+class CatalogueError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def _get_client() -> httpx.AsyncClient:
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client_loop is not loop:
+        concurrency = max(1, settings.TEMPLATE_FETCH_CONCURRENCY)
+        _client = httpx.AsyncClient(
+            timeout=REQUEST_TIMEOUT,
+            limits=httpx.Limits(max_connections=concurrency * 2, max_keepalive_connections=concurrency)
+        )
+        _client_loop = loop
+    return _client
+
+
+async def close_client():
+    global _client, _client_loop
+    if _client is not None:
+        await _client.aclose()
+    _client, _client_loop = None, None
+
+
+def inline_approval_status(approval_requests) -> Optional[str]:
+    if isinstance(approval_requests, dict):
+        whatsapp = approval_requests.get("whatsapp")
+        if isinstance(whatsapp, dict):
+            return whatsapp.get("status")
+    return None
+
+
+async def _list_contents(client: httpx.AsyncClient, auth: Tuple[str, str], etag: Optional[str]):
+    """(contents, etag) of every template, or (None, etag) if unchanged since etag"""
+    url = CONTENT_URL
+    params = {"PageSize": PAGE_SIZE}
+    headers = {"If-None-Match": etag} if etag else {}
+    contents = []
+    first_etag = None
+    while url:
+        with provider_call("twilio"):
+            response = await client.get(url, params=params, headers=headers, auth=auth)
+        if response.status_code == 304:
+            return None, etag
+        if response.status_code != 200:
+            raise CatalogueError(response.status_code, f"Twilio API error: {response.text}")
+        if first_etag is None:
+            first_etag = response.headers.get("ETag")
+        data = response.json()
+        contents.extend(data.get("contents", []))
+        url = (data.get("meta") or {}).get("next_page_url")
+        params, headers = None, {}  # next_page_url carries the paging parameters
+    return contents, first_etag
+
+
+async def _fetch_approval_status(client: httpx.AsyncClient, auth: Tuple[str, str], content_sid: str,
+                                 limit: asyncio.Semaphore) -> Optional[str]:
+    try:
+        async with limit:
+            with provider_call("twilio"):
+                response = await client.get(f"{CONTENT_URL}/{content_sid}/ApprovalRequests", auth=auth)
+        if response.status_code != 200:
+            return None
+        data = response.json()
+        approvals = data.get("approval_requests", [])
+        if isinstance(approvals, list):
+            for approval in approvals:
+                if isinstance(approval, dict) and approval.get("channel_type") == "whatsapp":
+                    return approval.get("status")
+        return inline_approval_status(approvals) or inline_approval_status(data)
+    except (httpx.HTTPError, ValueError) as e:
+        logger.warning(f"Could not fetch approval status of {content_sid}: {e}")
+        return None
+
+
+def _content_from_row(row: models.TwilioTemplate) -> dict:
+    return {
+        "sid": row.sid,
+        "friendly_name": row.friendly_name,
+        "language": row.language,
+        "date_created": row.date_created,
+        "date_updated": row.date_updated,
+        "types": json.loads(row.types or "{}"),
+        "variables": json.loads(row.variables or "{}"),
+        "approval_requests": json.loads(row.approval_requests or "{}"),
+    }
+
+
+def _load_stored(account_sid: str) -> Tuple[Optional[str], Dict[str, dict]]:
+    """(etag, {sid: content with approval_status}) of the stored catalogue"""
+    db = SessionLocal()
+    try:
+        sync = db.get(models.TwilioTemplateSync, account_sid)
+        stored = {}
+        for row in db.query(models.TwilioTemplate).filter(models.TwilioTemplate.account_sid == account_sid):
+            stored[row.sid] = {**_content_from_row(row), "approval_status": row.approval_status}
+        return (sync.etag if sync else None), stored
+    finally:
+        db.close()
+
+
+def _record_error(account_sid: str, error: str):
+    db = SessionLocal()
+    try:
+        sync = db.get(models.TwilioTemplateSync, account_sid)
+        if sync is None:
+            sync = models.TwilioTemplateSync(account_sid=account_sid)
+            db.add(sync)
+        sync.last_error = error
+        db.commit()
+    finally:
+        db.close()
+
+
+def _save(account_sid: str, contents: List[dict], statuses: Dict[str, Optional[str]], etag: Optional[str]) -> int:
+    """Write the refreshed catalogue; returns the template count"""
+    db = SessionLocal()
+    try:
+        rows = {
+            row.sid: row for row in
+            db.query(models.TwilioTemplate).filter(models.TwilioTemplate.account_sid == account_sid)
+        }
+        now = datetime.now(timezone.utc)
+        seen = set()
+        for content in contents:
+            sid = content.get("sid")
+            if not sid:
+                continue
+            seen.add(sid)
+            row = rows.get(sid)
+            if row is None:
+                row = models.TwilioTemplate(account_sid=account_sid, sid=sid)
+                db.add(row)
+            row.friendly_name = content.get("friendly_name")
+            row.language = content.get("language")
+            row.types = json.dumps(content.get("types") or {})
+            row.variables = json.dumps(content.get("variables") or {})
+            row.approval_requests = json.dumps(content.get("approval_requests") or {})
+            row.approval_status = statuses.get(sid)
+            row.date_created = content.get("date_created")
+            row.date_updated = content.get("date_updated")
+            row.synced_at = now
+        for sid, row in rows.items():
+            if sid not in seen:
+                db.delete(row)  # Deleted in Twilio
+
+        sync = db.get(models.TwilioTemplateSync, account_sid)
+        if sync is None:
+            sync = models.TwilioTemplateSync(account_sid=account_sid)
+            db.add(sync)
+        sync.etag = etag
+        sync.synced_at = now
+        sync.last_error = None
+        db.commit()
+        return len(seen)
+    finally:
+        db.close()
+
+
+async def _refresh(account_sid: str, auth_token: str) -> int:
+    auth = (account_sid, auth_token)
+    client = _get_client()
+    etag, stored = await run_in_threadpool(_load_stored, account_sid)
+
+    try:
+        contents, etag = await _list_contents(client, auth, etag if stored else None)
+    except (httpx.HTTPError, CatalogueError) as e:
+        await run_in_threadpool(_record_error, account_sid, str(e))
+        raise
+    if contents is None:
+        contents = list(stored.values())
+
+    statuses: Dict[str, Optional[str]] = {}
+    to_fetch = []
+    for content in contents:
+        sid = content.get("sid")
+        status = inline_approval_status(content.get("approval_requests"))
+        previous = stored.get(sid)
+        if status:
+            statuses[sid] = status
+        elif (previous and previous["date_updated"] == content.get("date_updated")
+              and previous["approval_status"] in FINAL_STATUSES):
+            statuses[sid] = previous["approval_status"]
+        elif sid:
+            to_fetch.append(sid)
+
+    if to_fetch:
+        limit = asyncio.Semaphore(max(1, settings.TEMPLATE_FETCH_CONCURRENCY))
+        fetched = await asyncio.gather(*(_fetch_approval_status(client, auth, sid, limit) for sid in to_fetch))
+        for sid, status in zip(to_fetch, fetched):
+            # Keep the last known status if the fetch failed
+            statuses[sid] = status or (stored[sid]["approval_status"] if sid in stored else None)
+
+    return await run_in_threadpool(_save, account_sid, contents, statuses, etag)
+
+
+async def refresh_catalogue(account_sid: str, auth_token: str) -> int:
+    """Bring the account's catalogue up to date with Twilio, joining a refresh already in flight"""
+    task = _in_flight.get(account_sid)
+    if task is None:
+        task = asyncio.ensure_future(_refresh(account_sid, auth_token))
+        _in_flight[account_sid] = task
+
+        def done(finished):
+            if _in_flight.get(account_sid) is finished:
+                del _in_flight[account_sid]
+        task.add_done_callback(done)
+    # Shielded so one caller going away does not cancel the refresh for the others
+    return await asyncio.shield(task)
+
+
+def _read_catalogue(db: Session, account_sid: str) -> Tuple[Optional[datetime], List[dict]]:
+    sync = db.get(models.TwilioTemplateSync, account_sid)
+    if sync is None or sync.synced_at is None:
+        return None, []
+    rows = db.query(models.TwilioTemplate).filter(
+        models.TwilioTemplate.account_sid == account_sid
+    ).order_by(models.TwilioTemplate.date_created.desc(), models.TwilioTemplate.id.desc()).all()
+
+    templates = []
+    for row in rows:
+        template = _content_from_row(row)
+        template["approval_status"] = row.approval_status
+        templates.append(template)
+    return sync.synced_at, templates
+
+
+async def get_catalogue(db: AsyncSession, account_sid: str, auth_token: str, refresh: bool = False) -> dict:
+    """The account's templates from the local catalogue, refreshing first if never synced (or asked to)"""
+    synced_at, templates = None, []
+    if not refresh:
+        synced_at, templates = await db.run_sync(_read_catalogue, account_sid)
+    if synced_at is None:
+        await refresh_catalogue(account_sid, auth_token)
+        db.expire_all()
+        synced_at, templates = await db.run_sync(_read_catalogue, account_sid)
+    return {"templates": templates, "synced_at": synced_at}
+
+
+def remove_template(db: Session, account_sid: str, content_sid: str):
+    """Drop a template deleted through the API from the catalogue right away"""
+    db.query(models.TwilioTemplate).filter(
+        models.TwilioTemplate.account_sid == account_sid,
+        models.TwilioTemplate.sid == content_sid
+    ).delete(synchronize_session=False)
+    db.commit()
+
+
+async def refresh_account(account_sid: str, auth_token: str):
+    """Background task: refresh one account's catalogue, logging failures"""
+    try:
+        await refresh_catalogue(account_sid, auth_token)
+    except Exception as e:
+        logger.error(f"Template catalogue refresh failed for {account_sid[:10]}...: {e}")
+
+
+def _catalogue_accounts() -> List[tuple]:
+    """(account_sid, auth_token) of every account with a catalogue and known credentials"""
+    db = SessionLocal()
+    try:
+        synced = {sid for (sid,) in db.query(models.TwilioTemplateSync.account_sid)}
+        credentials = {
+            sid: token for sid, token in db.query(
+                models.PhoneMapping.twilio_account_sid, models.PhoneMapping.twilio_auth_token
+            ).filter(
+                models.PhoneMapping.twilio_account_sid.isnot(None),
+                models.PhoneMapping.twilio_auth_token.isnot(None)
+            ).distinct()
+        }
+    finally:
+        db.close()
+    global_sid, global_token = os.getenv("TWILIO_ACCOUNT_SID"), os.getenv("TWILIO_AUTH_TOKEN")
+    if global_sid and global_token:
+        credentials.setdefault(global_sid, global_token)
+    return [(sid, token) for sid, token in credentials.items() if sid in synced]
+
+
+async def refresh_all_catalogues():
+    for account_sid, auth_token in await run_in_threadpool(_catalogue_accounts):
+        await refresh_account(account_sid, auth_token)
+
+
+async def template_catalogue_loop():
+    """Background task refreshing the template catalogues every TEMPLATE_REFRESH_MINUTES"""
+    interval = settings.TEMPLATE_REFRESH_MINUTES * 60
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await refresh_all_catalogues()
+        except Exception as e:
+            logger.error(f"Template catalogue refresh failed: {e}")
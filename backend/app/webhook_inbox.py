@@ -0,0 +1,189 @@
+"""
+Durable inbox for Razorpay webhooks.
+
+The webhook endpoint only verifies the signature, stores the raw payload in
+webhook_inbox (once per provider event id, so redeliveries are ignored) and
+acknowledges. A background worker (webhook_inbox_loop, started with the app)
+claims pending events and runs their handler; failures are retried with
+exponential backoff (WEBHOOK_RETRY_BASE_SECONDS * 2^n) until
+WEBHOOK_MAX_ATTEMPTS, after which the event is left as failed for an admin
+to retry.
+
+Events are claimed with a conditional UPDATE, so several app processes can
+run the worker side by side. Handlers must be idempotent (payment.captured
+goes through finalize_payment): an event whose worker died mid-way is
+reclaimed after PROCESSING_TIMEOUT and run again.
+"""
+import asyncio
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import List
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.orm import Session
+from . import models
+from .config import settings
+from .database import SessionLocal, insert_ignore
+from .invoices import prerender_invoice
+from .payment_finalization import finalize_payment
+
+logger = logging.getLogger(__name__)
+
+PROVIDER_RAZORPAY = "razorpay"
+
+# A claimed event not finished within this long is assumed abandoned
+PROCESSING_TIMEOUT = timedelta(minutes=10)
+MAX_RETRY_DELAY = timedelta(hours=6)
+
+# Set by the webhook endpoint so new events are processed without waiting a poll interval
+_wakeup = asyncio.Event()
+
+
+def store_event(db: Session, provider: str, event_id: str, event_type: str, payload: str) -> bool:
+    """Store a verified webhook; returns False for a redelivery of a stored event"""
+    result = insert_ignore(db, models.WebhookEvent, [{
+        "provider": provider,
+        "event_id": event_id,
+        "event_type": event_type,
+        "payload": payload,
+        "status": "pending",
+        "attempts": 0,
+    }], ["provider", "event_id"])
+    db.commit()
+    return result.rowcount == 1
+
+
+def notify_worker():
+    _wakeup.set()
+
+
+def _handle_payment_captured(db: Session, data: dict):
+    payment = data.get("payload", {}).get("payment", {}).get("entity", {})
+    order_id = payment.get("order_id")
+    if not order_id:
+        return
+    # No-op when the callback (or an earlier event) already completed the order
+    result = finalize_payment(
+        db,
+        razorpay_order_id=order_id,
+        razorpay_payment_id=payment.get("id"),
+        event_type="payment.captured",
+        source="razorpay_webhook",
+        description="Wallet recharge - Invoice #{invoice_number}",
+        raw_data=data
+    )
+    if result and result.created:
+        prerender_invoice(result.invoice.id)
+
+
+# Event type -> handler(db, payload); other events are stored and marked processed
+HANDLERS = {
+    "payment.captured": _handle_payment_captured,
+}
+
+
+def _claimable(now: datetime):
+    return or_(
+        and_(
+            models.WebhookEvent.status == "pending",
+            or_(models.WebhookEvent.next_attempt_at.is_(None), models.WebhookEvent.next_attempt_at <= now)
+        ),
+        and_(
+            models.WebhookEvent.status == "processing",
+            models.WebhookEvent.locked_at < now - PROCESSING_TIMEOUT
+        )
+    )
+
+
+def claim_events(db: Session, batch_size: int) -> List[int]:
+    """Mark up to batch_size due events as processing; returns the ids this worker owns"""
+    now = datetime.now(timezone.utc)
+    candidates = db.execute(
+        select(models.WebhookEvent.id)
+        .where(_claimable(now))
+        .order_by(models.WebhookEvent.id)
+        .limit(batch_size)
+    ).scalars().all()
+
+    claimed = []
+    for event_id in candidates:
+        # Another worker may have claimed it since the SELECT
+        result = db.execute(
+            update(models.WebhookEvent)
+            .where(models.WebhookEvent.id == event_id, _claimable(now))
+            .values(status="processing", locked_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount:
+            claimed.append(event_id)
+    db.commit()
+    return claimed
+
+
+def retry_delay(attempts: int) -> timedelta:
+    return min(timedelta(seconds=settings.WEBHOOK_RETRY_BASE_SECONDS * 2 ** (attempts - 1)), MAX_RETRY_DELAY)
+
+
+def process_event(event_id: int):
+    """Run the handler of one claimed event and record the outcome"""
+    db = SessionLocal()
+    try:
+        event = db.get(models.WebhookEvent, event_id)
+        attempts = (event.attempts or 0) + 1
+        try:
+            handler = HANDLERS.get(event.event_type)
+            if handler:
+                handler(db, json.loads(event.payload))
+            values = {"status": "processed", "processed_at": datetime.now(timezone.utc), "last_error": None}
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Webhook event {event_id} ({event.event_type}) failed, attempt {attempts}: {e}")
+            if attempts >= settings.WEBHOOK_MAX_ATTEMPTS:
+                values = {"status": "failed", "last_error": str(e)}
+            else:
+                values = {
+                    "status": "pending",
+                    "next_attempt_at": datetime.now(timezone.utc) + retry_delay(attempts),
+                    "last_error": str(e),
+                }
+
+        db.execute(
+            update(models.WebhookEvent)
+            .where(models.WebhookEvent.id == event_id)
+            .values(attempts=attempts, locked_at=None, **values)
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def process_pending_events(batch_size: int = 50) -> int:
+    """Process every due event; returns how many were handled"""
+    handled = 0
+    while True:
+        db = SessionLocal()
+        try:
+            claimed = claim_events(db, batch_size)
+        finally:
+            db.close()
+        if not claimed:
+            return handled
+        for event_id in claimed:
+            process_event(event_id)
+        handled += len(claimed)
+
+
+async def webhook_inbox_loop():
+    """Background task draining the inbox, on each new webhook or every WEBHOOK_POLL_SECONDS"""
+    while True:
+        _wakeup.clear()
+        try:
+            await run_in_threadpool(process_pending_events)
+        except Exception as e:
+            logger.error(f"Webhook inbox processing failed: {e}")
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=settings.WEBHOOK_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,51 @@
+"""
+Move message bodies and payment log payloads older than ARCHIVE_AFTER_DAYS
+into compressed archive files (see app/archive.py). Suitable for a nightly
+cron job. Run add_archive_columns.py once on existing databases first.
+
+On PostgreSQL the freed space is reused by new rows after autovacuum; run
+VACUUM (FULL) or pg_repack on messages / payment_logs to return it to the OS.
+
+Usage:
+    python archive_cold_data.py                       # both tables, ARCHIVE_AFTER_DAYS
+    python archive_cold_data.py --tables messages --older-than-days 180
+    python archive_cold_data.py --dry-run             # report sizes only
+"""
+import argparse
+import os
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.database import SessionLocal
+from app.archive import ARCHIVE_TARGETS, archive_rows
+from app.config import settings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive old message bodies and payment log payloads")
+    parser.add_argument("--tables", nargs="+", default=list(ARCHIVE_TARGETS), choices=list(ARCHIVE_TARGETS))
+    parser.add_argument("--older-than-days", type=int, default=settings.ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--batch-size", type=int, default=5000, help="rows per archive file")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    print(f"Archiving rows older than {args.older_than_days} days to {settings.ARCHIVE_URL}"
+          f"{' (dry run)' if args.dry_run else ''}\n")
+    db = SessionLocal()
+    try:
+        for table in args.tables:
+            report = archive_rows(db, table, args.older_than_days, args.batch_size, dry_run=args.dry_run)
+            ratio = report["bytes_raw"] / report["bytes_stored"] if report["bytes_stored"] else 0
+            print(
+                f"{table}: {report['rows']} rows in {report['files']} file(s), "
+                f"{report['bytes_raw'] / 1024:.1f} KiB -> {report['bytes_stored'] / 1024:.1f} KiB "
+                f"({ratio:.1f}x)"
+            )
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
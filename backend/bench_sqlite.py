@@ -0,0 +1,166 @@
+"""
+SQLite concurrency benchmark for the pragma profiles in app.database.
+
+Each profile gets a fresh database file. Writer threads simulate webhook
+traffic (look up a message, then update its status and insert a new one in the
+same transaction) while reader threads run dashboard-style aggregates. Reports
+write throughput, write latency and "database is locked" errors per profile.
+
+Usage:
+    python bench_sqlite.py                              # all profiles, 10s each
+    python bench_sqlite.py --profiles default performance --writers 8 --readers 4 --seconds 5
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import create_engine, event, func, insert, select, update
+from sqlalchemy.exc import OperationalError
+from app.database import Base, SQLITE_PRAGMA_PROFILES, apply_sqlite_pragmas
+from app import models
+
+SEED_MESSAGES = 20000
+SEED_USERS = 50
+
+
+def make_engine(path: str, profile: str):
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+
+    @event.listens_for(engine, "connect")
+    def _pragmas(dbapi_connection, connection_record):
+        apply_sqlite_pragmas(dbapi_connection, profile)
+
+    return engine
+
+
+def seed(engine):
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), [
+            {"email": f"bench{i}@example.com", "name": f"Bench {i}", "hashed_password": "x",
+             "role": "customer", "balance": 1000000}
+            for i in range(SEED_USERS)
+        ])
+        conn.execute(insert(models.Message), [
+            {"user_id": i % SEED_USERS + 1, "recipient_phone": "919999999999", "message_type": "template",
+             "cost": 200, "status": "sent", "whatsapp_message_id": f"SM{i}"}
+            for i in range(SEED_MESSAGES)
+        ])
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run_profile(profile: str, writers: int, readers: int, seconds: float) -> dict:
+    tmp_dir = tempfile.mkdtemp(prefix=f"bench_{profile}_")
+    try:
+        engine = make_engine(os.path.join(tmp_dir, "bench.db"), profile)
+        seed(engine)
+
+        stop = threading.Event()
+        lock = threading.Lock()
+        result = {"writes": 0, "reads": 0, "locked": 0, "write_latencies": []}
+
+        def writer(n):
+            rng = random.Random(n)
+            while not stop.is_set():
+                start = time.perf_counter()
+                try:
+                    with engine.begin() as conn:
+                        sid = f"SM{rng.randrange(SEED_MESSAGES)}"
+                        message_id = conn.execute(
+                            select(models.Message.id).where(models.Message.whatsapp_message_id == sid)
+                        ).scalar()
+                        conn.execute(
+                            update(models.Message).where(models.Message.id == message_id).values(status="delivered")
+                        )
+                        conn.execute(insert(models.Message).values(
+                            user_id=rng.randrange(SEED_USERS) + 1, recipient_phone="919999999999",
+                            message_type="session", cost=100, status="received"
+                        ))
+                    elapsed = time.perf_counter() - start
+                    with lock:
+                        result["writes"] += 1
+                        result["write_latencies"].append(elapsed)
+                except OperationalError as e:
+                    if "locked" not in str(e) and "busy" not in str(e):
+                        raise
+                    with lock:
+                        result["locked"] += 1
+
+        def reader(n):
+            rng = random.Random(1000 + n)
+            while not stop.is_set():
+                try:
+                    with engine.connect() as conn:
+                        conn.execute(
+                            select(func.count(models.Message.id), func.sum(models.Message.cost))
+                            .where(models.Message.user_id == rng.randrange(SEED_USERS) + 1)
+                        ).one()
+                    with lock:
+                        result["reads"] += 1
+                except OperationalError as e:
+                    if "locked" not in str(e) and "busy" not in str(e):
+                        raise
+                    with lock:
+                        result["locked"] += 1
+
+        threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+        threads += [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+        for t in threads:
+            t.start()
+        time.sleep(seconds)
+        stop.set()
+        for t in threads:
+            t.join()
+        engine.dispose()
+
+        latencies = result["write_latencies"]
+        return {
+            "profile": profile,
+            "writes_per_sec": result["writes"] / seconds,
+            "reads_per_sec": result["reads"] / seconds,
+            "write_p50_ms": percentile(latencies, 50) * 1000,
+            "write_p95_ms": percentile(latencies, 95) * 1000,
+            "write_max_ms": max(latencies, default=0) * 1000,
+            "locked_errors": result["locked"],
+        }
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SQLite pragma profiles under concurrent load")
+    parser.add_argument("--profiles", nargs="+", default=list(SQLITE_PRAGMA_PROFILES),
+                        choices=list(SQLITE_PRAGMA_PROFILES))
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+
+    print(f"{args.writers} writers, {args.readers} readers, {args.seconds:g}s per profile\n")
+    header = f"{'profile':<12} {'writes/s':>9} {'reads/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'locked':>7}"
+    print(header)
+    print("-" * len(header))
+    for profile in args.profiles:
+        r = run_profile(profile, args.writers, args.readers, args.seconds)
+        print(
+            f"{r['profile']:<12} {r['writes_per_sec']:>9.1f} {r['reads_per_sec']:>9.1f} "
+            f"{r['write_p50_ms']:>8.2f} {r['write_p95_ms']:>8.2f} {r['write_max_ms']:>8.1f} {r['locked_errors']:>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
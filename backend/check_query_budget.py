@@ -0,0 +1,139 @@
+"""
+Query budget check for admin listing endpoints.
+
+Seeds a throwaway SQLite database, calls each listing endpoint with a small and
+a large data set and counts the SQL statements issued per request. Fails if a
+listing exceeds its budget or if its statement count grows with the number of
+rows (an N+1 query pattern).
+
+Usage: python check_query_budget.py
+Exits with status 1 on failure, so it can run in CI.
+"""
+import os
+import sys
+import tempfile
+
+# Always run against a throwaway database, never the configured one
+_tmp_dir = tempfile.mkdtemp(prefix="query_budget_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp_dir, 'budget.db')}"
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from contextlib import contextmanager
+from sqlalchemy import event
+from fastapi.testclient import TestClient
+from app.main import app
+from app.database import engine, SessionLocal
+from app.auth import create_access_token
+from app.config import settings
+from app import models
+
+# Endpoint -> maximum SQL statements per request (including authentication)
+QUERY_BUDGETS = {
+    "/admin/phone-mappings": 2,
+    "/admin/pending-payments": 2,
+    "/admin/public-customers?limit=100&exact_total=true": 4,
+    "/admin/public-payments?limit=100&exact_total=true": 3,
+    "/admin/payment-logs?limit=100&exact_total=true": 3,
+    "/admin/messages?limit=100": 2,
+    "/admin/transactions?limit=100": 2,
+    "/admin/customers?limit=100": 2,
+}
+
+# Row counts used to detect statement counts that grow with the data
+SMALL, LARGE = 3, 30
+
+
+@contextmanager
+def count_queries():
+    """Count SQL statements executed on the engine inside the block"""
+    counter = {"count": 0}
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        counter["count"] += 1
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def seed(rows: int):
+    """Add `rows` customers, each with a mapping, pending payment, message and logs"""
+    db = SessionLocal()
+    try:
+        start = db.query(models.User).count()
+        for i in range(start, start + rows):
+            user = models.User(
+                email=f"budget{i}@example.com",
+                name=f"Budget {i}",
+                hashed_password="x",
+                role="customer",
+                balance=10000
+            )
+            db.add(user)
+            db.flush()
+
+            db.add(models.PhoneMapping(phone_number=f"+9190000{i:05d}", user_id=user.id))
+            db.add(models.Transaction(
+                user_id=user.id, amount=11800, type="credit", status="pending",
+                razorpay_order_id=f"order_budget_{i}"
+            ))
+            db.add(models.Message(
+                user_id=user.id, recipient_phone="919999999999",
+                message_type="template", cost=200, status="sent"
+            ))
+            db.add(models.PaymentLog(
+                razorpay_payment_id=f"pay_budget_{i}", razorpay_order_id=f"order_budget_{i}",
+                user_id=user.id
+            ))
+            db.add(models.PublicCustomer(phone=f"90000{i:05d}", name=f"Portal {i}", user_id=user.id))
+            db.add(models.PublicPayment(phone=f"90000{i:05d}", amount=11800, user_id=user.id))
+        db.commit()
+    finally:
+        db.close()
+
+
+def measure(client: TestClient, headers: dict) -> dict:
+    counts = {}
+    for path in QUERY_BUDGETS:
+        with count_queries() as counter:
+            response = client.get(path, headers=headers)
+        if response.status_code != 200:
+            raise RuntimeError(f"{path} returned {response.status_code}: {response.text}")
+        counts[path] = counter["count"]
+    return counts
+
+
+def main():
+    failures = []
+
+    with TestClient(app) as client:
+        token = create_access_token(data={"sub": settings.ADMIN_EMAIL})
+        headers = {"Authorization": f"Bearer {token}"}
+
+        seed(SMALL)
+        small = measure(client, headers)
+        seed(LARGE - SMALL)
+        large = measure(client, headers)
+
+    for path, budget in QUERY_BUDGETS.items():
+        status = "ok"
+        if large[path] > budget:
+            status = "OVER BUDGET"
+            failures.append(path)
+        elif large[path] != small[path]:
+            status = "GROWS WITH ROWS"
+            failures.append(path)
+        print(f"{status:>16}  {path}: {small[path]} -> {large[path]} statements (budget {budget})")
+
+    if failures:
+        print(f"\n{len(failures)} endpoint(s) failed the query budget")
+        sys.exit(1)
+    print("\nAll listings within query budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,7 @@ sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from app.models import Message, MessageStatus, MessageType, Base
 from app.database import engine, SessionLocal
+from app import counters  # registers the tenant counter flush hook
 
 def parse_phone(whatsapp_str):
     """Extract phone number from whatsapp:+91xxxxxxxxxx format"""
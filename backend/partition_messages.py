@@ -0,0 +1,212 @@
+"""
+Convert an existing (unpartitioned) PostgreSQL messages table into the monthly
+partitioned layout from app/partitioning.py without taking the app offline.
+
+Steps:
+  1. A trigger on messages starts logging the id of every inserted, updated or
+     deleted row into messages_partition_changes.
+  2. messages_partitioned is created with partitions from the oldest message's
+     month onwards, and existing rows are copied in id-range batches.
+  3. Logged changes are replayed (delete + re-copy by id) until the backlog
+     is small.
+  4. Cut-over in one short transaction: lock messages, replay the rest, drop
+     the transactions.message_id foreign key, swap the table names, move the
+     partition, index and sequence names over. The old table is kept as
+     messages_old.
+
+The copy can be interrupted and re-run; it resumes after the highest copied id.
+On SQLite there is nothing to do.
+
+Usage:
+    python partition_messages.py                          # migrate, keep messages_old
+    python partition_messages.py --batch-size 10000 --sleep 0.1
+    python partition_messages.py --drop-old               # drop messages_old once verified
+"""
+import argparse
+import os
+import sys
+import time
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import text
+from app.database import engine, Base
+from app.partitioning import MESSAGES_TABLE, create_partitioned_messages, is_partitioned
+from app import models  # noqa: F401 - registers the tables on Base.metadata
+
+STAGING = "messages_partitioned"
+OLD = "messages_old"
+CHANGES = "messages_partition_changes"
+CAPTURE = "messages_partition_capture"
+INDEX_SUFFIX = "_p"
+
+COLUMNS = ", ".join(c.name for c in Base.metadata.tables[MESSAGES_TABLE].columns)
+# created_at becomes part of the primary key and must not be NULL
+SELECT_COLUMNS = COLUMNS.replace("created_at", "COALESCE(created_at, updated_at, now())")
+
+
+def table_exists(conn, name: str) -> bool:
+    return conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is not None
+
+
+def start_change_capture(conn):
+    conn.exec_driver_sql(f"CREATE TABLE IF NOT EXISTS {CHANGES} (id integer PRIMARY KEY)")
+    conn.exec_driver_sql(f"""
+        CREATE OR REPLACE FUNCTION {CAPTURE}() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                INSERT INTO {CHANGES} (id) VALUES (OLD.id) ON CONFLICT DO NOTHING;
+            ELSE
+                INSERT INTO {CHANGES} (id) VALUES (NEW.id) ON CONFLICT DO NOTHING;
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS {CAPTURE} ON {MESSAGES_TABLE}")
+    # Waits for in-flight writes, so every row committed later is either
+    # visible to the bulk copy or logged
+    conn.exec_driver_sql(
+        f"CREATE TRIGGER {CAPTURE} AFTER INSERT OR UPDATE OR DELETE ON {MESSAGES_TABLE} "
+        f"FOR EACH ROW EXECUTE FUNCTION {CAPTURE}()"
+    )
+
+
+def copy_existing(batch_size: int, pause: float) -> int:
+    """Copy rows up to the id high-water mark in batches; later rows arrive through the change log"""
+    with engine.connect() as conn:
+        high = conn.execute(text(f"SELECT COALESCE(MAX(id), 0) FROM {MESSAGES_TABLE}")).scalar()
+        last = conn.execute(text(f"SELECT COALESCE(MAX(id), 0) FROM {STAGING}")).scalar()
+
+    copied = 0
+    while last < high:
+        upper = min(last + batch_size, high)
+        with engine.begin() as conn:
+            copied += conn.execute(text(
+                f"INSERT INTO {STAGING} ({COLUMNS}) "
+                f"SELECT {SELECT_COLUMNS} FROM {MESSAGES_TABLE} WHERE id > :last AND id <= :upper"
+            ), {"last": last, "upper": upper}).rowcount
+        last = upper
+        print(f"  copied up to id {last} / {high} ({copied} rows)")
+        if pause:
+            time.sleep(pause)
+    return copied
+
+
+def replay_changes(conn, batch_size: int) -> int:
+    """Re-copy one batch of logged ids from messages; returns how many were replayed"""
+    ids = conn.execute(text(
+        f"DELETE FROM {CHANGES} WHERE id IN (SELECT id FROM {CHANGES} ORDER BY id LIMIT :n) RETURNING id"
+    ), {"n": batch_size}).scalars().all()
+    if ids:
+        conn.execute(text(f"DELETE FROM {STAGING} WHERE id = ANY(:ids)"), {"ids": ids})
+        conn.execute(text(
+            f"INSERT INTO {STAGING} ({COLUMNS}) "
+            f"SELECT {SELECT_COLUMNS} FROM {MESSAGES_TABLE} WHERE id = ANY(:ids)"
+        ), {"ids": ids})
+    return len(ids)
+
+
+def cut_over(batch_size: int, lock_timeout: str):
+    index_names = [ix.name for ix in Base.metadata.tables[MESSAGES_TABLE].indexes]
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f"SET LOCAL lock_timeout = '{lock_timeout}'")
+        conn.exec_driver_sql(f"LOCK TABLE {MESSAGES_TABLE} IN ACCESS EXCLUSIVE MODE")
+        while replay_changes(conn, batch_size):
+            pass
+
+        conn.exec_driver_sql(f"DROP TRIGGER {CAPTURE} ON {MESSAGES_TABLE}")
+        conn.exec_driver_sql(f"DROP FUNCTION {CAPTURE}()")
+        conn.exec_driver_sql(f"DROP TABLE {CHANGES}")
+        # transactions.message_id cannot reference a partitioned messages.id
+        conn.exec_driver_sql("ALTER TABLE transactions DROP CONSTRAINT IF EXISTS transactions_message_id_fkey")
+
+        conn.exec_driver_sql(f"ALTER TABLE {MESSAGES_TABLE} RENAME TO {OLD}")
+        conn.exec_driver_sql(f"ALTER TABLE {OLD} RENAME CONSTRAINT messages_pkey TO {OLD}_pkey")
+        for name in index_names:
+            conn.exec_driver_sql(f"ALTER INDEX IF EXISTS {name} RENAME TO {name}_old")
+
+        partitions = conn.execute(
+            text("SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = to_regclass(:table)"),
+            {"table": STAGING}
+        ).scalars().all()
+        for partition in partitions:
+            # messages_partitioned_y2026m01 -> messages_y2026m01
+            conn.exec_driver_sql(
+                f"ALTER TABLE {partition} RENAME TO {MESSAGES_TABLE}{partition[len(STAGING):]}"
+            )
+        conn.exec_driver_sql(f"ALTER TABLE {STAGING} RENAME TO {MESSAGES_TABLE}")
+        conn.exec_driver_sql(f"ALTER TABLE {MESSAGES_TABLE} RENAME CONSTRAINT {STAGING}_pkey TO messages_pkey")
+        for name in index_names:
+            conn.exec_driver_sql(f"ALTER INDEX {name}{INDEX_SUFFIX} RENAME TO {name}")
+
+        # Hand the id sequence to the new table so dropping messages_old keeps it
+        conn.exec_driver_sql(f"ALTER TABLE {OLD} ALTER COLUMN id DROP DEFAULT")
+        conn.exec_driver_sql(f"ALTER SEQUENCE messages_id_seq OWNED BY {MESSAGES_TABLE}.id")
+        conn.exec_driver_sql(
+            f"SELECT setval('messages_id_seq', GREATEST((SELECT MAX(id) FROM {MESSAGES_TABLE}), "
+            f"(SELECT last_value FROM messages_id_seq)))"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Partition the messages table online (PostgreSQL)")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--sleep", type=float, default=0.05, help="pause between copy batches (seconds)")
+    parser.add_argument("--lock-timeout", default="10s", help="give up the cut-over if the lock is not granted in time")
+    parser.add_argument("--drop-old", action="store_true", help=f"drop {OLD} left by a previous run")
+    args = parser.parse_args()
+
+    if engine.dialect.name != "postgresql":
+        print("SQLite database: messages is not partitioned, nothing to do.")
+        return
+
+    with engine.connect() as conn:
+        already_partitioned = is_partitioned(conn)
+        old_exists = table_exists(conn, OLD)
+
+    if args.drop_old:
+        if not already_partitioned or not old_exists:
+            print(f"Nothing to drop ({OLD} missing or messages not partitioned yet).")
+            return
+        with engine.begin() as conn:
+            conn.exec_driver_sql(f"DROP TABLE {OLD}")
+        print(f"Dropped {OLD}.")
+        return
+
+    if already_partitioned:
+        print("messages is already partitioned.")
+        return
+    if old_exists:
+        print(f"{OLD} exists from an earlier migration; drop or rename it first.")
+        sys.exit(1)
+
+    with engine.begin() as conn:
+        start_change_capture(conn)
+        if not table_exists(conn, STAGING):
+            oldest = conn.execute(text(f"SELECT MIN(created_at) FROM {MESSAGES_TABLE}")).scalar()
+            created = create_partitioned_messages(
+                conn, STAGING, first=oldest, index_suffix=INDEX_SUFFIX, id_sequence="messages_id_seq"
+            )
+            print(f"Created {STAGING} with {len(created)} monthly partitions")
+
+    print("Copying existing messages...")
+    copied = copy_existing(args.batch_size, args.sleep)
+    print(f"Copied {copied} rows")
+
+    print("Replaying changes made during the copy...")
+    while True:
+        with engine.begin() as conn:
+            replayed = replay_changes(conn, args.batch_size)
+        if replayed < args.batch_size:
+            break
+
+    print("Swapping tables...")
+    cut_over(args.batch_size, args.lock_timeout)
+    print(f"\nDone! messages is partitioned; the previous table is kept as {OLD}.")
+    print("Run 'python partition_messages.py --drop-old' once the app is verified.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Reconcile the materialised dashboard counters (tenant_counters) against the
+messages and transactions tables. Suitable for a nightly cron job.
+Usage: python reconcile_counters.py [--fix]
+Exits with status 1 if drift was found and not fixed.
+"""
+import sys
+import os
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.database import engine, SessionLocal, Base
+from app.counters import reconcile_counters
+
+
+def main():
+    fix = "--fix" in sys.argv[1:]
+    Base.metadata.create_all(bind=engine)
+
+    db = SessionLocal()
+    try:
+        report = reconcile_counters(db, fix=fix)
+    finally:
+        db.close()
+
+    print(f"Checked {report['tenants_checked']} tenant counter(s)")
+    for item in report["drift"]:
+        print(
+            f"  tenant {item['tenant_id']}: {item['field']} "
+            f"counter={item['counter']} actual={item['actual']}"
+        )
+
+    if not report["drift"]:
+        print("No drift detected")
+    elif report["fixed"]:
+        print(f"Fixed {report['drift_count']} drifted value(s)")
+    else:
+        print(f"Found {report['drift_count']} drifted value(s). Run with --fix to repair.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
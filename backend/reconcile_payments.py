@@ -0,0 +1,55 @@
+"""
+Reconcile pending Razorpay orders in bulk (see app/reconciliation.py):
+captured payments are credited, unpaid orders past RECONCILE_EXPIRE_HOURS are
+expired. The app also runs this every RECONCILE_INTERVAL_MINUTES.
+
+Usage:
+    python reconcile_payments.py                      # last RECONCILE_WINDOW_HOURS
+    python reconcile_payments.py --window-hours 168 --expire-after-hours 48
+    python reconcile_payments.py --dry-run            # report only, change nothing
+    python reconcile_payments.py --json               # full report as JSON
+"""
+import argparse
+import json
+import os
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.config import settings
+from app.reconciliation import reconcile_payments
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconcile pending Razorpay orders")
+    parser.add_argument("--window-hours", type=float, default=settings.RECONCILE_WINDOW_HOURS)
+    parser.add_argument("--expire-after-hours", type=float, default=settings.RECONCILE_EXPIRE_HOURS)
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--json", action="store_true", help="print the full report as JSON")
+    args = parser.parse_args()
+
+    report = reconcile_payments(args.window_hours, args.expire_after_hours, dry_run=args.dry_run)
+    if args.json:
+        print(json.dumps(report, indent=2, default=str))
+        return
+
+    print(f"Window: {report['window_start']} .. {report['window_end']}{' (dry run)' if args.dry_run else ''}")
+    print(f"Pending orders: {report['pending_orders']}, Razorpay payments scanned: {report['razorpay_payments']}")
+    for item in report["completed"]:
+        print(f"  completed {item['order_id']} -> {item.get('invoice_number', item['outcome'])}")
+    for order_id in report["authorized"]:
+        print(f"  authorized, not captured: {order_id}")
+    for order_id in report["expired"]:
+        print(f"  expired {order_id}")
+    for item in report["errors"]:
+        print(f"  ERROR {item['order_id']}: {item['error']}")
+    print(f"\nCompleted {len(report['completed'])}, already completed {report['already_completed']}, "
+          f"expired {len(report['expired'])}, still pending {report['still_pending']}, "
+          f"errors {len(report['errors'])} in {report['duration_seconds']}s")
+    if report["errors"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
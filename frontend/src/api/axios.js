@@ -5,6 +5,9 @@ const API_URL = import.meta.env.VITE_API_URL || 'https://api.akashvanni.com';
 
 const api = axios.create({
   baseURL: API_URL,
+  // Sends the API's read-your-writes cookie, so reads right after a change
+  // are not served from a lagging read replica
+  withCredentials: true,
   headers: {
     'Content-Type': 'application/json',
   },
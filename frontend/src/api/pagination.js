@@ -0,0 +1,16 @@
+import api from './axios';
+
+// Fetch one page of a cursor-paginated listing.
+// List endpoints (e.g. /customer/messages) return the next cursor in the
+// X-Next-Cursor header; object responses (e.g. /admin/payment-logs) carry it
+// as `next_cursor`. `nextCursor` is null on the last page.
+export async function fetchPage(url, { cursor = null, params = {} } = {}) {
+  const res = await api.get(url, {
+    params: cursor ? { ...params, cursor } : params,
+  });
+
+  if (Array.isArray(res.data)) {
+    return { items: res.data, nextCursor: res.headers['x-next-cursor'] || null };
+  }
+  return { data: res.data, nextCursor: res.data.next_cursor || null };
+}
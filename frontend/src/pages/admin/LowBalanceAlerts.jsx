@@ -48,13 +48,9 @@ export default function LowBalanceAlerts() {
       setSending(true);
       const response = await api.post('/admin/send-low-balance-alerts', userIds);
 
-      if (response.data.sent > 0) {
-        toast.success(`Sent ${response.data.sent} alert(s) successfully`);
-      }
-      if (response.data.failed > 0) {
-        toast.error(`${response.data.failed} alert(s) failed to send`);
-      }
-      if (response.data.sent === 0 && response.data.failed === 0) {
+      if (response.data.queued > 0) {
+        toast.success(`Queued ${response.data.queued} alert(s) for sending`);
+      } else {
         toast.info('No alerts to send');
       }
 